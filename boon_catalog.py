@@ -0,0 +1,133 @@
+''' SQLite-backed catalog of the boons seen in saves, used as templates by add_boon '''
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from models.lazy_lua_table import encode_lazy_value
+from models.luabins_stream import read_value
+
+BOON_CATALOG_FILE = Path("boon_catalog.db")
+# Catalog of earlier versions, imported once when the SQLite catalog is created
+LEGACY_BOON_LIST_FILE = Path("boon_list.json")
+
+# SQLite's default limit on the number of parameters of one statement is 999
+_MAX_QUERY_PARAMETERS = 900
+
+
+def _from_legacy_json(value: Any) -> Any:
+    # json.dump turned the Lua number keys of boon_list.json into strings such as "1" or "1.0"
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            try:
+                key = float(key)
+            except ValueError:
+                pass
+            result[key] = _from_legacy_json(item)
+        return result
+    return value
+
+
+def _encode_template(boon_data: Any) -> bytes:
+    # Templates are stored as luabins, which keeps Lua types and number keys as they are
+    out = bytearray()
+    encode_lazy_value(boon_data, out)
+    return bytes(out)
+
+
+class BoonCatalog:
+    """
+    One row per boon name, holding the boon's data as first seen in a save.
+
+    The database runs in WAL mode, so several processes (e.g. `show boons` on different
+    profiles) can read while one of them records new boons. Only boons that are not in the
+    catalog yet are written.
+    """
+
+    def __init__(self, path=BOON_CATALOG_FILE):
+        self.path = Path(path)
+        is_new = not self.path.exists()
+        self.connection = sqlite3.connect(str(self.path), timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS boons ("
+            " name TEXT PRIMARY KEY,"
+            " template BLOB NOT NULL,"
+            " first_seen TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+        if is_new and LEGACY_BOON_LIST_FILE.exists():
+            self.import_legacy_boon_list(LEGACY_BOON_LIST_FILE)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'BoonCatalog':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def known_names(self, names: Iterable[str]) -> set:
+        """Returns the subset of names that are already in the catalog."""
+        names = list(names)
+        known = set()
+        for start in range(0, len(names), _MAX_QUERY_PARAMETERS):
+            batch = names[start:start + _MAX_QUERY_PARAMETERS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(f"SELECT name FROM boons WHERE name IN ({placeholders})", batch)
+            known.update(name for (name,) in rows)
+        return known
+
+    def add_unseen(self, boons: Dict[str, Any]) -> List[str]:
+        """
+        Records the boons of a save that are not in the catalog yet.
+
+        :return: The names that were added
+        """
+        known = self.known_names(boons)
+        unseen = [name for name in boons if name not in known]
+        if not unseen:
+            return []
+
+        first_seen = datetime.utcnow().isoformat()
+        added = []
+        with self.connection:
+            for name in unseen:
+                # OR IGNORE: another process may have recorded the same boon in the meantime
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO boons (name, template, first_seen) VALUES (?, ?, ?)",
+                    (name, _encode_template(boons[name]), first_seen)
+                )
+                if cursor.rowcount:
+                    added.append(name)
+        return added
+
+    def names(self, prefix: str = "") -> List[str]:
+        """Returns the boon names starting with prefix, sorted."""
+        if not prefix:
+            rows = self.connection.execute("SELECT name FROM boons ORDER BY name")
+        else:
+            # A range on the primary key rather than LIKE, so the lookup uses the index
+            rows = self.connection.execute(
+                "SELECT name FROM boons WHERE name >= ? AND name < ? ORDER BY name",
+                (prefix, prefix + "\U0010ffff")
+            )
+        return [name for (name,) in rows]
+
+    def template(self, name: str) -> Optional[Dict[Any, Any]]:
+        """Returns a fresh copy of the stored data of a boon, or None if it is not in the catalog."""
+        row = self.connection.execute("SELECT template FROM boons WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return read_value(memoryview(row[0]), 0)[0]
+
+    def import_legacy_boon_list(self, path) -> int:
+        """Imports the boons of a boon_list.json file, returning how many were new."""
+        with open(path, "r") as f:
+            boon_list = json.load(f)
+        return len(self.add_unseen({name: _from_legacy_json(data) for name, data in boon_list.items()}))
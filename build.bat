@@ -1 +1,3 @@
-pyinstaller --noconsole --onefile --add-data pluto.ui;. main.py
+REM --onedir rather than --onefile: a one-file build unpacks itself to a temporary directory on
+REM every run, which costs more than the whole CLI startup when scripts call it many times.
+pyinstaller --onedir --name pluto --add-data data\gamedata.json;data pluto_cli.py
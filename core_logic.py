@@ -1,11 +1,21 @@
 import csv
+import hashlib
 from models.save_file import HadesSaveFile
-import gamedata # Used by export_runs_to_csv and potentially others
+from models.raw_save_file import RawSaveFile
+from models.lua_state import LuaState, decompress_lua_state_bytes
+from models.lazy_lua_table import LazyLuaTable, iter_lazy_state, resolve_lazy_tables
+from snapshot_store import SnapshotStore
+from lua_query import compile_query, parse_literal
+from structured_log import get_logger
+import gamedata # Used by export_runs and potentially others
 import copy
+import os
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 import json
 
+logger = get_logger("core")
+
 # Helper functions (moved from main.py)
 def _easy_mode_level_from_damage_reduction(damage_reduction: int) -> int:
     # Make sure the damage reduction is between 20-80 as that is what the game uses, out of range might not be safe
@@ -24,20 +34,67 @@ def load_save_file(file_path: str) -> HadesSaveFile:
     """Loads a Hades save file and returns the HadesSaveFile object."""
     # Actual implementation will call HadesSaveFile.from_file(file_path)
     # and handle potential errors.
-    print(f"Core logic: Loading {file_path}")
+    logger.info("Loading save", extra={"fields": {"path": file_path}})
     save_file = HadesSaveFile.from_file(file_path)
     return save_file
 
-def save_game_file(save_file_object: HadesSaveFile, target_path: str):
-    """Saves the HadesSaveFile object to the target path."""
+def save_game_file(save_file_object: HadesSaveFile, target_path: str, snapshot: bool = True, journal: bool = True):
+    """
+    Saves the HadesSaveFile object to the target path.
+
+    If a save already exists at the target path and snapshot is set, it is first recorded in the
+    snapshot store next to it, so the overwritten revision can be restored later. With journal
+    set, the changes are also appended to the save's journal, so they can be undone.
+    """
     # Actual implementation will call save_file_object.to_file(target_path)
-    print(f"Core logic: Saving to {target_path}")
+    before = read_for_journal(target_path) if journal else None
+    if snapshot and os.path.exists(target_path):
+        take_snapshot(target_path)
+    logger.info("Saving", extra={"fields": {"path": target_path}})
     save_file_object.to_file(target_path)
+    if before is not None:
+        journal_write(target_path, before)
+
+def take_snapshot(target_path: str, store: Optional[SnapshotStore] = None):
+    """
+    Records the save at target_path in a snapshot store (by default the one next to it). Returns
+    the snapshot's manifest, or warns and returns None if the file cannot be read as a save.
+    """
+    store = store or SnapshotStore.for_save(target_path)
+    try:
+        manifest = store.create(target_path)
+    except Exception as e:
+        logger.warning(f"Not taking a snapshot of '{target_path}', it could not be read: {e}")
+        return None
+    logger.info("Snapshot of the previous save taken", extra={"fields": {
+        "path": target_path, "snapshot": manifest["id"], "new_bytes": manifest["new_bytes"], "store": store.root
+    }})
+    return manifest
+
+def read_for_journal(target_path: str):
+    """Reads the save about to be overwritten at target_path, or returns None if there is none (or it cannot be read)."""
+    if not os.path.exists(target_path):
+        return None
+    try:
+        return RawSaveFile.from_file(target_path)
+    except Exception as e:
+        logger.warning(f"Not journaling the changes to '{target_path}', it could not be read: {e}")
+        return None
+
+def journal_write(target_path: str, before: RawSaveFile):
+    """Records the changes from before to the save now at target_path in its journal."""
+    from save_journal import SaveJournal
+    journal = SaveJournal.for_save(target_path)
+    entry = journal.record(before, RawSaveFile.from_file(target_path))
+    if entry is not None:
+        logger.info("Changes journaled", extra={"fields": {
+            "path": target_path, "entry": entry["number"], "changes": entry["changes"], "bytes": entry["size"]
+        }})
 
 def get_save_info(save_file_object: HadesSaveFile) -> dict:
     """Extracts general save information."""
     # Extracts info like version, runs, location, god/hell mode status
-    print("Core logic: Getting save info")
+    logger.info("Getting save info")
     return {
         "version": save_file_object.version,
         "runs": save_file_object.runs,
@@ -50,7 +107,7 @@ def get_save_info(save_file_object: HadesSaveFile) -> dict:
 def get_currencies(save_file_object: HadesSaveFile) -> dict:
     """Extracts currency data from the save file object."""
     # Extracts Darkness, Gems, Diamonds etc. from save_file_object.lua_state
-    print("Core logic: Getting currencies")
+    logger.info("Getting currencies")
     ls = save_file_object.lua_state
     return {
         "darkness": ls.darkness,
@@ -65,31 +122,9 @@ def get_currencies(save_file_object: HadesSaveFile) -> dict:
     }
 
 
-BOON_LIST_FILE = Path("boon_list.json")    
-
-def load_boon_list() -> Dict:
-    if BOON_LIST_FILE.exists():
-        with open(BOON_LIST_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_boon_list(boon_list: Dict):
-    with open(BOON_LIST_FILE, "w") as f:
-        json.dump(boon_list, f, indent=4)
-
-def deep_copy_dict(obj):
-    # Recursive deep copy without using copy.deepcopy
-    if isinstance(obj, dict):
-        return {k: deep_copy_dict(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [deep_copy_dict(item) for item in obj]
-    else:
-        return obj
-
 def get_boons(save_file_object) -> Dict[str, str]:
-    print("Core logic: Getting Boons")
+    logger.info("Getting boons")
     boons = save_file_object.lua_state.boons  # dict of boon_name -> { "1.0": {...} }
-    boon_list = load_boon_list()
     result = {}
 
     for boon_name, boon_data in boons.items():
@@ -99,11 +134,11 @@ def get_boons(save_file_object) -> Dict[str, str]:
         level = data.get("OldLevel")
         result[boon_name] = f"Lv {int(level)}" if level is not None else "Lv Max"
 
-        if boon_name not in boon_list:
-            boon_list[boon_name] = deep_copy_dict(boon_data)
-            print(f"New boon discovered and added to boon_list: {boon_name}")
+    from boon_catalog import BoonCatalog
 
-    save_boon_list(boon_list)
+    with BoonCatalog() as catalog:
+        for boon_name in catalog.add_unseen(boons):
+            logger.info("New boon added to the boon catalog", extra={"fields": {"boon": boon_name}})
     return result
 
 
@@ -132,82 +167,147 @@ def remove_boon(save_file_object, boon_name: str) -> None:
         print(f"Boon '{boon_name}' not found; nothing to remove")
 
 def add_boon(save_file_object):
-    boon_list = load_boon_list()
-    if not boon_list:
-        print("No boons in boon_list to add.")
-        return
+    from boon_catalog import BoonCatalog
 
-    print("Available boons:")
-    boon_names = list(boon_list.keys())
-    for i, name in enumerate(boon_names, 1):
-        print(f"{i}. {name}")
+    with BoonCatalog() as catalog:
+        prefix = input("Enter a boon name or the start of one (leave blank to list all): ").strip()
+        boon_names = catalog.names(prefix)
+        if not boon_names:
+            print("No boons in the boon catalog to add." if not prefix else f"No boons in the boon catalog start with '{prefix}'.")
+            return
 
-    try:
-        choice = int(input("Enter the number of the boon to add: ")) - 1
-        if 0 <= choice < len(boon_names):
+        if len(boon_names) == 1:
+            boon_name = boon_names[0]
+        else:
+            print("Available boons:")
+            for i, name in enumerate(boon_names, 1):
+                print(f"{i}. {name}")
+            try:
+                choice = int(input("Enter the number of the boon to add: ")) - 1
+            except ValueError:
+                print("Please enter a valid number.")
+                return
+            if not 0 <= choice < len(boon_names):
+                print("Invalid selection.")
+                return
             boon_name = boon_names[choice]
-            base_data = deep_copy_dict(boon_list[boon_name])
-
-            # The base_data is expected to be in the form {1: { ... }}
-            if 1 not in base_data:
-                base_data[1] = {}
-
-            level = base_data[1].get("OldLevel", "Max")
-            change = input(f"Current level is {level}. Change it? (y/n): ").lower()
-            if change == "y":
-                new_level = input("Enter new level (leave blank for Max): ")
-                if new_level.strip() == "":
-                    base_data[1].pop("OldLevel", None)  # Max level
-                else:
-                    base_data[1]["OldLevel"] = int(new_level)
 
-            # Add or replace the boon in the save file
-            save_file_object.lua_state.boons[boon_name] = base_data
-            print(f"Boon '{boon_name}' added to save file.")
+        base_data = catalog.template(boon_name)
+
+    # The base_data is expected to be in the form {1: { ... }}
+    if 1 not in base_data:
+        base_data[1] = {}
+
+    level = base_data[1].get("OldLevel", "Max")
+    change = input(f"Current level is {level}. Change it? (y/n): ").lower()
+    if change == "y":
+        new_level = input("Enter new level (leave blank for Max): ")
+        if new_level.strip() == "":
+            base_data[1].pop("OldLevel", None)  # Max level
         else:
-            print("Invalid selection.")
-    except ValueError:
-        print("Please enter a valid number.")
+            try:
+                base_data[1]["OldLevel"] = int(new_level)
+            except ValueError:
+                print("Please enter a valid number.")
+                return
+
+    # Add or replace the boon in the save file
+    save_file_object.lua_state.boons[boon_name] = base_data
+    print(f"Boon '{boon_name}' added to save file.")
+
 
-    
-    
-    
 def update_lua(save_file_object: HadesSaveFile):
-    embed()
+    """
+    Opens the Lua state of the save in the interactive editor.
+
+    The editor works on the live state without copying it and only writes the journaled edits
+    back on Ctrl-S. Returns the applied (path, key, old value, new value) edits, or None if the
+    user quit without saving.
+    """
+    # The editor pulls in prompt_toolkit, which no other command needs
+    from lua_editor import LuaStateEditor
+
+    editor = LuaStateEditor(save_file_object.lua_state._active_state)
+    return editor.run()
+
+def update_lua_file(file_path: str, started_at: float = None):
+    """
+    Opens the Lua state of the save at file_path in the interactive editor without waiting for
+    it to be decoded.
+
+    The editor appears right away; the save is read, decompressed and decoded in a worker thread,
+    top-level keys become browsable as they are decoded and deeper tables are only decoded when
+    opened. Once the user saves, tables that were never opened are decoded so the full state can
+    be written back.
+
+    :return: (save file object with the edits applied or None, applied edits or None, editor)
+    """
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(file_path)
+    from lua_editor import LuaStateEditor
+
+    loaded = {}
+
+    def load_top_level_entries():
+        raw_save_file = RawSaveFile.from_file(file_path)
+        loaded["raw_save_file"] = raw_save_file
+        lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+        yield from iter_lazy_state(lua_bytes)
+
+    editor = LuaStateEditor({}, loader=load_top_level_entries, started_at=started_at)
+    applied_edits = editor.run()
+    if not applied_edits:
+        return None, applied_edits, editor
+
+    raw_save_file = loaded["raw_save_file"]
+    lua_state = LuaState(raw_save_file.version, [resolve_lazy_tables(editor.data)])
+    return HadesSaveFile.from_raw_save_file(raw_save_file, lua_state), applied_edits, editor
+
+# update_field names of the numeric LuaState properties
+CURRENCY_FIELDS = {
+    "darkness": "darkness",
+    "gems": "gems",
+    "money": "money",
+    "diamonds": "diamonds",
+    "nectar": "nectar",
+    "ambrosia": "ambrosia",
+    "keys": "chthonic_key", # Internal name is chthonic_key
+    "titan_blood": "titan_blood",
+    "rerolls": "rerolls",
+}
+
+# The LuaState properties reset_npc_gifts empties
+NPC_GIFT_PROPERTIES = [
+    "gift_record", "npc_interactions", "trigger_record", "activation_record", "use_record", "text_lines"
+]
+
+def update_field_rules(field_name: str, field_value: any) -> list:
+    """Returns update_field as transform rules (see state_transform), for every field but 'boons'."""
+    from state_transform import TransformRule, set_to
+    if field_name in CURRENCY_FIELDS:
+        path, value = LuaState.property_path(CURRENCY_FIELDS[field_name]), float(field_value)
+    elif field_name == "god_mode_reduction":
+        # Convert percentage to easy_mode_level
+        path, value = LuaState.property_path("easy_mode_level"), _easy_mode_level_from_damage_reduction(float(field_value))
+    elif field_name == "hell_mode":
+        path, value = LuaState.property_path("hell_mode"), str(field_value).lower() in ['true', 'on', '1', 'yes']
+    else:
+        raise ValueError(f"Unknown field: {field_name}")
+    return [TransformRule(path, set_to(value), default=None, name=f"{field_name} = {value}")]
+
+def reset_npc_gifts_rules() -> list:
+    """Returns reset_npc_gifts as transform rules (see state_transform)."""
+    from state_transform import TransformRule, clear_table
+    return [TransformRule(LuaState.property_path(name), clear_table, default={}) for name in NPC_GIFT_PROPERTIES]
 
 def update_field(save_file_object: HadesSaveFile, field_name: str, field_value: any):
     """Updates a specific field in the save file object's lua_state."""
     # Logic to map field_name to the correct attribute in save_file_object.lua_state
     # and update it. Will need type conversion for numeric values.
     # Also handles special cases like 'god_mode_reduction' and 'hell_mode'.
-    print(f"Core logic: Updating {field_name} to {field_value}")
+    logger.info("Updating field", extra={"fields": {"field": field_name, "value": field_value}})
     ls = save_file_object.lua_state
-    if field_name == "darkness":
-        ls.darkness = float(field_value)
-    elif field_name == "gems":
-        ls.gems = float(field_value)
-    elif field_name == "money":
-        ls.money = float(field_value)
-    elif field_name == "diamonds":
-        ls.diamonds = float(field_value)
-    elif field_name == "nectar":
-        ls.nectar = float(field_value)
-    elif field_name == "ambrosia":
-        ls.ambrosia = float(field_value)
-    elif field_name == "keys": # Internal name is chthonic_key
-        ls.chthonic_key = float(field_value)
-    elif field_name == "titan_blood":
-        ls.titan_blood = float(field_value)
-    elif field_name == "rerolls":
-        ls.rerolls = float(field_value)
-    elif field_name == "god_mode_reduction":
-        # Convert percentage to easy_mode_level
-        ls.easy_mode_level = _easy_mode_level_from_damage_reduction(float(field_value))
-    elif field_name == "hell_mode":
-        is_hell_mode = str(field_value).lower() in ['true', 'on', '1', 'yes']
-        ls.hell_mode = is_hell_mode
-        save_file_object.hell_mode_enabled = is_hell_mode # Also update this top-level flag
-    elif field_name == "boons":
+    if field_name == "boons":
         while True:
             print("\n--- Boon Management ---")
             print("1. List current boons")
@@ -256,76 +356,208 @@ def update_field(save_file_object: HadesSaveFile, field_name: str, field_value:
                 break
             else:
                 print("Invalid choice. Please enter a number from 1 to 5.")
+        return
 
-        
-    else:
-        raise ValueError(f"Unknown field: {field_name}")
+    from state_transform import TransformEngine
+    rules = update_field_rules(field_name, field_value)
+    counts = TransformEngine(rules).apply(ls._active_state)
+    for rule, count in zip(rules, counts):
+        if not count:
+            raise ValueError(f"'{rule.path}' cannot be set in this save (a table above it is missing)")
+    if field_name == "hell_mode":
+        save_file_object.hell_mode_enabled = ls.hell_mode # Also update this top-level flag
+
+def query_lua_state(file_path: str, query: str):
+    """
+    Yields (dotted path, value) for every match of a path query in the save's Lua state.
+
+    Only the tables the query descends into are decoded; matched tables may be returned as
+    LazyLuaTable placeholders (see decode_query_value).
+    """
+    compiled_query = compile_query(query)
+    raw_save_file = RawSaveFile.from_file(file_path)
+    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+    yield from compiled_query.find(dict(iter_lazy_state(lua_bytes)))
+
+def decode_query_value(value):
+    """Fully decodes a value returned by query_lua_state."""
+    if isinstance(value, LazyLuaTable):
+        return value.decode()
+    if isinstance(value, dict):
+        return resolve_lazy_tables(value)
+    return value
+
+def set_lua_state(save_file_object: HadesSaveFile, query: str, value_text: str):
+    """
+    Sets every match of a path query in the save's Lua state to a value.
+
+    :param value_text: The new value, in query literal syntax (numbers, true/false/nil, strings)
+    :return: (dotted path, old value) of every value replaced
+    """
+    compiled_query = compile_query(query)
+    new_value = parse_literal(value_text)
+    logger.info("Setting values", extra={"fields": {"query": query, "value": new_value}})
+    return compiled_query.set(save_file_object.lua_state._active_state, new_value)
 
 def reset_npc_gifts(save_file_object: HadesSaveFile):
     """Resets NPC gift records in the save file object."""
-    # Mirrors logic from App.reset_gift_record()
-    print("Core logic: Resetting NPC gifts")
-    ls = save_file_object.lua_state
-    ls.gift_record = {}
-    ls.npc_interactions = {}
-    ls.trigger_record = {}
-    ls.activation_record = {}
-    ls.use_record = {}
-    ls.text_lines = {}
+    # Mirrors logic from App.reset_gift_record(), emptying every record in one pass over the state
+    from state_transform import TransformEngine
+    logger.info("Resetting NPC gifts")
+    TransformEngine(reset_npc_gifts_rules()).apply(save_file_object.lua_state._active_state)
 
 # Copied _get_aspect_from_trait_cache and _get_weapon_from_weapons_cache from main.py App class
-# These are needed for export_runs_to_csv
+# These are needed for export_runs
 def _get_aspect_from_trait_cache(trait_cache):
-    for trait in trait_cache:
-        if trait in gamedata.AspectTraits:
-            return f"Aspect of {gamedata.AspectTraits[trait]}"
+    trait = gamedata.classify_aspect(trait_cache)
+    if trait is not None:
+        return f"Aspect of {gamedata.AspectTraits[trait]}"
     return "Redacted"
 
 def _get_weapon_from_weapons_cache(weapons_cache):
-    for weapon_name in gamedata.HeroMeleeWeapons.keys():
-        if weapon_name in weapons_cache:
-            return gamedata.HeroMeleeWeapons[weapon_name]
+    weapon_name = gamedata.classify_weapon(weapons_cache)
+    if weapon_name is not None:
+        return gamedata.HeroMeleeWeapons[weapon_name]
     return "Unknown weapon"
 
-def export_runs_to_csv(save_file_object: HadesSaveFile, csv_filepath: str):
-    """Exports run history from the save file object to a CSV file."""
+def _get_gods_from_trait_cache(trait_cache):
+    return ";".join(gamedata.classify_gods(trait_cache))
+
+def _get_keepsakes_from_trait_cache(trait_cache):
+    return ";".join(gamedata.Keepsakes[trait]["name"] for trait in gamedata.classify_keepsakes(trait_cache))
+
+def _get_companions_from_trait_cache(trait_cache):
+    return ";".join(gamedata.Companions[trait]["name"] for trait in gamedata.classify_companions(trait_cache))
+
+RUN_CSV_HEADER = [
+    "Attempt", "Heat", "Weapon", "Form",
+    "Elapsed time (seconds)", "Outcome", "Godmode",
+    "Godmode damage reduction"
+]
+# Extra columns of export_runs --details
+RUN_CSV_DETAIL_HEADER = ["Gods", "Keepsakes", "Companion"]
+
+def run_to_csv_row(key, run, details: bool = False) -> list:
+    """Builds the RUN_CSV_HEADER columns for one RunHistory entry, plus RUN_CSV_DETAIL_HEADER with details."""
+    trait_cache = run.get("TraitCache")
+    row = [
+        # Attempt
+        int(key),
+        # Heat
+        run.get("ShrinePointsCache", ""),
+        # Weapon
+        _get_weapon_from_weapons_cache(run["WeaponsCache"]) if "WeaponsCache" in run else "",
+        # Form
+        _get_aspect_from_trait_cache(trait_cache) if trait_cache is not None else "",
+        # Run duration (seconds)
+        run.get("GameplayTime", ""),
+        # Outcome
+        "Escaped" if run.get("Cleared", False) else "",
+        # Godmode
+        "EasyModeLevel" in run,
+        # Godmode damage reduction
+        _damage_reduction_from_easy_mode_level(run["EasyModeLevel"]) if "EasyModeLevel" in run else ""
+    ]
+    if details:
+        row += [
+            # Gods whose boons were taken
+            _get_gods_from_trait_cache(trait_cache) if trait_cache is not None else "",
+            # Keepsakes
+            _get_keepsakes_from_trait_cache(trait_cache) if trait_cache is not None else "",
+            # Companion
+            _get_companions_from_trait_cache(trait_cache) if trait_cache is not None else "",
+        ]
+    return row
+
+RUN_EXPORT_INDEX_SUFFIX = ".index.json"
+
+def _run_export_format(filepath: str) -> str:
+    return "ndjson" if Path(filepath).suffix.lower() in (".ndjson", ".jsonl") else "csv"
+
+def _load_run_export_index(filepath: str, export_format: str, details: bool):
+    # The index is only trusted if the export it describes is still exactly as we left it
+    index_path = Path(filepath + RUN_EXPORT_INDEX_SUFFIX)
+    export_path = Path(filepath)
+    if not index_path.exists() or not export_path.exists():
+        return None
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("format") != export_format or index.get("size") != export_path.stat().st_size:
+        return None
+    if index.get("details", False) != details:
+        return None # Exported with other columns
+    return index
+
+def _write_run_rows(f, export_format: str, header: list, rows: list, write_header: bool):
+    if export_format == "ndjson":
+        for row in rows:
+            f.write(json.dumps(dict(zip(header, row))) + "\n")
+    else:
+        run_writer = csv.writer(f, dialect='excel')
+        if write_header:
+            run_writer.writerow(header)
+        run_writer.writerows(rows)
+
+def export_runs(save_file_object: HadesSaveFile, filepath: str, incremental: bool = True, details: bool = False):
+    """
+    Exports run history from the save file object to a CSV or NDJSON (.ndjson/.jsonl) file.
+    With details, the gods, keepsakes and companion of each run are added as extra columns.
+
+    A sidecar index (filepath + RUN_EXPORT_INDEX_SUFFIX) records the highest attempt exported and a
+    hash of the exported rows. When incremental, later exports only append runs newer than that
+    attempt; if any earlier run changed, or the export was modified, the file is rewritten in full.
+    """
     # Mirrors logic from App.export_runs_as_csv()
     # Uses _get_aspect_from_trait_cache, _get_weapon_from_weapons_cache, 
     # and _damage_reduction_from_easy_mode_level helper functions.
-    print(f"Core logic: Exporting runs to {csv_filepath}")
-    
-    runs_data = save_file_object.lua_state.to_dicts() # This returns a list
-    if not runs_data or "GameState" not in runs_data[0] or "RunHistory" not in runs_data[0]["GameState"]:
+    logger.info("Exporting runs", extra={"fields": {"path": filepath}})
+
+    runs = save_file_object.lua_state.run_history
+    if not runs:
         print("Error: Could not find RunHistory in save file.")
         return
 
-    runs = runs_data[0]["GameState"]["RunHistory"]
-
-    with open(csv_filepath, "w", newline='') as csvfile:
-      run_writer = csv.writer(csvfile, dialect='excel')
-      run_writer.writerow([
-          "Attempt", "Heat", "Weapon", "Form", 
-          "Elapsed time (seconds)", "Outcome", "Godmode", 
-          "Godmode damage reduction"
-      ])
-
-      for key, run in runs.items():
-          run_writer.writerow([
-              # Attempt
-              int(key),
-              # Heat
-              run.get("ShrinePointsCache", ""),
-              # Weapon
-              _get_weapon_from_weapons_cache(run["WeaponsCache"]) if "WeaponsCache" in run else "",
-              # Form
-              _get_aspect_from_trait_cache(run["TraitCache"]) if "TraitCache" in run else "",
-              # Run duration (seconds)
-              run.get("GameplayTime", ""),
-              # Outcome
-              "Escaped" if run.get("Cleared", False) else "",
-              # Godmode
-              "EasyModeLevel" in run,
-              # Godmode damage reduction
-              _damage_reduction_from_easy_mode_level(run["EasyModeLevel"]) if "EasyModeLevel" in run else ""
-          ])
-    print(f"Successfully exported runs to {csv_filepath}")
+    export_format = _run_export_format(filepath)
+    header = RUN_CSV_HEADER + RUN_CSV_DETAIL_HEADER if details else RUN_CSV_HEADER
+    rows = [run_to_csv_row(key, run, details) for key, run in sorted(runs.items(), key=lambda item: item[0])]
+
+    index = _load_run_export_index(filepath, export_format, details) if incremental else None
+    rows_hash = hashlib.sha256()
+    first_new_row = 0
+    for i, row in enumerate(rows):
+        if index is not None and row[0] > index["last_attempt"]:
+            break
+        rows_hash.update(json.dumps(row).encode("utf-8"))
+        first_new_row = i + 1
+
+    if index is not None and rows_hash.hexdigest() != index["hash"]:
+        print("Earlier runs changed since the last export, rewriting the whole file.")
+        index = None
+
+    if index is None:
+        new_rows = rows
+        rows_hash = hashlib.sha256()
+    else:
+        new_rows = rows[first_new_row:]
+    for row in new_rows:
+        rows_hash.update(json.dumps(row).encode("utf-8"))
+
+    with open(filepath, "a" if index is not None else "w", newline='') as f:
+        _write_run_rows(f, export_format, header, new_rows, write_header=index is None)
+
+    with open(filepath + RUN_EXPORT_INDEX_SUFFIX, "w") as f:
+        json.dump({
+            "format": export_format,
+            "details": details,
+            "last_attempt": rows[-1][0],
+            "hash": rows_hash.hexdigest(),
+            "size": Path(filepath).stat().st_size,
+        }, f)
+
+    if index is not None:
+        print(f"Appended {len(new_rows)} new runs to {filepath}")
+    else:
+        print(f"Successfully exported runs to {filepath}")
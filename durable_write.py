@@ -0,0 +1,131 @@
+''' Atomic save writes: a temporary file in the same directory, renamed over the target '''
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, Optional, Set
+
+# Durability modes:
+#   full  fsync the file before the rename and its directory after it, so the new save survives
+#         a power loss once the write returns
+#   file  fsync the file only; the rename itself may be lost on a power loss (the old save is
+#         then still there, complete)
+#   none  no fsync; the operating system writes the file when it sees fit
+# In every mode the rename is atomic: readers, and the save after a crash of this process,
+# see either the old or the new save, never a partly written one.
+FULL = "full"
+FILE = "file"
+NONE = "none"
+DURABILITY_MODES = [FULL, FILE, NONE]
+
+_default_durability = FULL
+# Directories waiting for one fsync at the end of the innermost grouped_directory_sync
+_pending_directories: Optional[Set[str]] = None
+
+
+def set_default_durability(durability: str):
+    """Sets the durability mode of writes that do not give one (the CLI's --durability)."""
+    global _default_durability
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode {durability} (expected one of {', '.join(DURABILITY_MODES)})")
+    _default_durability = durability
+
+
+def _sync_directory(directory: str):
+    if os.name == "nt":
+        return # Directories cannot be opened for fsync on Windows, and renames there are journaled by NTFS
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _file_mode(path: str) -> int:
+    # Keep the permissions of the file being replaced; new files get the usual umask defaults
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def atomic_write_bytes(path: str, data: bytes, durability: Optional[str] = None) -> None:
+    """Writes data to path through a temporary file in the same directory and an atomic rename."""
+    durability = durability or _default_durability
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode {durability} (expected one of {', '.join(DURABILITY_MODES)})")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            if durability != NONE:
+                os.fsync(f.fileno())
+        os.chmod(temp_path, _file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+
+    if durability == FULL:
+        if _pending_directories is not None:
+            _pending_directories.add(directory)
+        else:
+            _sync_directory(directory)
+
+
+@contextlib.contextmanager
+def grouped_directory_sync() -> Iterator[None]:
+    """
+    Defers the directory fsyncs of full-durability writes made inside the block to its end, so
+    bulk jobs sync each directory once instead of after every file.
+    """
+    global _pending_directories
+    if _pending_directories is not None:
+        yield # Nested in another group, which syncs at its end
+        return
+    _pending_directories = set()
+    try:
+        yield
+    finally:
+        directories, _pending_directories = _pending_directories, None
+        for directory in sorted(directories):
+            _sync_directory(directory)
+
+
+def benchmark_durability(save_path: str, count: int = 20) -> Dict[str, Dict[str, float]]:
+    """
+    Times writing count copies of a save in each durability mode, one at a time and grouped,
+    in a temporary directory next to the save (so they hit the same file system).
+    """
+    with open(save_path, "rb") as f:
+        data = f.read()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix=".pluto_benchmark_", dir=os.path.dirname(os.path.abspath(save_path))) as directory:
+        for durability in DURABILITY_MODES:
+            for grouped in (False, True):
+                if grouped and durability != FULL:
+                    continue # Only full durability syncs the directory
+                start = time.perf_counter()
+                with grouped_directory_sync() if grouped else contextlib.nullcontext():
+                    for index in range(count):
+                        atomic_write_bytes(os.path.join(directory, f"Profile{index}.sav"), data, durability)
+                elapsed = time.perf_counter() - start
+                results[durability + (" grouped" if grouped else "")] = {"ms_per_write": elapsed * 1000 / count}
+    return results
+
+
+if __name__ == '__main__' and '--benchmark' in sys.argv:
+    arguments = sys.argv[sys.argv.index('--benchmark') + 1:]
+    count = int(arguments[1]) if len(arguments) > 1 else 20
+    result = benchmark_durability(arguments[0], count)
+    print(f"{count} writes of {arguments[0]}:")
+    for mode, timings in result.items():
+        print(f"  {mode:>12}: {timings['ms_per_write']:8.2f} ms per write")
@@ -1,44 +1,92 @@
 ''' Contains Hades gamedata '''
+import json
+from typing import Any, Dict, FrozenSet, List, Optional
 
-# Based on data in Weaponsets.lua
-HeroMeleeWeapons = {
-    "SwordWeapon": "Stygian Blade",
-    "SpearWeapon": "Eternal Spear",
-    "ShieldWeapon": "Shield of Chaos",
-    "BowWeapon": "Heart-Seeking Bow",
-    "FistWeapon": "Twin Fists of Malphon",
-    "GunWeapon": "Adamant Rail",
-}
-
-
-# Based on data from TraitData.lua
-AspectTraits = {
-    "SwordCriticalParryTrait": "Nemesis",
-    "SwordConsecrationTrait": "Arthur",
-    "ShieldRushBonusProjectileTrait": "Chaos",
-    "ShieldLoadAmmoTrait": "Beowulf",
-    # "ShieldBounceEmpowerTrait": "",
-    "ShieldTwoShieldTrait": "Zeus",
-    "SpearSpinTravel": "Guan Yu",
-    "GunGrenadeSelfEmpowerTrait": "Eris",
-    "FistVacuumTrait": "Talos",
-    "FistBaseUpgradeTrait": "Zagreus",
-    "FistWeaveTrait": "Demeter",
-    "FistDetonateTrait": "Gilgamesh",
-    "SwordBaseUpgradeTrait": "Zagreus",
-    "BowBaseUpgradeTrait": "Zagreus",
-    "SpearBaseUpgradeTrait": "Zagreus",
-    "ShieldBaseUpgradeTrait": "Zagreus",
-    "GunBaseUpgradeTrait": "Zagreus",
-    "DislodgeAmmoTrait": "Poseidon",
-    # "SwordAmmoWaveTrait": "",
-    "GunManualReloadTrait": "Hestia",
-    "GunLoadedGrenadeTrait": "Lucifer",
-    "BowMarkHomingTrait": "Chiron",
-    "BowLoadAmmoTrait": "Hera",
-    # "BowStoredChargeTrait": "",
-    "BowBondTrait": "Rama",
-    # "BowBeamTrait": "",
-    "SpearWeaveTrait": "Hades",
-    "SpearTeleportTrait": "Achilles",
-}
+from util import load_data_file_as_binary
+
+# The tables live in data/gamedata.json:
+#   HeroMeleeWeapons - based on data in Weaponsets.lua
+#   AspectTraits, AspectWeapons, Boons, Keepsakes, Companions - based on data from TraitData.lua
+# They are loaded on first access, and the lookup indexes below are built once at that point.
+GAMEDATA_FILE = "gamedata.json"
+
+
+class _GameDataCatalog:
+    def __init__(self, tables: Dict[str, Any]):
+        self.HeroMeleeWeapons: Dict[str, str] = tables["HeroMeleeWeapons"]
+        self.AspectTraits: Dict[str, str] = tables["AspectTraits"]
+        self.AspectWeapons: Dict[str, str] = tables["AspectWeapons"]
+        self.Gods: List[str] = tables["Gods"]
+        self.Boons: Dict[str, Dict[str, str]] = tables["Boons"]
+        self.Keepsakes: Dict[str, Dict[str, str]] = tables["Keepsakes"]
+        self.Companions: Dict[str, Dict[str, str]] = tables["Companions"]
+
+        # Membership sets for classifying a run's WeaponsCache / TraitCache by intersection
+        self.MeleeWeaponSet: FrozenSet[str] = frozenset(self.HeroMeleeWeapons)
+        self.AspectTraitSet: FrozenSet[str] = frozenset(self.AspectTraits)
+        self.BoonTraitSet: FrozenSet[str] = frozenset(self.Boons)
+        self.KeepsakeTraitSet: FrozenSet[str] = frozenset(self.Keepsakes)
+        self.CompanionTraitSet: FrozenSet[str] = frozenset(self.Companions)
+
+        # Reverse maps
+        self.WeaponOrder: Dict[str, int] = {name: i for i, name in enumerate(self.HeroMeleeWeapons)}
+        self.BoonGods: Dict[str, str] = {trait: boon["god"] for trait, boon in self.Boons.items()}
+        self.GodOrder: Dict[str, int] = {god: i for i, god in enumerate(self.Gods)}
+        self.GodBoons: Dict[str, FrozenSet[str]] = {
+            god: frozenset(trait for trait, boon_god in self.BoonGods.items() if boon_god == god)
+            for god in self.Gods
+        }
+
+
+_catalog: Optional[_GameDataCatalog] = None
+
+
+def catalog() -> _GameDataCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = _GameDataCatalog(json.loads(load_data_file_as_binary(GAMEDATA_FILE)))
+    return _catalog
+
+
+def __getattr__(name: str) -> Any:
+    # Lets callers keep using gamedata.HeroMeleeWeapons etc. while loading the tables lazily
+    if name.startswith("_"):
+        raise AttributeError(name)
+    try:
+        return getattr(catalog(), name)
+    except AttributeError:
+        raise AttributeError(f"module 'gamedata' has no attribute '{name}'") from None
+
+
+def classify_weapon(weapons_cache) -> Optional[str]:
+    """Returns the melee weapon of a run's WeaponsCache, or None."""
+    data = catalog()
+    matches = data.MeleeWeaponSet.intersection(weapons_cache)
+    if not matches:
+        return None
+    return min(matches, key=data.WeaponOrder.__getitem__)
+
+
+def classify_aspect(trait_cache) -> Optional[str]:
+    """Returns the aspect trait of a run's TraitCache (the first one in it, if there are several), or None."""
+    matches = catalog().AspectTraitSet.intersection(trait_cache)
+    if len(matches) <= 1:
+        return next(iter(matches), None)
+    return next(trait for trait in trait_cache if trait in matches)
+
+
+def classify_gods(trait_cache) -> List[str]:
+    """Returns the gods whose boons appear in a run's TraitCache, in Gods order."""
+    data = catalog()
+    gods = {data.BoonGods[trait] for trait in data.BoonTraitSet.intersection(trait_cache)}
+    return sorted(gods, key=data.GodOrder.__getitem__)
+
+
+def classify_keepsakes(trait_cache) -> List[str]:
+    """Returns the keepsake traits of a run's TraitCache, sorted by name."""
+    return sorted(catalog().KeepsakeTraitSet.intersection(trait_cache))
+
+
+def classify_companions(trait_cache) -> List[str]:
+    """Returns the companion traits of a run's TraitCache, sorted by name."""
+    return sorted(catalog().CompanionTraitSet.intersection(trait_cache))
@@ -0,0 +1,289 @@
+''' RFC 6902 JSON Patch for the header fields and Lua state of a save '''
+import copy
+import json
+from typing import Any, Dict, List, Tuple
+
+from models.lazy_lua_table import LazyLuaTable, encode_lazy_value
+from models.lua_path import resolve_key
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET
+from models.raw_save_file import RawSaveFile
+
+# Pointers address the same document edit_raw shows as JSON: the header fields at the top level
+# ("/runs") and the Lua state under "/lua_state/0" ("/lua_state/0/GameState/Resources/Gems").
+# Lua number keys are written as numbers ("/lua_state/0/GameState/RunHistory/12").
+LUA_STATE_MEMBER = "lua_state"
+
+OPERATIONS = ["add", "remove", "replace", "move", "copy", "test"]
+
+# Header fields that a patch may not change, since they decide how the save is parsed
+READ_ONLY_HEADER_FIELDS = ["version"]
+
+
+def parse_pointer(pointer: str) -> List[str]:
+    """Splits an RFC 6901 JSON pointer into its unescaped reference tokens."""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer (must start with '/'): {pointer}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def to_lua_value(value: Any) -> Any:
+    """Converts a JSON value to the form decoded Lua values take: numbers are floats, arrays are tables."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, list):
+        return {float(index + 1): to_lua_value(item) for index, item in enumerate(value)}
+    if isinstance(value, dict):
+        return {key: to_lua_value(item) for key, item in value.items()}
+    raise ValueError(f"Unsupported value: {value!r}")
+
+
+def _lua_type_name(value: Any) -> str:
+    if value is None:
+        return "nil"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return "table"
+
+
+def _header_type_name(value: Any) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return type(value).__name__
+
+
+def _decoded(value: Any) -> Any:
+    if isinstance(value, LazyLuaTable):
+        return value.decode()
+    if isinstance(value, dict):
+        return {key: _decoded(item) for key, item in value.items()}
+    return value
+
+
+class SavePatchDocument:
+    """
+    The header fields and Lua state of a save, as a target for patch operations.
+
+    The Lua state is only decompressed when an operation refers to it, and only the tables on
+    the operations' paths are decoded (everything else stays a LazyLuaTable placeholder whose
+    bytes are copied unchanged when the state is written back).
+    """
+
+    def __init__(self, raw_save_file: RawSaveFile):
+        self.raw_save_file = raw_save_file
+        self.header = raw_save_file.header_fields()
+        self.header_changed = False
+        self.state_changed = False
+        self._state = None
+        self._lua_bytes = None
+        self._state_end = None
+
+    def _state_table(self) -> Dict[Any, Any]:
+        if self._state is None:
+            self._lua_bytes = decompress_lua_state_bytes(self.raw_save_file.version, bytes(self.raw_save_file.lua_state_bytes))
+            state = LazyLuaTable(memoryview(self._lua_bytes), STATE_TABLE_OFFSET)
+            self._state = state.load()
+            self._state_end = state.end
+        return self._state
+
+    def _resolve_token(self, container, token: str, in_state: bool, adding: bool):
+        if isinstance(container, list):
+            if token == "-":
+                return len(container)
+            if not token.isdigit():
+                raise ValueError(f"Invalid array index: {token}")
+            return int(token)
+
+        if not in_state:
+            return token
+        if token == "-":
+            # Appending to a Lua sequence: the key after the largest number key
+            return max((key for key in container if isinstance(key, float)), default=0.0) + 1
+        key = resolve_key(container, token)
+        if adding and key not in container and any(isinstance(existing, float) for existing in container):
+            # A new key in a table with number keys is a number too, if it looks like one
+            try:
+                return float(token)
+            except ValueError:
+                pass
+        return key
+
+    def resolve(self, pointer: str, adding: bool = False) -> Tuple[Any, Any, bool]:
+        """Returns (parent container, key, whether it is inside the Lua state) for a pointer."""
+        tokens = parse_pointer(pointer)
+        if not tokens:
+            raise ValueError("Operations on the whole document are not supported")
+
+        in_state = tokens[0] == LUA_STATE_MEMBER
+        if in_state:
+            if len(tokens) < 3 or tokens[1] != "0":
+                raise ValueError(f"Lua state pointers must start with /{LUA_STATE_MEMBER}/0/: {pointer}")
+            container = self._state_table()
+            tokens = tokens[2:]
+        else:
+            container = self.header
+            if tokens[0] not in self.header:
+                raise ValueError(f"Unknown header field: {tokens[0]}")
+            if tokens[0] in READ_ONLY_HEADER_FIELDS:
+                raise ValueError(f"The '{tokens[0]}' header field cannot be patched")
+
+        for token in tokens[:-1]:
+            key = self._resolve_token(container, token, in_state, adding=False)
+            try:
+                child = container[key]
+            except (KeyError, IndexError):
+                raise ValueError(f"Path not found: {pointer}") from None
+            if isinstance(child, LazyLuaTable):
+                # Decode only the tables on the operation's path
+                child = container[key] = child.load()
+            if not isinstance(child, (dict, list)):
+                raise ValueError(f"Not a table or array at {pointer}")
+            container = child
+
+        return container, self._resolve_token(container, tokens[-1], in_state, adding), in_state
+
+    def _mark_changed(self, in_state: bool):
+        if in_state:
+            self.state_changed = True
+        else:
+            self.header_changed = True
+
+    def _check_type(self, pointer: str, old_value: Any, new_value: Any, in_state: bool):
+        type_name = _lua_type_name if in_state else _header_type_name
+        if type_name(old_value) != type_name(new_value):
+            raise ValueError(f"{pointer} is a {type_name(old_value)}, got a {type_name(new_value)}")
+
+    def get(self, pointer: str) -> Any:
+        container, key, _ = self.resolve(pointer)
+        try:
+            return container[key]
+        except (KeyError, IndexError):
+            raise ValueError(f"Path not found: {pointer}") from None
+
+    def add(self, pointer: str, value: Any, converted: bool = False):
+        container, key, in_state = self.resolve(pointer, adding=True)
+        if in_state and not converted:
+            value = to_lua_value(value)
+        if isinstance(container, list):
+            if key > len(container):
+                raise ValueError(f"Array index out of range: {pointer}")
+            container.insert(key, value)
+        else:
+            if key in container:
+                self._check_type(pointer, container[key], value, in_state)
+            container[key] = value
+        self._mark_changed(in_state)
+
+    def remove(self, pointer: str) -> Any:
+        container, key, in_state = self.resolve(pointer)
+        if not in_state and container is self.header:
+            raise ValueError(f"Header fields cannot be removed: {pointer}")
+        try:
+            value = container.pop(key)
+        except (KeyError, IndexError):
+            raise ValueError(f"Path not found: {pointer}") from None
+        self._mark_changed(in_state)
+        return value
+
+    def replace(self, pointer: str, value: Any):
+        container, key, in_state = self.resolve(pointer)
+        if in_state:
+            value = to_lua_value(value)
+        try:
+            old_value = container[key]
+        except (KeyError, IndexError):
+            raise ValueError(f"Path not found: {pointer}") from None
+        self._check_type(pointer, old_value, value, in_state)
+        container[key] = value
+        self._mark_changed(in_state)
+
+    def test(self, pointer: str, value: Any):
+        _, _, in_state = self.resolve(pointer)
+        expected = to_lua_value(value) if in_state else value
+        if _decoded(self.get(pointer)) != expected:
+            raise ValueError(f"Test failed: {pointer} is not {json.dumps(value)}")
+
+    def apply(self, operation: Dict[str, Any]):
+        op = operation.get("op")
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op!r}")
+        if "path" not in operation:
+            raise ValueError(f"Operation '{op}' is missing 'path'")
+        path = operation["path"]
+
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise ValueError(f"Operation '{op}' is missing 'value'")
+        if op in ("move", "copy") and "from" not in operation:
+            raise ValueError(f"Operation '{op}' is missing 'from'")
+
+        if op == "add":
+            self.add(path, operation["value"])
+        elif op == "remove":
+            self.remove(path)
+        elif op == "replace":
+            self.replace(path, operation["value"])
+        elif op == "test":
+            self.test(path, operation["value"])
+        elif op == "move":
+            if path.startswith(operation["from"] + "/"):
+                raise ValueError(f"Cannot move {operation['from']} into itself")
+            if parse_pointer(path)[:1] != parse_pointer(operation["from"])[:1]:
+                raise ValueError("Values can only be moved within the header or within the Lua state")
+            self.add(path, self.remove(operation["from"]), converted=True)
+        elif op == "copy":
+            if parse_pointer(path)[:1] != parse_pointer(operation["from"])[:1]:
+                raise ValueError("Values can only be copied within the header or within the Lua state")
+            self.add(path, copy.deepcopy(self.get(operation["from"])), converted=True)
+
+    def write_back(self):
+        """Stores the changed header fields and Lua state in the RawSaveFile."""
+        save_data = self.raw_save_file.save_data
+        if self.header_changed:
+            for field_name, value in self.header.items():
+                if field_name not in READ_ONLY_HEADER_FIELDS:
+                    save_data[field_name] = value
+
+        if self.state_changed:
+            lua_bytes = bytearray(self._lua_bytes[:STATE_TABLE_OFFSET])
+            encode_lazy_value(self._state, lua_bytes)
+            lua_bytes += self._lua_bytes[self._state_end:]
+            lua_state_bytes = compress_lua_state_bytes(self.raw_save_file.version, bytes(lua_bytes))
+            save_data["lua_state"] = lua_state_bytes
+            self.raw_save_file.lua_state_bytes = lua_state_bytes
+
+
+def parse_patch(text: str) -> List[Dict[str, Any]]:
+    """Parses a JSON Patch document (an array of operation objects)."""
+    operations = json.loads(text)
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        raise ValueError("A JSON Patch must be an array of operation objects")
+    return operations
+
+
+def apply_patch(raw_save_file: RawSaveFile, operations: List[Dict[str, Any]]) -> SavePatchDocument:
+    """
+    Applies patch operations to a save, all or nothing: if any operation fails, a ValueError
+    naming it is raised and the save is left unchanged.
+    """
+    document = SavePatchDocument(raw_save_file)
+    for index, operation in enumerate(operations):
+        try:
+            document.apply(operation)
+        except ValueError as e:
+            raise ValueError(f"Operation {index} ({operation.get('op')} {operation.get('path')}): {e}") from None
+    document.write_back()
+    return document
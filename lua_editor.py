@@ -1,4 +1,6 @@
-import copy
+import sys
+import threading
+import time
 from prompt_toolkit.application import Application
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.layout.containers import HSplit, Window, VSplit, ConditionalContainer
@@ -8,17 +10,57 @@ from prompt_toolkit.widgets import TextArea
 from prompt_toolkit.formatted_text import FormattedText, HTML
 from prompt_toolkit.filters import Condition
 
+from models.lazy_lua_table import LazyLuaTable
+from models.lua_path import resolve_key, split_path
+from state_index import StateIndex
+
+# Rows formatted above and below the visible window, so small scrolls hit the row cache
+VIEWPORT_MARGIN = 10
+SELECTED_ROW_STYLE = "bg:#444444"
+# Maximum number of paths listed for a '/' search
+SEARCH_RESULT_LIMIT = 1000
+
+
 class LuaStateEditor:
-    def __init__(self, lua_state_dict_original):
-        self.original_data = lua_state_dict_original
-        self.working_data = copy.deepcopy(lua_state_dict_original) # Edit a copy
-        
+    """
+    TUI editor over a Lua state dict.
+
+    The state is not copied: edits are recorded in a journal of (path, key, old, new) entries and
+    shown as an overlay on top of the live data. Ctrl-S applies the journaled edits to the state;
+    quitting leaves it untouched.
+
+    With a loader, the editor opens on an empty state and the loader runs in a worker thread,
+    yielding top-level (key, value) entries that become browsable as they arrive. Values may be
+    LazyLuaTable placeholders, which are decoded when the user opens them.
+    """
+
+    def __init__(self, lua_state_dict, input=None, output=None, loader=None, started_at=None):
+        self.data = lua_state_dict # Live state, only modified by _apply_journal and the loader
+
+        # Background loading; the timings are in milliseconds since started_at
+        self.loader = loader
+        self.loading = loader is not None
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.first_paint_ms = None
+        self.load_ms = None
+
         self.current_path = [] # List of keys/indices representing path from root
-        self.current_view_data = self.working_data # Data currently being displayed/navigated
+        self.current_view_data = self.data # Data currently being displayed/navigated
+        # (parent view data, selected_index, scroll_offset) for each level above the current view,
+        # so going back does not walk down from the root again
+        self._view_stack = []
         self.selected_index = 0 # Index in current list or dict view
-        self.view_items = [] # List of (key_or_index, value) for current view
+        self.view_keys = [] # Keys (dict) or indices (list) of the current view; values are looked up lazily
+        self.scroll_offset = 0 # Index of the first row in the viewport
+        self._row_cache = {} # Row index -> formatted row text, valid until the current view changes
 
         self.user_saved = False
+
+        # Change journal: entries before _journal_position are applied, the rest can be redone
+        self.journal = [] # (path tuple, key_or_idx, old value, new value)
+        self._journal_position = 0
+        self._pending = {} # (path tuple, key_or_idx) -> new value for the applied journal entries
+        self.showing_pending = False
         
         # Edit Mode State
         self.editing_mode = False
@@ -28,6 +70,14 @@ class LuaStateEditor:
         self.error_message = "" 
         self.edit_input_area = TextArea(multiline=False, height=1, prompt="Edit: ")
 
+        # Search State: the index is built on the first search and covers the state as loaded,
+        # not the pending edits
+        self.searching = False
+        self.search_results = None # (term, dotted path) list while the results are shown
+        self.search_selected = 0
+        self._search_index = None
+        self.search_input_area = TextArea(multiline=False, height=1, prompt="Search: ")
+
 
         self._update_view_items()
 
@@ -39,16 +89,21 @@ class LuaStateEditor:
         self.header_text = FormattedTextControl(text=self._get_header_text, focusable=False)
         self.path_text = FormattedTextControl(text=self._get_path_text, focusable=False)
         self.main_content_text = FormattedTextControl(text=self._get_main_content_formatted_text, focusable=True)
+        self.main_window = Window(content=self.main_content_text, wrap_lines=False)
         self.error_line = FormattedTextControl(text=self._get_error_text, focusable=False)
 
         root_container = HSplit([
             Window(height=1, content=self.header_text),
             Window(height=1, content=self.path_text),
-            Window(content=self.main_content_text),
+            self.main_window,
             ConditionalContainer(
                 content=self.edit_input_area,
                 filter=Condition(lambda: self.editing_mode)
             ),
+            ConditionalContainer(
+                content=self.search_input_area,
+                filter=Condition(lambda: self.searching)
+            ),
             ConditionalContainer(
                 Window(height=1, content=self.error_line), 
                 filter=Condition(lambda: bool(self.error_message)) 
@@ -57,37 +112,86 @@ class LuaStateEditor:
 
         
         self.layout = Layout(container=root_container)
-        self.app = Application(layout=self.layout, key_bindings=self.kb, full_screen=True, mouse_support=False)
+        self.app = Application(
+            layout=self.layout, key_bindings=self.kb, full_screen=True, mouse_support=False,
+            input=input, output=output
+        )
+        self.app.after_render += self._on_after_render
+
+    def _on_after_render(self, _):
+        if self.first_paint_ms is None:
+            self.first_paint_ms = (time.perf_counter() - self.started_at) * 1000
+
+    def _start_loader(self):
+        if self.loader is None:
+            return
+        loop = self.app.loop
+        threading.Thread(target=self._run_loader, args=(loop,), daemon=True).start()
+
+    def _run_loader(self, loop):
+        # Runs in the worker thread; the state is only modified on the event loop's thread
+        try:
+            for key, value in self.loader():
+                loop.call_soon_threadsafe(self._add_loaded_entry, key, value)
+        except Exception as e:
+            loop.call_soon_threadsafe(self._fail_loading, e)
+            return
+        loop.call_soon_threadsafe(self._finish_loading)
+
+    def _add_loaded_entry(self, key, value):
+        self.data[key] = value
+        if self.current_view_data is self.data and isinstance(self.view_keys, list):
+            self.view_keys.append(key)
+        self.app.invalidate()
+
+    def _finish_loading(self):
+        self.loading = False
+        self.load_ms = (time.perf_counter() - self.started_at) * 1000
+        self.app.invalidate()
+
+    def _fail_loading(self, exception):
+        self.loading = False
+        self.app.exit(exception=exception)
 
     def _get_header_text(self):
         edit_mode_hint = " | (Editing Mode - Enter: Submit, Esc: Cancel)" if self.editing_mode else ""
-        return HTML(f"<style bg='blue' fg='white'>Lua State Editor | Up/Down: Navigate | Enter: Dive/Edit | Esc: Back | Ctrl-S: Save & Exit | Ctrl-Q: Quit{edit_mode_hint}</style>")
+        if self.loading:
+            edit_mode_hint += f" | Loading... ({len(self.data)} keys)"
+        return HTML(f"<style bg='blue' fg='white'>Lua State Editor | Up/Down: Navigate | Enter: Dive/Edit | Esc: Back | /: Search | Ctrl-Z/Ctrl-Y: Undo/Redo | Ctrl-P: Pending ({self._journal_position}) | Ctrl-S: Save &amp; Exit | Ctrl-Q: Quit{edit_mode_hint}</style>")
 
     def _get_path_text(self):
-        return HTML(f"<style fg='cyan'>Path: {'/'.join(map(str, self.current_path))}</style>")
+        position = f"{self.selected_index + 1}/{len(self.view_keys)}" if self.view_keys else "0/0"
+        return HTML(f"<style fg='cyan'>Path: {'/'.join(map(str, self.current_path))}  [{position}]</style>")
 
     def _update_view_items(self):
-        self.view_items = []
+        # Only the keys are collected here; values are read when their row becomes visible
         if isinstance(self.current_view_data, dict):
-            self.view_items = list(self.current_view_data.items())
+            self.view_keys = list(self.current_view_data.keys())
         elif isinstance(self.current_view_data, list):
-            self.view_items = list(enumerate(self.current_view_data))
-        
+            self.view_keys = range(len(self.current_view_data))
+        else:
+            self.view_keys = []
+        self._row_cache = {}
+        self.scroll_offset = 0
+
         # Ensure selected_index is valid
-        if not self.view_items:
+        if not self.view_keys:
             self.selected_index = 0
         else:
-            self.selected_index = max(0, min(self.selected_index, len(self.view_items) - 1))
+            self.selected_index = max(0, min(self.selected_index, len(self.view_keys) - 1))
 
+    def _item_at(self, index):
+        key_or_idx = self.view_keys[index]
+        pending_key = (tuple(self.current_path), key_or_idx)
+        if pending_key in self._pending:
+            return key_or_idx, self._pending[pending_key]
+        return key_or_idx, self.current_view_data[key_or_idx]
+
+    def _format_row(self, index):
+        row = self._row_cache.get(index)
+        if row is None:
+            key_or_idx, value = self._item_at(index)
 
-    def _get_main_content_formatted_text(self):
-        lines = []
-        if not self.view_items:
-            lines.append(HTML("<em>&lt;Empty&gt;</em>"))
-        
-        for i, (key_or_idx, value) in enumerate(self.view_items):
-            prefix = "> " if i == self.selected_index else "  "
-            
             # Display key/index
             if isinstance(self.current_view_data, dict):
                 display_key = f"{key_or_idx}: "
@@ -95,23 +199,99 @@ class LuaStateEditor:
                 display_key = f"[{key_or_idx}] "
 
             # Display value (simplified for now)
-            if isinstance(value, (dict, list)):
-                display_value = f"&lt;{type(value).__name__} of {len(value)} items&gt;"
+            if isinstance(value, LazyLuaTable):
+                display_value = f"<dict of {len(value)} items>"
+            elif isinstance(value, (dict, list)):
+                display_value = f"<{type(value).__name__} of {len(value)} items>"
             else:
                 display_value = repr(value) # Show strings with quotes, etc.
-            
-            line_html = f"{prefix}{HTML(display_key)}{HTML(display_value)}"
-            if i == self.selected_index:
-                line_html = f"<style bg='#444444'>{line_html}</style>" # Highlight selected line
-            lines.append(HTML(line_html))
-        return FormattedText(lines)
+
+            row = display_key + display_value
+            self._row_cache[index] = row
+        return row
+
+    def _visible_height(self):
+        render_info = self.main_window.render_info
+        if render_info is not None:
+            return max(1, render_info.window_height)
+        # Not rendered yet: the header, path and error lines take three rows
+        return max(1, self.app.output.get_size().rows - 3)
+
+    def _move_selection(self, delta):
+        if self.search_results is not None:
+            if self.search_results:
+                self.search_selected = max(0, min(self.search_selected + delta, len(self.search_results) - 1))
+        elif self.view_keys:
+            self.selected_index = max(0, min(self.selected_index + delta, len(self.view_keys) - 1))
+
+    def _row_count(self):
+        return len(self.search_results) if self.search_results is not None else len(self.view_keys)
+
+    def _get_search_results_formatted_text(self):
+        if not self.search_results:
+            return FormattedText([("italic", "<No matches, Esc to go back>")])
+
+        height = self._visible_height() - 1 # The first line is the title
+        first = max(0, min(self.search_selected - height // 2, len(self.search_results) - height))
+        fragments = [("bold", f"{len(self.search_results)} match(es), Enter: Go to path, Esc: Back\n")]
+        for i in range(first, min(first + height, len(self.search_results))):
+            term, path = self.search_results[i]
+            row = path if path == term or path.endswith("." + term) else f"{path} = {term!r}"
+            if i == self.search_selected:
+                fragments.append((SELECTED_ROW_STYLE, f"> {row}\n"))
+            else:
+                fragments.append(("", f"  {row}\n"))
+        return FormattedText(fragments)
+
+    def _get_pending_changes_formatted_text(self):
+        if not self._journal_position:
+            return FormattedText([("italic", "<No pending changes>")])
+        fragments = [("bold", f"Pending changes ({self._journal_position}), Ctrl-P to go back:\n")]
+        for path, key_or_idx, old_value, new_value in self.journal[:self._journal_position]:
+            full_path = "/".join(map(str, path + (key_or_idx,)))
+            fragments.append(("", f"  {full_path}: {old_value!r} -> {new_value!r}\n"))
+        return FormattedText(fragments)
+
+    def _get_main_content_formatted_text(self):
+        if self.showing_pending:
+            return self._get_pending_changes_formatted_text()
+        if self.search_results is not None:
+            return self._get_search_results_formatted_text()
+
+        # Only the rows inside the viewport are formatted, so the cost of a redraw does not
+        # depend on the size of the table being viewed.
+        if not self.view_keys:
+            return FormattedText([("italic", "<Loading...>" if self.loading else "<Empty>")])
+
+        height = self._visible_height()
+        if self.selected_index < self.scroll_offset:
+            self.scroll_offset = self.selected_index
+        elif self.selected_index >= self.scroll_offset + height:
+            self.scroll_offset = self.selected_index - height + 1
+        self.scroll_offset = max(0, min(self.scroll_offset, len(self.view_keys) - 1))
+
+        # Keep the cache bounded to the viewport and its margin
+        first = max(0, self.scroll_offset - VIEWPORT_MARGIN)
+        last = min(len(self.view_keys), self.scroll_offset + height + VIEWPORT_MARGIN)
+        if len(self._row_cache) > 4 * (height + 2 * VIEWPORT_MARGIN):
+            self._row_cache = {i: row for i, row in self._row_cache.items() if first <= i < last}
+
+        fragments = []
+        for i in range(first, last):
+            row = self._format_row(i)
+            if self.scroll_offset <= i < self.scroll_offset + height:
+                if i == self.selected_index:
+                    fragments.append((SELECTED_ROW_STYLE, f"> {row}\n")) # Highlight selected line
+                else:
+                    fragments.append(("", f"  {row}\n"))
+        return FormattedText(fragments)
 
 
     def _get_error_text(self):
         return HTML(f"<style fg='red'>{self.error_message}</style>")
 
     def _start_editing_value(self):
-        if not self.view_items:
+        if not self.view_keys:
             return
         
         self.editing_mode = True
@@ -119,7 +299,7 @@ class LuaStateEditor:
         # if we were to allow deeper navigation while editing (not current design).
         self.editing_path_to_parent = list(self.current_path) 
         
-        key_or_idx, value = self.view_items[self.selected_index]
+        key_or_idx, value = self._item_at(self.selected_index)
         self.editing_key_or_idx = key_or_idx
         self.original_value_for_edit = value
         
@@ -159,68 +339,186 @@ class LuaStateEditor:
             self.error_message = f"Invalid value: Expected {original_type.__name__}"
 
         if coercion_success:
-            parent_data = self.working_data
-            for path_segment in self.editing_path_to_parent:
-                parent_data = parent_data[path_segment]
-            
-            parent_data[self.editing_key_or_idx] = new_value
-            
-            # Update current_view_data if we edited an item in it directly
-            if self.editing_path_to_parent == self.current_path:
-                 self.current_view_data[self.editing_key_or_idx] = new_value
+            if new_value != self.original_value_for_edit:
+                self._record_edit(
+                    tuple(self.editing_path_to_parent), self.editing_key_or_idx,
+                    self.original_value_for_edit, new_value
+                )
 
             self.editing_mode = False
             self.error_message = ""
-            self._update_view_items() # Refresh main display
+            self._row_cache.pop(self.selected_index, None) # Refresh the edited row only
             self.app.layout.focus(self.main_content_text)
         else:
             # Keep editing_mode = True and focus on input area
             self.app.layout.focus(self.edit_input_area)
 
 
+    def _record_edit(self, path, key_or_idx, old_value, new_value):
+        # A new edit discards anything that was undone
+        del self.journal[self._journal_position:]
+        self.journal.append((path, key_or_idx, old_value, new_value))
+        self._journal_position += 1
+        self._pending[(path, key_or_idx)] = new_value
+
+    def _rebuild_pending(self):
+        self._pending = {}
+        for path, key_or_idx, _, new_value in self.journal[:self._journal_position]:
+            self._pending[(path, key_or_idx)] = new_value
+        self._row_cache = {}
+
+    def undo(self):
+        if self._journal_position > 0:
+            self._journal_position -= 1
+            self._rebuild_pending()
+
+    def redo(self):
+        if self._journal_position < len(self.journal):
+            self._journal_position += 1
+            self._rebuild_pending()
+
+    def _apply_journal(self):
+        """Writes the applied journal entries into the live state and returns them."""
+        applied = self.journal[:self._journal_position]
+        for path, key_or_idx, _, new_value in applied:
+            parent_data = self.data
+            for path_segment in path:
+                parent_data = parent_data[path_segment]
+            parent_data[key_or_idx] = new_value
+        return applied
+
     def _cancel_editing_value(self):
         self.editing_mode = False
         self.error_message = ""
         self.app.layout.focus(self.main_content_text)
 
 
+    def _start_search(self):
+        if self.loading:
+            self.error_message = "Still loading the save, try again once loading has finished."
+            return
+        self.searching = True
+        self.showing_pending = False
+        self.error_message = ""
+        self.search_input_area.text = ""
+        self.app.layout.focus(self.search_input_area)
+
+    def _submit_search(self):
+        query = self.search_input_area.text
+        self.searching = False
+        self.app.layout.focus(self.main_content_text)
+        if not query:
+            return
+
+        if self._search_index is None:
+            self._search_index = StateIndex.from_table(self.data)
+        self.search_results = self._search_index.search(query, limit=SEARCH_RESULT_LIMIT)
+        self.search_selected = 0
+
+    def _cancel_search(self):
+        self.searching = False
+        self.app.layout.focus(self.main_content_text)
+
+    def _open_child(self, key_or_idx, value):
+        if isinstance(value, LazyLuaTable):
+            # Decode the table's own entries now; its sub-tables stay placeholders
+            value = value.load()
+            self.current_view_data[key_or_idx] = value
+
+        self._view_stack.append((self.current_view_data, self.selected_index, self.scroll_offset))
+        self.current_path.append(key_or_idx)
+        self.current_view_data = value
+        self._update_view_items()
+        self.selected_index = 0
+
+    def _jump_to_path(self, path):
+        """Opens the table containing the entry at a dotted path and selects the entry."""
+        self.current_path = []
+        self.current_view_data = self.data
+        self._view_stack = []
+        self._update_view_items()
+
+        components = split_path(path)
+        for depth, component in enumerate(components):
+            if isinstance(self.current_view_data, list):
+                key_or_idx = int(component)
+            else:
+                key_or_idx = resolve_key(self.current_view_data, component)
+            self.selected_index = self.view_keys.index(key_or_idx)
+            if depth < len(components) - 1:
+                self._open_child(key_or_idx, self.current_view_data[key_or_idx])
+
     def _setup_key_bindings(self):
-        # Condition to disable when in editing mode
-        not_editing = ~Condition(lambda: self.editing_mode)
+        # Condition to disable when in editing or search mode
+        not_editing = ~Condition(lambda: self.editing_mode or self.searching)
 
         @self.kb.add('up', filter=not_editing)
         def _(event):
-            if self.selected_index > 0:
-                self.selected_index -= 1
+            self._move_selection(-1)
         
         @self.kb.add('down', filter=not_editing)
         def _(event):
-            if self.view_items and self.selected_index < len(self.view_items) - 1:
-                self.selected_index += 1
+            self._move_selection(1)
+
+        @self.kb.add('pageup', filter=not_editing)
+        def _(event):
+            self._move_selection(-self._visible_height())
+
+        @self.kb.add('pagedown', filter=not_editing)
+        def _(event):
+            self._move_selection(self._visible_height())
+
+        @self.kb.add('home', filter=not_editing)
+        def _(event):
+            self._move_selection(-self._row_count())
+
+        @self.kb.add('end', filter=not_editing)
+        def _(event):
+            self._move_selection(self._row_count())
         
         @self.kb.add('escape', filter=not_editing)
         def _(event):
-            if self.current_path:
+            if self.showing_pending:
+                self.showing_pending = False
+            elif self.search_results is not None:
+                self.search_results = None
+            elif self._view_stack:
                 self.current_path.pop()
-                self._rebuild_current_view_from_path()
+                self.current_view_data, selected_index, scroll_offset = self._view_stack.pop()
                 self._update_view_items()
-                self.selected_index = 0 
+                self.selected_index = selected_index
+                self.scroll_offset = scroll_offset
         
-        @self.kb.add('enter', filter=not_editing)
+        @self.kb.add('enter', filter=not_editing & ~Condition(lambda: self.showing_pending))
         def _(event):
-            if not self.view_items:
+            if self.search_results is not None:
+                if self.search_results:
+                    self._jump_to_path(self.search_results[self.search_selected][1])
+                    self.search_results = None
+                return
+
+            if not self.view_keys:
                 return
 
-            key_or_idx, value = self.view_items[self.selected_index]
+            key_or_idx, value = self._item_at(self.selected_index)
             
-            if isinstance(value, (dict, list)):
-                self.current_path.append(key_or_idx)
-                self.current_view_data = value
-                self._update_view_items()
-                self.selected_index = 0
+            if isinstance(value, (dict, list, LazyLuaTable)):
+                self._open_child(key_or_idx, value)
             else: # Primitive value
                 self._start_editing_value()
 
+        @self.kb.add('c-z', filter=not_editing)
+        def _(event):
+            self.undo()
+
+        @self.kb.add('c-y', filter=not_editing)
+        def _(event):
+            self.redo()
+
+        @self.kb.add('c-p', filter=not_editing)
+        def _(event):
+            self.showing_pending = not self.showing_pending
+
         # Keybindings for editing mode
         editing = Condition(lambda: self.editing_mode)
 
@@ -232,6 +530,20 @@ class LuaStateEditor:
         def _(event):
             self._cancel_editing_value()
 
+        @self.kb.add('/', filter=not_editing)
+        def _(event):
+            self._start_search()
+
+        searching = Condition(lambda: self.searching)
+
+        @self.kb.add('enter', filter=searching)
+        def _(event):
+            self._submit_search()
+
+        @self.kb.add('escape', filter=searching)
+        def _(event):
+            self._cancel_search()
+
 
         # Global keybindings (always active)
         @self.kb.add('c-s') 
@@ -242,9 +554,13 @@ class LuaStateEditor:
                 self._submit_edited_value() # Attempt to submit, then exit
                 if self.editing_mode: # If submit failed (e.g. validation error)
                     return # Don't exit yet
+            if self.loading:
+                # Saving now would drop the top-level keys that have not been loaded yet
+                self.error_message = "Still loading the save, try again once loading has finished."
+                return
             
             self.user_saved = True
-            self.app.exit(result=self.working_data)
+            self.app.exit(result=self._apply_journal())
 
         @self.kb.add('c-q') 
         def _(event):
@@ -256,20 +572,111 @@ class LuaStateEditor:
             self.user_saved = False
             self.app.exit(result=None)
             
-    def _rebuild_current_view_from_path(self): # This is the correct, single definition
-        # Navigate from self.working_data using self.current_path
-        target_data = self.working_data
-        for path_segment in self.current_path:
-            target_data = target_data[path_segment]
-        self.current_view_data = target_data
-
-
     def run(self):
+        """
+        Runs the editor until Ctrl-S or Ctrl-Q.
+
+        :return: The journal entries applied to the state on Ctrl-S, or None on Ctrl-Q
+        """
         # This will block until Application.exit() is called.
         # The result passed to exit() will be returned by app.run().
-        return self.app.run()
+        return self.app.run(pre_run=self._start_loader)
+
+def benchmark_redraw(entries=50000, keypresses=1000):
+    """
+    Measures keypress-to-redraw latency while scrolling through a table of `entries` rows.
+
+    Each simulated keypress moves the selection down one row and then formats the content,
+    path and header controls, which is what prompt_toolkit does on every redraw.
+    """
+    from prompt_toolkit.input import DummyInput
+    from prompt_toolkit.output import DummyOutput
+
+    table = {float(i): {"GameplayTime": float(i), "Cleared": i % 3 == 0} for i in range(1, entries + 1)}
+    editor = LuaStateEditor({"GameState": {"RunHistory": table}}, input=DummyInput(), output=DummyOutput())
+
+    def redraw():
+        editor._get_header_text()
+        editor._get_path_text()
+        editor._get_main_content_formatted_text()
+
+    # Opening the table: Enter on GameState, then on RunHistory
+    start = time.perf_counter()
+    for key in ("GameState", "RunHistory"):
+        editor.current_path.append(key)
+        editor.current_view_data = editor.current_view_data[key]
+        editor._update_view_items()
+        editor.selected_index = 0
+    redraw()
+    open_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(keypresses):
+        start = time.perf_counter()
+        editor._move_selection(1)
+        redraw()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return {
+        "entries": entries,
+        "keypresses": keypresses,
+        "open_ms": open_ms,
+        "median_ms": latencies[len(latencies) // 2],
+        "p99_ms": latencies[int(len(latencies) * 0.99)],
+        "max_ms": latencies[-1],
+    }
 
-if __name__ == '__main__':
+def benchmark_first_paint(save_path):
+    """
+    Compares the time until the editor first paints when it decodes the save in the background
+    with the time a blocking full load of the same save takes before any UI can appear.
+    """
+    from io import BytesIO
+    from prompt_toolkit.input import create_pipe_input
+    from prompt_toolkit.output import DummyOutput
+    from luabins import decode_luabins
+    from models.lazy_lua_table import iter_lazy_state
+    from models.lua_state import decompress_lua_state_bytes
+    from models.raw_save_file import RawSaveFile
+
+    start = time.perf_counter()
+    raw_save_file = RawSaveFile.from_file(save_path)
+    decode_luabins(BytesIO(decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))))
+    blocking_ms = (time.perf_counter() - start) * 1000
+
+    def load_top_level_entries():
+        raw_save_file = RawSaveFile.from_file(save_path)
+        lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+        yield from iter_lazy_state(lua_bytes)
+
+    with create_pipe_input() as pipe_input:
+        editor = LuaStateEditor(
+            {}, input=pipe_input, output=DummyOutput(), loader=load_top_level_entries, started_at=time.perf_counter()
+        )
+
+        def exit_when_loaded(_):
+            if not editor.loading and not editor.app.is_done:
+                editor.app.exit()
+
+        editor.app.after_render += exit_when_loaded
+        editor.run()
+
+    return {"blocking_load_ms": blocking_ms, "first_paint_ms": editor.first_paint_ms, "load_ms": editor.load_ms}
+
+if __name__ == '__main__' and '--benchmark-open' in sys.argv:
+    save_path = sys.argv[sys.argv.index('--benchmark-open') + 1]
+    result = benchmark_first_paint(save_path)
+    print(f"Opening {save_path}:")
+    print(f"  blocking full decode: {result['blocking_load_ms']:.1f} ms before the UI appears")
+    print(f"  background decode: first paint after {result['first_paint_ms']:.1f} ms, "
+          f"top-level keys loaded after {result['load_ms']:.1f} ms")
+elif __name__ == '__main__' and '--benchmark' in sys.argv:
+    result = benchmark_redraw()
+    print(f"Keypress-to-redraw latency over {result['keypresses']} keypresses on a {result['entries']}-entry table:")
+    print(f"  open table: {result['open_ms']:.2f} ms")
+    print(f"  median: {result['median_ms']:.3f} ms  p99: {result['p99_ms']:.3f} ms  max: {result['max_ms']:.3f} ms")
+elif __name__ == '__main__':
     # Example Usage (for testing this module directly)
     sample_lua_data = {
         "GameState": {
@@ -283,15 +690,15 @@ if __name__ == '__main__':
         "EmptyDict": {}
     }
     editor = LuaStateEditor(sample_lua_data)
-    final_data = editor.run()
+    applied_edits = editor.run()
 
     if editor.user_saved: # Check the flag set by Ctrl-S
-        print("Data saved:")
-        # Basic diff or print (replace with better diff if complex)
-        # For now, just print if it's different or what was returned
-        if final_data != sample_lua_data: # This will be true due to deepcopy if no changes made
-             print(final_data) # In real use, this would be processed further
-        else: # if final_data is None (Ctrl-Q) or same as original
-             print("Data was not changed or quit without saving.")
+        if applied_edits:
+            print(f"Applied {len(applied_edits)} edit(s):")
+            for path, key_or_idx, old_value, new_value in applied_edits:
+                print(f"  {'/'.join(map(str, path + (key_or_idx,)))}: {old_value!r} -> {new_value!r}")
+            print(sample_lua_data)
+        else:
+            print("Data was not changed.")
     else:
         print("Exited without saving.")
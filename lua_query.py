@@ -0,0 +1,256 @@
+''' Path query language for reading and bulk-writing the Lua state '''
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from models.lazy_lua_table import LazyLuaTable
+from models.lua_path import format_key, join_path, resolve_key
+
+# A query is a dotted path whose components may be:
+#   Name        a key (numbers match Lua number keys, so "12" matches RunHistory attempt 12)
+#   *           any key at this level
+#   **          any number of levels, including none
+# and any component but ** may be followed by predicates on the matched value:
+#   [Field=value]   the value is a table whose Field compares equal (also !=, <, <=, >, >=)
+#   [Field]         the value is a table that has Field
+#   [>=value]       the value itself compares (no field name)
+# Literals are numbers, true, false, nil, or strings (quoted with ' or " if they contain
+# special characters). Example: GameState.RunHistory.*[Cleared=true].GameplayTime
+
+KEY = "key"
+ANY = "any"
+DESCENDANTS = "descendants"
+
+_MISSING = object()
+_PREDICATE = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)?\s*(?:(!=|<=|>=|=|<|>)\s*(.+?))?\s*$", re.DOTALL)
+_NUMBER = re.compile(r"^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+_COMPARISONS: Dict[str, Callable[[Any, Any], bool]] = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def parse_literal(text: str) -> Any:
+    """Parses a query or set value: numbers become Lua numbers (floats), plus true/false/nil/strings."""
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    if text == "true":
+        return True
+    if text == "false":
+        return False
+    if text == "nil":
+        return None
+    if _NUMBER.match(text):
+        return float(text)
+    return text
+
+
+def _as_table(value):
+    if isinstance(value, LazyLuaTable):
+        return value.load()
+    return value
+
+
+class _Predicate:
+    def __init__(self, text: str):
+        match = _PREDICATE.match(text)
+        if match is None or (match.group(1) is None and match.group(2) is None):
+            raise ValueError(f"Invalid predicate: [{text}]")
+        self.field, self.operator, literal = match.groups()
+        self.literal = parse_literal(literal) if self.operator else None
+        self.compare = _COMPARISONS.get(self.operator)
+
+    def __call__(self, value) -> bool:
+        if self.field is not None:
+            table = _as_table(value)
+            if not isinstance(table, dict):
+                return False
+            value = table.get(resolve_key(table, self.field), _MISSING)
+            if value is _MISSING:
+                return False
+            if self.operator is None:
+                return True
+        if self.operator not in ("=", "!=") and (
+                isinstance(value, bool) or not isinstance(value, float) or not isinstance(self.literal, float)
+        ):
+            # Ordering comparisons only apply to numbers
+            return False
+        return self.compare(value, self.literal)
+
+
+class _Step:
+    def __init__(self, kind: str, name: Optional[str] = None, predicates: Tuple[_Predicate, ...] = ()):
+        self.kind = kind
+        self.name = name
+        self.predicates = predicates
+
+    def accepts_key(self, key) -> bool:
+        return self.kind != KEY or format_key(key) == self.name
+
+    def accepts(self, key, value) -> bool:
+        return self.accepts_key(key) and all(predicate(value) for predicate in self.predicates)
+
+
+def _split_components(text: str) -> List[str]:
+    # Splits on dots that are not inside a predicate or a quoted string
+    components = []
+    current = []
+    depth = 0
+    quote = None
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"" and depth:
+            quote = char
+        elif char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f"Unbalanced ']' in query: {text}")
+        elif char == "." and not depth:
+            components.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if depth or quote:
+        raise ValueError(f"Unterminated predicate or string in query: {text}")
+    components.append("".join(current))
+    return components
+
+
+def _compile_step(component: str) -> _Step:
+    bracket = component.find("[")
+    name = (component if bracket < 0 else component[:bracket]).strip()
+    predicates = []
+    rest = "" if bracket < 0 else component[bracket:]
+    while rest:
+        end = _find_predicate_end(rest)
+        predicates.append(_Predicate(rest[1:end]))
+        rest = rest[end + 1:].strip()
+
+    if not name:
+        raise ValueError(f"Empty path component in query: '{component}'")
+    if name == "**":
+        if predicates:
+            raise ValueError("Predicates are not supported on '**'")
+        return _Step(DESCENDANTS)
+    if name == "*":
+        return _Step(ANY, predicates=tuple(predicates))
+    return _Step(KEY, name, tuple(predicates))
+
+
+def _find_predicate_end(text: str) -> int:
+    if not text.startswith("["):
+        raise ValueError(f"Unexpected text after predicate: '{text}'")
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "]":
+            return i
+    raise ValueError(f"Unterminated predicate: '{text}'")
+
+
+class CompiledQuery:
+    """
+    A query compiled into steps, evaluated over a state table in one traversal.
+
+    The traversal tracks the set of steps each table can be at (more than one because of '**')
+    and only descends into children that advance at least one of them, so subtrees that cannot
+    match are never visited. Where every step left is a plain key, the children are looked up
+    directly instead of being iterated.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.steps = [_compile_step(component) for component in _split_components(text)]
+
+    def _closure(self, positions) -> frozenset:
+        # '**' also matches zero levels, so it lets the following step apply at the same table
+        result = set(positions)
+        for position in positions:
+            while position < len(self.steps) and self.steps[position].kind == DESCENDANTS:
+                position += 1
+                result.add(position)
+        return frozenset(result)
+
+    def _candidate_keys(self, table, positions) -> Optional[List[Any]]:
+        # Direct lookups when only plain key steps are left, otherwise None (iterate everything)
+        keys = []
+        for position in positions:
+            step = self.steps[position]
+            if step.kind != KEY:
+                return None
+            key = resolve_key(table, step.name)
+            if key in table and key not in keys:
+                keys.append(key)
+        return keys
+
+    def _walk(self, table, positions, path, new_value) -> Iterator[Tuple[List[Any], Any]]:
+        positions = frozenset(position for position in positions if position < len(self.steps))
+        if not positions:
+            return
+
+        if isinstance(table, list):
+            keys = range(len(table))
+        else:
+            keys = self._candidate_keys(table, positions)
+            if keys is None:
+                keys = list(table.keys())
+
+        for key in keys:
+            value = table[key]
+            next_positions = set()
+            for position in positions:
+                step = self.steps[position]
+                if step.kind == DESCENDANTS:
+                    next_positions.add(position)
+                    continue
+                if step.predicates and isinstance(value, LazyLuaTable) and step.accepts_key(key):
+                    # Decode the table's own entries once for the predicates and the descent
+                    value = table[key] = value.load()
+                if step.accepts(key, value):
+                    next_positions.add(position + 1)
+            if not next_positions:
+                continue # Nothing below this key can match
+
+            next_positions = self._closure(next_positions)
+            child_path = path + [key]
+            if len(self.steps) in next_positions:
+                if new_value is not _MISSING:
+                    # Bulk writes happen as the matches are found
+                    table[key] = new_value
+                    yield child_path, value
+                    value = new_value
+                else:
+                    yield child_path, value
+
+            if isinstance(value, LazyLuaTable):
+                # Decode the table's own entries, keeping the result for later visits
+                value = table[key] = value.load()
+            if isinstance(value, (dict, list)):
+                yield from self._walk(value, next_positions, child_path, new_value)
+
+    def find(self, state: Dict[Any, Any]) -> Iterator[Tuple[str, Any]]:
+        """Yields (dotted path, value) for every match in the state, in traversal order."""
+        for path, value in self._walk(state, self._closure({0}), [], _MISSING):
+            yield join_path(path), value
+
+    def set(self, state: Dict[Any, Any], new_value: Any) -> List[Tuple[str, Any]]:
+        """Replaces every match in the state with new_value, returning (dotted path, old value)."""
+        return [(join_path(path), old_value) for path, old_value in self._walk(state, self._closure({0}), [], new_value)]
+
+
+def compile_query(text: str) -> CompiledQuery:
+    """Compiles a path query. Raises ValueError for invalid syntax."""
+    return CompiledQuery(text)
@@ -0,0 +1,235 @@
+''' Counters and histograms for batch and daemon runs, written as a Prometheus textfile or JSON '''
+import bisect
+import json
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Metrics are off unless enable_metrics() is called (the CLI's --metrics). While they are off,
+# the recording functions below return after one global check, so instrumented code pays well
+# under a microsecond per call; run `python metrics.py --benchmark` to measure it.
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+FILES_PROCESSED = "pluto_files_processed_total"
+BYTES_READ = "pluto_bytes_read_total"
+BYTES_WRITTEN = "pluto_bytes_written_total"
+CACHE_HITS = "pluto_cache_hits_total"
+CACHE_MISSES = "pluto_cache_misses_total"
+ERRORS = "pluto_errors_total"
+STAGE_SECONDS = "pluto_stage_seconds"
+COMMAND_SECONDS = "pluto_command_seconds"
+DECODED_STATE_BYTES = "pluto_decoded_state_bytes"
+
+_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_BYTES_BUCKETS = tuple(float(1 << shift) for shift in range(16, 26)) # 64 KiB to 32 MiB
+
+# name: (type, help, histogram buckets)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    FILES_PROCESSED: (COUNTER, "Saves parsed", ()),
+    BYTES_READ: (COUNTER, "Bytes of saves read from disk", ()),
+    BYTES_WRITTEN: (COUNTER, "Bytes of saves written to disk", ()),
+    CACHE_HITS: (COUNTER, "Lookups answered from a cache, by cache", ()),
+    CACHE_MISSES: (COUNTER, "Lookups that had to rebuild a cache entry, by cache", ()),
+    ERRORS: (COUNTER, "Failed commands, and saves that failed in bulk commands, by command", ()),
+    STAGE_SECONDS: (HISTOGRAM, "Time spent in each stage of reading and writing saves", _SECONDS_BUCKETS),
+    COMMAND_SECONDS: (HISTOGRAM, "Run time of each command", _SECONDS_BUCKETS),
+    DECODED_STATE_BYTES: (HISTOGRAM, "Size of decompressed Lua states", _BYTES_BUCKETS),
+}
+
+# Labels are tuples of (name, value) pairs, e.g. (("stage", "decode"),)
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one counts values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+
+    def inc(self, name: str, amount: float = 1, labels: Labels = ()):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = _Histogram(METRICS[name][2])
+        histogram.observe(value)
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text format (for node_exporter's textfile collector)."""
+        lines = []
+        for name, (metric_type, help_text, _) in METRICS.items():
+            if metric_type == COUNTER:
+                samples = [(labels, value) for (metric, labels), value in sorted(self.counters.items()) if metric == name]
+            else:
+                samples = [(labels, value) for (metric, labels), value in sorted(self.histograms.items()) if metric == name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if metric_type == COUNTER:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                    continue
+                for bound, count in value.cumulative():
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(self.counters.items()):
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "buckets": dict(histogram.cumulative()),
+                "sum": histogram.sum,
+                "count": histogram.count,
+            })
+        return result
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+_registry: Optional[MetricsRegistry] = None
+_output_path: Optional[str] = None
+
+
+def enable_metrics(output_path: Optional[str] = None) -> MetricsRegistry:
+    """Starts recording metrics; write_metrics() then writes them to output_path."""
+    global _registry, _output_path
+    if _registry is None:
+        _registry = MetricsRegistry()
+    _output_path = output_path
+    return _registry
+
+
+def disable_metrics():
+    global _registry, _output_path
+    _registry = None
+    _output_path = None
+
+
+def inc(name: str, amount: float = 1, labels: Labels = ()):
+    if _registry is not None:
+        _registry.inc(name, amount, labels)
+
+
+def observe(name: str, value: float, labels: Labels = ()):
+    if _registry is not None:
+        _registry.observe(name, value, labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timer:
+    def __init__(self, registry: MetricsRegistry, name: str, labels: Labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def stage_timer(stage: str):
+    """Times a with block into pluto_stage_seconds{stage=...}."""
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer(_registry, STAGE_SECONDS, (("stage", stage),))
+
+
+def write_metrics(path: Optional[str] = None):
+    """
+    Writes the metrics to path (default: the one given to enable_metrics), as JSON if it ends in
+    .json and in the Prometheus text format otherwise. The file is replaced atomically, so a
+    collector never reads it half-written. Does nothing while metrics are off.
+    """
+    from durable_write import NONE, atomic_write_bytes
+    path = path or _output_path
+    if _registry is None or path is None:
+        return
+    if path.endswith(".json"):
+        text = json.dumps(_registry.to_dict(), indent=2) + "\n"
+    else:
+        text = _registry.to_prometheus()
+    atomic_write_bytes(path, text.encode("utf-8"), NONE)
+
+
+def benchmark_overhead(calls: int = 1_000_000) -> Dict[str, float]:
+    """Returns the cost in ns of inc() and stage_timer() with metrics off and on."""
+    global _registry
+    results = {}
+    previous = _registry
+    try:
+        for state, registry in (("off", None), ("on", MetricsRegistry())):
+            _registry = registry
+            start = time.perf_counter()
+            for _ in range(calls):
+                inc(FILES_PROCESSED)
+            results[f"inc, metrics {state}"] = (time.perf_counter() - start) * 1e9 / calls
+            start = time.perf_counter()
+            for _ in range(calls):
+                with stage_timer("benchmark"):
+                    pass
+            results[f"stage_timer, metrics {state}"] = (time.perf_counter() - start) * 1e9 / calls
+    finally:
+        _registry = previous
+    return results
+
+
+if __name__ == '__main__' and '--benchmark' in sys.argv:
+    for name, nanoseconds in benchmark_overhead().items():
+        print(f"  {name:>24}: {nanoseconds:7.1f} ns per call")
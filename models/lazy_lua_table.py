@@ -0,0 +1,117 @@
+import struct
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from luabins.constants import (
+    LUABINS_NIL, LUABINS_FALSE, LUABINS_TRUE, LUABINS_NUMBER, LUABINS_STRING, LUA_STR_ENCODING
+)
+from luabins.lua_table_key import LuaTableKey
+
+from models.luabins_stream import (
+    STATE_TABLE_OFFSET, TABLE_HEADER_SIZE, encode_table_header, iter_table_spans, is_table, read_value, skip_value, table_size
+)
+
+# Lazily decoded view of a luabins stream, used by the Lua state editor to show a save before the
+# whole state has been decoded. A table is kept as a LazyLuaTable placeholder (its offset in the
+# stream) until it is opened, and opening it only decodes its own entries: sub-tables become
+# placeholders in turn.
+
+
+_NUMBER = struct.Struct("<d")
+_UINT = struct.Struct("<I")
+
+
+class LazyLuaTable:
+    def __init__(self, buf, offset: int, end: Optional[int] = None):
+        self.buf = buf
+        self.offset = offset
+        self._end = end
+
+    @property
+    def end(self) -> int:
+        """Offset just past the encoded table."""
+        if self._end is None:
+            self._end = skip_value(self.buf, self.offset)
+        return self._end
+
+    def __deepcopy__(self, memo) -> 'LazyLuaTable':
+        # A placeholder never changes (opening it returns a new dict), so copies can share it
+        return self
+
+    def __len__(self) -> int:
+        # The entry count is part of the table header, so no decoding is needed for it
+        return table_size(self.buf, self.offset)
+
+    def load(self) -> Dict[Any, Any]:
+        """Decodes the entries of this table, keeping sub-tables as placeholders."""
+        table = {}
+        end = self.offset + TABLE_HEADER_SIZE
+        for key, value_start, end in iter_table_spans(self.buf, self.offset):
+            if is_table(self.buf, value_start):
+                table[key] = LazyLuaTable(self.buf, value_start, end)
+            else:
+                table[key] = read_value(self.buf, value_start)[0]
+        # The entries were walked anyway, which gives the end of the table for free
+        self._end = end
+        return table
+
+    def decode(self) -> Dict[Any, Any]:
+        """Fully decodes this table."""
+        return read_value(self.buf, self.offset)[0]
+
+
+def iter_lazy_entries(buf, offset: int) -> Iterator[Tuple[Any, Any]]:
+    """Yields (key, value) for the table at offset, with sub-tables as LazyLuaTable placeholders."""
+    for key, value_start, value_end in iter_table_spans(buf, offset):
+        if is_table(buf, value_start):
+            yield key, LazyLuaTable(buf, value_start, value_end)
+        else:
+            yield key, read_value(buf, value_start)[0]
+
+
+def iter_lazy_state(lua_bytes: bytes) -> Iterator[Tuple[Any, Any]]:
+    """Yields the top-level entries of the state table of a decompressed luabins stream."""
+    return iter_lazy_entries(memoryview(lua_bytes), STATE_TABLE_OFFSET)
+
+
+def resolve_lazy_tables(table: Dict[Any, Any]) -> Dict[Any, Any]:
+    """Replaces every placeholder left in table (in place) with its fully decoded table."""
+    for key, value in table.items():
+        if isinstance(value, LazyLuaTable):
+            table[key] = value.decode()
+        elif isinstance(value, dict):
+            resolve_lazy_tables(value)
+    return table
+
+
+def encode_lazy_value(value: Any, out: bytearray):
+    """
+    Appends the luabins encoding of a value that may contain LazyLuaTable placeholders to out.
+
+    Placeholders are copied as their original bytes, so only the tables that were decoded are
+    encoded again. Decoded tables get the same array/hash sizes encode_luabins gives them.
+    """
+    if isinstance(value, LazyLuaTable):
+        out += value.buf[value.offset:value.end]
+    elif value is None:
+        out.append(LUABINS_NIL)
+    elif value is False:
+        out.append(LUABINS_FALSE)
+    elif value is True:
+        out.append(LUABINS_TRUE)
+    elif isinstance(value, (int, float)):
+        out.append(LUABINS_NUMBER)
+        out += _NUMBER.pack(float(value))
+    elif isinstance(value, str):
+        encoded = value.encode(LUA_STR_ENCODING)
+        out.append(LUABINS_STRING)
+        out += _UINT.pack(len(encoded))
+        out += encoded
+    elif isinstance(value, (dict, list)):
+        table = value if isinstance(value, dict) else {index + 1: item for index, item in enumerate(value)}
+        array_size = sum(1 for key in table if isinstance(key, int))
+        out += encode_table_header(array_size, len(table) - array_size)
+        for key, item in table.items():
+            encode_lazy_value(key.inner if isinstance(key, LuaTableKey) else key, out)
+            encode_lazy_value(item, out)
+    else:
+        raise Exception(f"Unknown type {type(value)}")
@@ -0,0 +1,39 @@
+from typing import Any, Dict, List
+
+# Dotted paths in the same format _LuaStateProperty uses, e.g. "GameState.Resources.Gems".
+# Lua numbers used as keys (RunHistory attempts, array indices) are written without the
+# trailing ".0", so attempt 12 of the run history is "GameState.RunHistory.12".
+
+
+def format_key(key: Any) -> str:
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    if isinstance(key, float) and key.is_integer():
+        return str(int(key))
+    return str(key)
+
+
+def join_path(components: List[Any]) -> str:
+    return ".".join(format_key(component) for component in components)
+
+
+def split_path(path: str) -> List[str]:
+    return path.split(".") if path else []
+
+
+def resolve_key(table: Dict[Any, Any], component: str) -> Any:
+    """
+    Returns the key of table that a path component refers to.
+
+    String keys take precedence; otherwise a numeric component matches the Lua number key.
+    If nothing matches, the component is returned as a string key.
+    """
+    if component in table:
+        return component
+    try:
+        number = float(component)
+    except ValueError:
+        return component
+    if number in table:
+        return number
+    return component
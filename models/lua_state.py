@@ -6,9 +6,31 @@ from typing import Dict, Any, List
 from luabins import decode_luabins, encode_luabins
 import lz4.block
 
+import metrics
 from constant import SAV15_UNCOMPRESSED_SIZE, SAV16_UNCOMPRESSED_SIZE
 
 
+def decompress_lua_state_bytes(version: int, input_bytes: bytes) -> bytes:
+    """Returns the raw luabins stream of a save's lua_state, decompressing it for LZ4 versions."""
+    with metrics.stage_timer("decompress"):
+        if version == 15:
+            lua_bytes = lz4.block.decompress(input_bytes, uncompressed_size=SAV15_UNCOMPRESSED_SIZE)
+        elif version == 16:
+            lua_bytes = lz4.block.decompress(input_bytes, uncompressed_size=SAV16_UNCOMPRESSED_SIZE)
+        else:
+            lua_bytes = input_bytes
+    metrics.observe(metrics.DECODED_STATE_BYTES, len(lua_bytes))
+    return lua_bytes
+
+
+def compress_lua_state_bytes(version: int, lua_bytes: bytes) -> bytes:
+    """Inverse of decompress_lua_state_bytes: returns the lua_state field for a save version."""
+    if version <= 14:
+        return lua_bytes
+    with metrics.stage_timer("compress"):
+        return lz4.block.compress(lua_bytes, store_size=False)
+
+
 class _LuaStateProperty:
     def __init__(self, key: str, default: Any):
         self.key = key
@@ -41,16 +63,12 @@ class LuaState:
 
     @classmethod
     def from_bytes(cls, version: int, input_bytes: bytes) -> 'LuaState':
-        decompressed_bytes: bytes = input_bytes
-        if version == 15:
-            decompressed_bytes: bytes = lz4.block.decompress(input_bytes, uncompressed_size=SAV15_UNCOMPRESSED_SIZE)
-        elif version == 16:
-            decompressed_bytes: bytes = lz4.block.decompress(input_bytes, uncompressed_size=SAV16_UNCOMPRESSED_SIZE)
-
-        return LuaState.from_dict(
-            version,
-            decode_luabins(BytesIO(decompressed_bytes))
-        )
+        lua_bytes = decompress_lua_state_bytes(version, input_bytes)
+        with metrics.stage_timer("decode"):
+            return LuaState.from_dict(
+                version,
+                decode_luabins(BytesIO(lua_bytes))
+            )
 
     @classmethod
     def from_dict(cls, version: int, input_dicts: List[Dict[Any, Any]]) -> 'LuaState':
@@ -78,6 +96,12 @@ class LuaState:
     use_record = _LuaStateProperty("CurrentRun.UseRecord", {})
     text_lines = _LuaStateProperty("CurrentRun.TextLinesRecord", {})
     boons = _LuaStateProperty("CurrentRun.Hero.TraitDictionary", {})
+    run_history = _LuaStateProperty("GameState.RunHistory", {})
+
+    @classmethod
+    def property_path(cls, name: str) -> str:
+        """Returns the dotted path of a property, e.g. property_path("gems") -> "GameState.Resources.Gems"."""
+        return vars(cls)[name].key
 
     def _parse_nested_path_reference(
             self,
@@ -133,10 +157,9 @@ class LuaState:
         reference[key] = value
 
     def to_bytes(self) -> bytes:
-        if self.version <= 14:
-            return encode_luabins(self.to_dicts())
-        else:
-            return lz4.block.compress(encode_luabins(self.to_dicts()), store_size=False)
+        with metrics.stage_timer("encode"):
+            lua_bytes = encode_luabins(self.to_dicts())
+        return compress_lua_state_bytes(self.version, lua_bytes)
 
 
     def to_dicts(self) -> List[Dict[Any, Any]]:
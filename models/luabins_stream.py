@@ -0,0 +1,211 @@
+import struct
+from typing import Any, Iterator, List, Optional, Tuple
+
+from luabins.constants import (
+    LUABINS_NIL, LUABINS_FALSE, LUABINS_TRUE, LUABINS_NUMBER, LUABINS_STRING, LUABINS_TABLE, LUA_STR_ENCODING
+)
+from luabins.lua_table_key import LuaTableKey
+
+# Offset-based reader for luabins streams. Unlike luabins.decode_luabins it can skip over
+# subtrees without building Python objects for them, which makes pulling a single table
+# (such as GameState.RunHistory) out of a multi-megabyte save much cheaper.
+
+_NUMBER = struct.Struct("<d")
+_UINT = struct.Struct("<I")
+_TABLE_SIZES = struct.Struct("<II")
+
+# A stream starts with one byte holding the number of top-level values. A save's Lua state is
+# a single table, which starts right after it.
+STATE_TABLE_OFFSET = 1
+# A table is its type byte and the sizes of its array and hash parts, followed by its entries
+TABLE_HEADER_SIZE = 1 + _TABLE_SIZES.size
+
+
+def skip_value(buf, offset: int) -> int:
+    """Returns the offset just past the value starting at offset."""
+    # Iterative rather than recursive: a table just adds its keys and values to the number
+    # of values still to skip. This is the hot loop when walking past large subtrees.
+    unpack_uint = _UINT.unpack_from
+    unpack_table_sizes = _TABLE_SIZES.unpack_from
+    pending = 1
+
+    while pending:
+        pending -= 1
+        value_type = buf[offset]
+        offset += 1
+
+        if value_type == LUABINS_NUMBER:
+            offset += 8
+        elif value_type == LUABINS_STRING:
+            offset += 4 + unpack_uint(buf, offset)[0]
+        elif value_type == LUABINS_TABLE:
+            array_size, hash_size = unpack_table_sizes(buf, offset)
+            offset += 8
+            pending += 2 * (array_size + hash_size)
+        elif value_type not in (LUABINS_NIL, LUABINS_FALSE, LUABINS_TRUE):
+            raise Exception(f"Unknown type {value_type} at offset {offset - 1}")
+
+    return offset
+
+
+def read_value(buf, offset: int) -> Tuple[Any, int]:
+    """Decodes the value starting at offset, returning it and the offset just past it."""
+    value_type = buf[offset]
+    offset += 1
+
+    if value_type == LUABINS_NUMBER:
+        return _NUMBER.unpack_from(buf, offset)[0], offset + _NUMBER.size
+    elif value_type == LUABINS_STRING:
+        length = _UINT.unpack_from(buf, offset)[0]
+        offset += _UINT.size
+        return bytes(buf[offset:offset + length]).decode(LUA_STR_ENCODING), offset + length
+    elif value_type == LUABINS_TABLE:
+        array_size, hash_size = _TABLE_SIZES.unpack_from(buf, offset)
+        offset += _TABLE_SIZES.size
+        table = {}
+        for _ in range(array_size + hash_size):
+            key, offset = read_value(buf, offset)
+            if isinstance(key, dict):
+                key = LuaTableKey(key)
+            table[key], offset = read_value(buf, offset)
+        return table, offset
+    elif value_type == LUABINS_NIL:
+        return None, offset
+    elif value_type == LUABINS_FALSE:
+        return False, offset
+    elif value_type == LUABINS_TRUE:
+        return True, offset
+    else:
+        raise Exception(f"Unknown type {value_type} at offset {offset - 1}")
+
+
+def read_key(buf, offset: int) -> Tuple[Any, int]:
+    """Decodes the table key starting at offset (table keys as LuaTableKey), returning it and the offset of its value."""
+    key, offset = read_value(buf, offset)
+    if isinstance(key, dict):
+        key = LuaTableKey(key)
+    return key, offset
+
+
+def read_table_header(buf, offset: int) -> Tuple[int, int, int]:
+    """Returns the array size, hash size and offset of the first entry of the table starting at offset."""
+    if buf[offset] != LUABINS_TABLE:
+        raise Exception(f"Expected a table at offset {offset}")
+    array_size, hash_size = _TABLE_SIZES.unpack_from(buf, offset + 1)
+    return array_size, hash_size, offset + TABLE_HEADER_SIZE
+
+
+def encode_table_header(array_size: int, hash_size: int) -> bytes:
+    return bytes((LUABINS_TABLE,)) + _TABLE_SIZES.pack(array_size, hash_size)
+
+
+def iter_table(buf, offset: int) -> Iterator[Tuple[Any, int]]:
+    """
+    Yields (key, value_offset) for every entry of the table starting at offset.
+
+    The caller does not need to consume the value; the next entry is located by skipping it.
+    """
+    array_size, hash_size, offset = read_table_header(buf, offset)
+    for _ in range(array_size + hash_size):
+        key, offset = read_key(buf, offset)
+        yield key, offset
+        offset = skip_value(buf, offset)
+
+
+def iter_entry_spans(buf, offset: int) -> Iterator[Tuple[Any, int, int, int]]:
+    """
+    Yields (key, entry_offset, value_offset, end_offset) for every entry of the table starting
+    at offset. An entry's encoded key and value are buf[entry_offset:end_offset].
+    """
+    array_size, hash_size, offset = read_table_header(buf, offset)
+    for _ in range(array_size + hash_size):
+        key, value_offset = read_key(buf, offset)
+        end = skip_value(buf, value_offset)
+        yield key, offset, value_offset, end
+        offset = end
+
+
+def iter_table_spans(buf, offset: int) -> Iterator[Tuple[Any, int, int]]:
+    """Yields (key, value_offset, end_offset) for every entry of the table starting at offset."""
+    for key, _, value_offset, end in iter_entry_spans(buf, offset):
+        yield key, value_offset, end
+
+
+def read_table_entries(buf, offset: int) -> Iterator[Tuple[Any, Any, int, int]]:
+    """
+    Yields (key, value, value_offset, end_offset) for every entry of the table starting at offset.
+
+    Each value is decoded once; its encoded bytes are buf[value_offset:end_offset].
+    """
+    array_size, hash_size, offset = read_table_header(buf, offset)
+    for _ in range(array_size + hash_size):
+        key, value_offset = read_key(buf, offset)
+        value, offset = read_value(buf, value_offset)
+        yield key, value, value_offset, offset
+
+
+def is_table(buf, offset: int) -> bool:
+    return buf[offset] == LUABINS_TABLE
+
+
+def table_size(buf, offset: int) -> int:
+    """Returns the number of entries of the table starting at offset, from its header."""
+    array_size, hash_size, _ = read_table_header(buf, offset)
+    return array_size + hash_size
+
+
+def find_path(buf, path: List[Any]) -> Optional[int]:
+    """
+    Returns the offset of the value at path inside the first top-level value of a luabins stream.
+
+    :param buf: Decompressed luabins bytes (or a memoryview of them)
+    :param path: Keys to descend through, e.g. ["GameState", "RunHistory"]
+    :return: Offset of the value, or None if any component is missing
+    """
+    offset = STATE_TABLE_OFFSET
+    for component in path:
+        if buf[offset] != LUABINS_TABLE:
+            return None
+        for key, value_offset in iter_table(buf, offset):
+            if key == component:
+                offset = value_offset
+                break
+        else:
+            return None
+    return offset
+
+
+# Marks a table in the values yielded by walk_table; its entries follow it in the walk
+TABLE_START = object()
+
+
+def walk_table(buf, offset: int) -> Iterator[Tuple[Tuple[Any, ...], Any, Any]]:
+    """
+    Walks every entry below the table starting at offset in a single pass over the stream.
+
+    Yields (parent path, key, value) in stream order, where value is TABLE_START for a
+    sub-table, whose own entries are yielded right after it with the path extended by its key.
+    """
+    array_size, hash_size, offset = read_table_header(buf, offset)
+    path: List[Any] = []
+    # Entries left in each open table; path holds the keys of all open tables but the outermost
+    remaining = [array_size + hash_size]
+
+    while remaining:
+        if not remaining[-1]:
+            remaining.pop()
+            if path:
+                path.pop()
+            continue
+        remaining[-1] -= 1
+
+        key, offset = read_key(buf, offset)
+
+        if buf[offset] == LUABINS_TABLE:
+            array_size, hash_size, offset = read_table_header(buf, offset)
+            yield tuple(path), key, TABLE_START
+            path.append(key)
+            remaining.append(array_size + hash_size)
+        else:
+            value, offset = read_value(buf, offset)
+            yield tuple(path), key, value
@@ -0,0 +1,71 @@
+import json
+from typing import Any, Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from models.lua_path import format_key
+
+# Rules that apply to the values at a dotted path pattern, where "*" matches any key at one
+# level, as used by compact (retention rules) and transform (edit rules). A rule set is
+# compiled into a trie of its path components, so one traversal of a state applies all the
+# rules: starting from [root], matching_nodes() gives the nodes each key of a table leads to,
+# and the traversal only descends where that list is not empty.
+#
+# Rule files are JSON lists of objects, each with a "path" and the fields of its rule type.
+WILDCARD = "*"
+
+Rule = TypeVar("Rule")
+
+
+class RuleNode:
+    # One level of the rule paths; rules sit on the node of the value they apply to
+    def __init__(self):
+        self.children: Dict[str, 'RuleNode'] = {}
+        self.rules: List[Any] = []
+
+
+def build_rule_trie(rules: Iterable[Any]) -> RuleNode:
+    """Compiles rules (anything with a list of path .components) into a trie, keeping their order per node."""
+    root = RuleNode()
+    for rule in rules:
+        node = root
+        for component in rule.components:
+            node = node.children.setdefault(component, RuleNode())
+        node.rules.append(rule)
+    return root
+
+
+def matching_nodes(nodes: List[RuleNode], key: Any) -> List[RuleNode]:
+    """Returns the children of nodes that a table key leads to, by name and by wildcard."""
+    name = format_key(key)
+    result = []
+    for node in nodes:
+        for component in (name, WILDCARD):
+            child = node.children.get(component)
+            if child is not None:
+                result.append(child)
+    return result
+
+
+def check_rule_fields(data: Any, fields: Iterable[str]):
+    """Raises ValueError unless data is a rule object with a "path" and no fields but the given ones."""
+    if not isinstance(data, dict) or "path" not in data:
+        raise ValueError(f"A rule must be an object with a 'path': {data!r}")
+    unknown = set(data) - {"path", *fields}
+    if unknown:
+        raise ValueError(f"Unknown rule field(s) {', '.join(sorted(unknown))} in {data!r}")
+
+
+def split_rule_argument(text: str, expected: str) -> Tuple[str, str]:
+    """Splits a PATH=ARGUMENT command line rule at its last "=" (expected names the argument in errors)."""
+    path, separator, argument = text.rpartition("=")
+    if not separator or not path:
+        raise ValueError(f"Expected PATH={expected}, got '{text}'")
+    return path, argument
+
+
+def load_rule_file(path: str, from_dict: Callable[[Dict[str, Any]], Rule]) -> List[Rule]:
+    """Reads a JSON file holding a list of rule objects, building each with from_dict."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("A rules file must hold a JSON list of rules")
+    return [from_dict(rule) for rule in data]
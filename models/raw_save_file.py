@@ -1,6 +1,8 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
+import metrics
 from bin_utils import rpad_bytes
+from durable_write import atomic_write_bytes
 from constant import SAVE_DATA_V14_LENGTH, SAVE_DATA_V15_LENGTH
 from schemas.sav_14 import sav14_schema, sav14_save_data_schema
 from schemas.sav_15 import sav15_schema, sav15_save_data_schema
@@ -9,6 +11,14 @@ from schemas.version_id import version_identifier_schema
 from construct import Container # Moved import to top
 
 
+# Header fields stored next to the Lua state, in schema order. "timestamp" only exists from version 16.
+SAVE_HEADER_FIELDS = [
+    "version", "timestamp", "location", "runs", "active_meta_points",
+    "active_shrine_points", "god_mode_enabled", "hell_mode_enabled",
+    "lua_keys", "current_map_name", "start_next_map"
+]
+
+
 class RawSaveFile:
     def __init__(
             self,
@@ -26,12 +36,28 @@ class RawSaveFile:
         else:
             raise TypeError(f"save_data must be a Container or dict, got {type(save_data)}")
 
+    def header_fields(self) -> Dict[str, Any]:
+        """Returns the header fields of this save (everything except lua_state)."""
+        header = {}
+        for field_name in SAVE_HEADER_FIELDS:
+            if field_name in self.save_data:
+                value = self.save_data[field_name]
+                header[field_name] = list(value) if field_name == "lua_keys" else value
+        return header
+
     @classmethod
     def from_file(cls, path: str) -> 'RawSaveFile':
-        with open(path, 'rb') as f:
-            input_bytes = f.read()
-            version = version_identifier_schema.parse(input_bytes).version
+        with metrics.stage_timer("read"):
+            with open(path, 'rb') as f:
+                input_bytes = f.read()
+        metrics.inc(metrics.BYTES_READ, len(input_bytes))
+        return cls.from_bytes(input_bytes)
 
+    @classmethod
+    def from_bytes(cls, input_bytes: bytes) -> 'RawSaveFile':
+        version = version_identifier_schema.parse(input_bytes).version
+
+        with metrics.stage_timer("parse"):
             if version == 14:
                 parsed_schema = sav14_schema.parse(input_bytes)
             elif version == 15:
@@ -40,17 +66,18 @@ class RawSaveFile:
                 parsed_schema = sav16_schema.parse(input_bytes)
             else:
                 raise Exception(f"Unsupported version {version}")
+        metrics.inc(metrics.FILES_PROCESSED)
 
-            # The 'clean_save_data' logic is removed.
-            # RawSaveFile is instantiated with the direct parsed_schema.save_data.value (Container)
-            return RawSaveFile(
-                version,
-                parsed_schema.save_data.value 
-            )
+        # The 'clean_save_data' logic is removed.
+        # RawSaveFile is instantiated with the direct parsed_schema.save_data.value (Container)
+        return RawSaveFile(
+            version,
+            parsed_schema.save_data.value 
+        )
 
-    def to_file(self, path: str) -> None:
+    def to_bytes(self) -> bytes:
         if self.version == 14:
-            sav14_schema.build_file(
+            return sav14_schema.build(
                 {
                     'save_data': {
                         'data': rpad_bytes(
@@ -60,11 +87,10 @@ class RawSaveFile:
                             SAVE_DATA_V14_LENGTH
                         )
                     }
-                },
-                filename=path,
+                }
             )
         elif self.version == 15:
-            sav15_schema.build_file(
+            return sav15_schema.build(
                 {
                     'save_data': {
                         'data': rpad_bytes(
@@ -74,19 +100,28 @@ class RawSaveFile:
                             SAVE_DATA_V15_LENGTH
                         )
                     }
-                },
-                filename=path,
+                }
             )
         elif self.version == 16:
-            sav16_schema.build_file( # Corrected from sav15_schema to sav16_schema
+            return sav16_schema.build(
                 {
                     'save_data': {
                         'data': sav16_save_data_schema.build(
                             self.save_data
                         )
                     }
-                },
-                filename=path,
+                }
             )
         else:
             raise Exception(f"Unsupported version {self.version}")
+
+    def to_file(self, path: str, durability: Optional[str] = None) -> None:
+        """
+        Writes the save to path atomically (see durable_write), so a crash never leaves a
+        partly written save behind. durability defaults to the mode set with set_default_durability.
+        """
+        with metrics.stage_timer("build"):
+            output_bytes = self.to_bytes()
+        with metrics.stage_timer("write"):
+            atomic_write_bytes(path, output_bytes, durability)
+        metrics.inc(metrics.BYTES_WRITTEN, len(output_bytes))
@@ -44,7 +44,11 @@ class HadesSaveFile:
             version=raw_save_file.version,
             input_bytes=bytes(raw_save_file.lua_state_bytes)
         )
+        return cls.from_raw_save_file(raw_save_file, lua_state)
 
+    @classmethod
+    def from_raw_save_file(cls, raw_save_file: RawSaveFile, lua_state: LuaState):
+        """Combines the header of a parsed save with an already decoded Lua state."""
         # Unused, for debugging
         lua_state.raw_save_file = raw_save_file
 
@@ -1,28 +1,26 @@
 import argparse
 import sys
 import os # For checking file existence in export_runs
-import tempfile
-import click # Added for click.edit()
-import subprocess
 import json
+import time
 
-from models.raw_save_file import RawSaveFile # Changed import
-from models.lua_state import LuaState, lua_state_to_json_string, json_string_to_lua_state_data
-from lua_editor import LuaStateEditor # Added import
-from core_logic import (
-    load_save_file,
-    save_game_file,
-    update_lua,
-    get_save_info,
-    get_currencies,
-    get_boons,
-    update_field,
-    reset_npc_gifts,
-    export_runs_to_csv,
-    _damage_reduction_from_easy_mode_level # For displaying god mode reduction
-)
+# Subcommand handlers import what they need when they run, so that e.g. `show info` does not pay
+# for the TUI (prompt_toolkit), NumPy or the search and export modules at startup. See
+# startup_budget.py for the import-time budget of each subcommand.
+
+# state_interchange.FORMATS (JSON first), spelled out so that building the parser imports nothing
+DUMP_FORMATS = ["json", "binary"]
+# durable_write.DURABILITY_MODES (the default first)
+DURABILITY_MODES = ["full", "file", "none"]
+# structured_log.LOG_FORMATS
+LOG_FORMATS = ["text", "json"]
 
 def handle_edit_raw(args):
+    import subprocess
+    import tempfile
+    from core_logic import save_game_file
+    from models.raw_save_file import RawSaveFile
+    from state_interchange import JSON_FORMAT, dump_lua_state, load_lua_state
     # Give the user a moment to read the warning or a chance to Ctrl+C
     try:
         input("Press Enter to continue, or Ctrl+C to abort...")
@@ -49,58 +47,22 @@ def handle_edit_raw(args):
             return
 
         try:
-            print("Preparing save data for JSON conversion...")
-            # raw_save_file.save_data is a construct.Container
-            # Create a dictionary for JSON editing
-            editable_save_data_dict = {}
-            
-            # Define expected fields based on common schema structure (e.g., sav16)
-            # This list should be comprehensive for all supported versions or handled dynamically.
-            # For now, using a list similar to what was in RawSaveFile previously.
-            fields_to_copy = [
-                "version", "location", "runs", "active_meta_points",
-                "active_shrine_points", "god_mode_enabled", "hell_mode_enabled",
-                "lua_keys", "current_map_name", "start_next_map" 
-                # "lua_state" is handled separately
-                # "timestamp" is version-specific (only in v16's save_data container)
-            ]
-            if raw_save_file.version == 16 and hasattr(raw_save_file.save_data, "timestamp"):
-                fields_to_copy.insert(1, "timestamp")
-
-            for field_name in fields_to_copy:
-                if hasattr(raw_save_file.save_data, field_name):
-                    editable_save_data_dict[field_name] = getattr(raw_save_file.save_data, field_name)
-                else:
-                    # Handle cases where a field might not exist (e.g. older versions)
-                    # For simplicity, we assume fields exist if listed, or use None/default.
-                    editable_save_data_dict[field_name] = None 
-                    print(f"Warning: Field '{field_name}' not found in save_data Container for version {raw_save_file.version}. Setting to None in JSON.", file=sys.stderr)
-
-            # Handle lua_state: convert from bytes/ListContainer to list of dicts
-            lua_state_from_container = raw_save_file.save_data.lua_state
-            if isinstance(lua_state_from_container, list): # If it's ListContainer
-                lua_state_from_container = bytes(lua_state_from_container)
-            
-            if isinstance(lua_state_from_container, bytes):
-                lua_state_obj = LuaState.from_bytes(raw_save_file.version, lua_state_from_container)
-                editable_save_data_dict['lua_state'] = lua_state_obj.to_dicts()
-            else:
-                print(f"Warning: 'lua_state' in save_data Container was not bytes or list, but type {type(lua_state_from_container)}. Setting to None in JSON.", file=sys.stderr)
-                editable_save_data_dict['lua_state'] = None
-            
-            json_string = json.dumps(editable_save_data_dict, indent=2)
-            print("Save data successfully converted to JSON.")
+            what = f"'{args.path}'" if args.path else "save data"
+            print(f"Converting {what} to {args.format}...")
+            dump_data = dump_lua_state(raw_save_file, args.format, args.path)
+            print(f"Save data successfully converted to {args.format}.")
         except Exception as e:
-            print(f"Error: Failed to convert save data to JSON. Details: {e}", file=sys.stderr)
+            print(f"Error: Failed to convert save data to {args.format}. Details: {e}", file=sys.stderr)
             return
 
 
         try:
             # Create the temporary file
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.json', delete=False) as tmp_file:
+            suffix = '.json' if args.format == JSON_FORMAT else '.bin'
+            with tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, delete=False) as tmp_file:
                 temp_file_name = tmp_file.name
-                tmp_file.write(json_string)
-            print(f"JSON data has been written to a temporary file: {temp_file_name}")
+                tmp_file.write(dump_data)
+            print(f"Data has been written to a temporary file: {temp_file_name}")
         except (IOError, OSError) as e:
             print(f"Error: Could not create or write to the temporary file. Details: {e}", file=sys.stderr)
             if temp_file_name and os.path.exists(temp_file_name): 
@@ -168,11 +130,11 @@ def handle_edit_raw(args):
             return
 
         try:
-            print(f"Reading modified JSON data from temporary file: {temp_file_name}...")
-            with open(temp_file_name, 'r') as tmp_file:
-                modified_json_string = tmp_file.read()
+            print(f"Reading modified data from temporary file: {temp_file_name}...")
+            with open(temp_file_name, 'rb') as tmp_file:
+                modified_data = tmp_file.read()
             
-            if not modified_json_string.strip() and temp_file_name : # Check if file is empty or just whitespace
+            if not modified_data.strip() and temp_file_name : # Check if file is empty or just whitespace
                 print("Warning: The temporary file appears to be empty or contains only whitespace. If you proceed, this might clear parts of your save data or cause errors.", file=sys.stderr)
                 user_confirmation = input("Do you want to proceed with the empty data? (yes/no): ").strip().lower()
                 if user_confirmation != 'yes':
@@ -181,51 +143,17 @@ def handle_edit_raw(args):
         except (IOError, OSError) as e:
             print(f"Error: Could not read from the temporary file '{temp_file_name}'. Details: {e}", file=sys.stderr)
             return
-        exit()
-        try:
-            print("Parsing modified JSON data...")
-            modified_data_dict = json.loads(modified_json_string)
-            print("JSON data successfully parsed.")
-        except json.JSONDecodeError as e:
-            print(f"Error: The modified data is not valid JSON. Please correct the syntax. Details: {e}", file=sys.stderr)
-            print(f"Your modified (invalid) JSON data was left in the temporary file: {temp_file_name}", file=sys.stderr)
-            print("Tip: You can try opening this file in a text editor that highlights JSON errors to find the issue.", file=sys.stderr)
-            # Intentionally do not remove the temp_file_name here so the user can recover their work.
-            # The finally block needs to be aware of this decision if we want to persist it.
-            # For now, the finally block will still remove it. This needs refinement if data persistence is key.
-            # A flag could be set: e.g., `keep_temp_file_on_error = True`
-            return
 
         try:
             print("Updating internal save data structure with modified data...")
-            # Update the fields of the original raw_save_file.save_data Container
-            final_lua_bytes = None
-            if 'lua_state' in modified_data_dict and isinstance(modified_data_dict['lua_state'], list):
-                version_for_lua_state = modified_data_dict.get('version', raw_save_file.version)
-                lua_state_obj = LuaState.from_dict(version_for_lua_state, modified_data_dict['lua_state'])
-                final_lua_bytes = lua_state_obj.to_bytes()
-
-            for key, value in modified_data_dict.items():
-                if key == 'lua_state':
-                    if final_lua_bytes is not None:
-                        setattr(raw_save_file.save_data, key, final_lua_bytes)
-                elif hasattr(raw_save_file.save_data, key):
-                    setattr(raw_save_file.save_data, key, value)
-                # else: field in JSON not in original save_data container, might be an error or new field.
-                # For now, only update existing fields.
-            
-            # Critically, update raw_save_file.lua_state_bytes as well
-            if final_lua_bytes is not None:
-                 raw_save_file.lua_state_bytes = final_lua_bytes
-            
-            # Note: raw_save_file.save_data (the Container) has been updated directly.
-            # The assignment `raw_save_file.save_data = modified_data_dict` is no longer needed
-            # as we are modifying the container in place.
-
+            load_lua_state(raw_save_file, modified_data)
             print("Internal save data (Container) updated.")
+        except json.JSONDecodeError as e:
+            print(f"Error: The modified data is not valid JSON. Please correct the syntax. Details: {e}", file=sys.stderr)
+            print("Tip: You can try opening the file in a text editor that highlights JSON errors to find the issue.", file=sys.stderr)
+            return
         except (TypeError, KeyError, IndexError, ValueError) as e:
-            print(f"Error: The JSON data is valid, but its structure or types are not compatible with the expected save data format. Details: {e}", file=sys.stderr)
-            print(f"Your modified JSON data was left in the temporary file: {temp_file_name}", file=sys.stderr)
+            print(f"Error: The modified data does not fit the save data format. Details: {e}", file=sys.stderr)
             return
         except Exception as e:
             print(f"Error: An unexpected error occurred while updating the internal save data. Details: {e}", file=sys.stderr)
@@ -234,7 +162,7 @@ def handle_edit_raw(args):
         try:
             output_path = args.output if args.output else save_file_path
             print(f"Attempting to save all changes to: '{output_path}'...")
-            save_game_file(raw_save_file, output_path)
+            save_game_file(raw_save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
             # raw_save_file.to_file(output_path) # Use RawSaveFile.to_file
             print(f"Successfully saved changes to '{output_path}'.")
             if output_path != save_file_path:
@@ -259,25 +187,33 @@ def handle_edit_raw(args):
                 print(f"Error: Could not remove the temporary file '{temp_file_name}'. You may need to remove it manually. Details: {e}", file=sys.stderr)
 
 def handle_edit_lua(args):
+    from core_logic import save_game_file, update_lua_file
     try:
-        save_file = load_save_file(args.file)
-        update_lua(save_file)
-        
+        started_at = time.perf_counter()
+        save_file, applied_edits, editor = update_lua_file(args.file, started_at=started_at)
+        if editor.first_paint_ms is not None:
+            load_time = f"{editor.load_ms:.0f} ms" if editor.load_ms is not None else "not finished"
+            print(f"Time to first paint: {editor.first_paint_ms:.0f} ms (Lua state loaded: {load_time})")
+        if not applied_edits:
+            print("No changes made. Save file not modified.")
+            return
+
         output_path = args.output if args.output else args.file
-        save_game_file(save_file, output_path)
-        print(f"Successfully updated '{args.field}' to '{args.value}'. Saved to {output_path}")
+        save_game_file(save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+        print(f"Applied {len(applied_edits)} edit(s) to the Lua state. Saved to {output_path}")
 
     except FileNotFoundError:
         print(f"Error: Save file not found at {args.file}", file=sys.stderr)
         sys.exit(1)
     except ValueError as ve:
-        print(f"Error updating field: {ve}", file=sys.stderr)
+        print(f"Error editing Lua state: {ve}", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         print(f"An error occurred: {e}", file=sys.stderr)
         sys.exit(1)
 
 def handle_show(args):
+    from core_logic import load_save_file, get_save_info, get_currencies, get_boons, _damage_reduction_from_easy_mode_level
     try:
         save_file = load_save_file(args.file)
         if args.section == "info":
@@ -315,12 +251,13 @@ def handle_show(args):
         sys.exit(1)
 
 def handle_update(args):
+    from core_logic import load_save_file, save_game_file, update_field
     try:
         save_file = load_save_file(args.file)
         update_field(save_file, args.field, args.value)
         
         output_path = args.output if args.output else args.file
-        save_game_file(save_file, output_path)
+        save_game_file(save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
         print(f"Successfully updated '{args.field}' to '{args.value}'. Saved to {output_path}")
 
     except FileNotFoundError:
@@ -334,12 +271,13 @@ def handle_update(args):
         sys.exit(1)
 
 def handle_reset_gifts(args):
+    from core_logic import load_save_file, save_game_file, reset_npc_gifts
     try:
         save_file = load_save_file(args.file)
         reset_npc_gifts(save_file)
 
         output_path = args.output if args.output else args.file
-        save_game_file(save_file, output_path)
+        save_game_file(save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
         print(f"Successfully reset NPC gifts. Saved to {output_path}")
 
     except FileNotFoundError:
@@ -350,6 +288,7 @@ def handle_reset_gifts(args):
         sys.exit(1)
 
 def handle_export_runs(args):
+    from core_logic import load_save_file, export_runs
     try:
         # Basic check if output directory exists, or if path is a directory
         csv_path = args.csv_filepath
@@ -364,8 +303,8 @@ def handle_export_runs(args):
             print(f"Created directory: {csv_dir}")
 
         save_file = load_save_file(args.file)
-        export_runs_to_csv(save_file, csv_path)
-        # export_runs_to_csv in core_logic already prints success message
+        export_runs(save_file, csv_path, incremental=not args.full, details=args.details)
+        # export_runs in core_logic already prints success message
         # print(f"Successfully exported runs to {csv_path}")
     except FileNotFoundError:
         print(f"Error: Save file not found at {args.file}", file=sys.stderr)
@@ -374,6 +313,566 @@ def handle_export_runs(args):
         print(f"An error occurred during export: {e}", file=sys.stderr)
         sys.exit(1)
 
+def print_run_stats(stats):
+    print("Run Statistics:")
+    print(f"  Runs: {stats['runs']}")
+    print(f"  Escapes: {stats['clears']} ({stats['win_rate']:.1%})")
+    print(f"  God Mode Runs: {stats['god_mode_runs']}")
+
+    print("Win Rate by Weapon:")
+    for weapon, group in sorted(stats["by_weapon"].items(), key=lambda item: -item[1]["runs"]):
+        print(f"  {weapon}: {group['clears']}/{group['runs']} ({group['win_rate']:.1%})")
+
+    print("Win Rate by Aspect:")
+    for aspect, group in sorted(stats["by_aspect"].items(), key=lambda item: -item[1]["runs"]):
+        print(f"  {aspect}: {group['clears']}/{group['runs']} ({group['win_rate']:.1%})")
+
+    print("Heat Distribution:")
+    for heat, group in stats["heat"].items():
+        print(f"  Heat {heat}: {group['runs']} runs, {group['clears']} escapes")
+
+    print("Escape Time Percentiles (seconds):")
+    for percentile, seconds in stats["clear_time_percentiles"].items():
+        print(f"  p{percentile}: {seconds:.1f}")
+
+def handle_stats(args):
+    from core_logic import load_save_file
+    from run_stats import load_run_columns, compute_run_stats, save_run_columns_npz
+    try:
+        save_file = load_save_file(args.file)
+        columns = load_run_columns(save_file)
+        print_run_stats(compute_run_stats(columns))
+
+        if args.npz:
+            save_run_columns_npz(columns, args.npz)
+            print(f"Run columns saved to {args.npz}")
+    except FileNotFoundError:
+        print(f"Error: Save file not found at {args.file}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while computing stats: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_aggregate(args):
+    from run_aggregate import aggregate_run_history, export_aggregated_runs_to_csv
+    from run_stats import compute_run_stats, save_run_columns_npz, runs_to_columns
+    try:
+        result = aggregate_run_history([args.file] + args.paths, workers=args.jobs)
+
+        for path, error in result["errors"].items():
+            print(f"Warning: Skipped '{path}': {error}", file=sys.stderr)
+
+        runs = result["runs"]
+        if args.csv:
+            export_aggregated_runs_to_csv(runs, args.csv)
+            print(f"Successfully exported {len(runs)} runs to {args.csv}")
+        else:
+            columns = runs_to_columns(((attempt, run) for _, attempt, run in runs), len(runs))
+            print_run_stats(compute_run_stats(columns))
+            if args.npz:
+                save_run_columns_npz(columns, args.npz)
+                print(f"Run columns saved to {args.npz}")
+
+        seconds = result["seconds"]
+        runs_per_second = result["runs_read"] / seconds if seconds > 0 else 0.0
+        print(f"Read {result['runs_read']} runs from {result['files'] - len(result['errors'])} files "
+              f"in {seconds:.2f}s ({runs_per_second:.0f} runs/s), "
+              f"{result['duplicates']} duplicates removed, {len(runs)} unique runs.")
+    except Exception as e:
+        print(f"An error occurred during aggregation: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_export_db(args):
+    from state_export import export_lua_states
+    try:
+        result = export_lua_states(args.database, [args.file] + args.paths, incremental=not args.full)
+
+        for path, error in result["errors"].items():
+            print(f"Warning: Skipped '{path}': {error}", file=sys.stderr)
+        print(f"Exported {len(result['exported'])} saves ({result['rows']} rows) to {args.database} "
+              f"in {result['seconds']:.2f}s, {len(result['skipped'])} unchanged saves skipped.")
+    except Exception as e:
+        print(f"An error occurred during the database export: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_diff(args):
+    from save_diff import diff_save_files, format_diff_entry
+    try:
+        changes = 0
+        for entry in diff_save_files(args.file, args.other_file):
+            print(format_diff_entry(entry))
+            changes += 1
+        print(f"{changes} difference(s) between '{args.file}' and '{args.other_file}'.")
+    except FileNotFoundError as e:
+        print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while comparing saves: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_watch(args):
+    import metrics
+    from save_watch import SaveWatcher
+    directory = args.directory or os.path.dirname(os.path.abspath(args.file))
+    try:
+        if not os.path.isdir(directory):
+            print(f"Error: '{directory}' is not a directory.", file=sys.stderr)
+            sys.exit(1)
+        watcher = SaveWatcher(directory, path_filter=args.path)
+        for event in watcher.watch(interval=args.interval, use_inotify=not args.poll):
+            print(json.dumps(event, default=str), flush=True)
+            # Keep the --metrics file current while the watch runs
+            metrics.write_metrics()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"An error occurred while watching '{directory}': {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_du(args):
+    from models.raw_save_file import RawSaveFile
+    from state_usage import lua_state_usage, format_usage
+    try:
+        usage = lua_state_usage(RawSaveFile.from_file(args.file), max_depth=args.depth)
+        if args.json:
+            print(json.dumps(usage, indent=2))
+        else:
+            for line in format_usage(usage, limit=args.limit):
+                print(line)
+    except FileNotFoundError:
+        print(f"Error: Save file not found at {args.file}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while measuring the save: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_compact(args):
+    from core_logic import save_game_file
+    from models.raw_save_file import RawSaveFile
+    from save_compact import KEEP_LAST, DROP, compact_lua_state, load_rules, parse_rule_argument
+    from state_usage import format_bytes
+    try:
+        rules = load_rules(args.rules) if args.rules else []
+        rules += [parse_rule_argument(text, KEEP_LAST) for text in args.keep_last]
+        rules += [parse_rule_argument(text, DROP) for text in args.drop]
+        if not rules:
+            print("Error: No retention rules given (use --keep-last, --drop or --rules).", file=sys.stderr)
+            sys.exit(1)
+
+        raw_save_file = RawSaveFile.from_file(args.file)
+        result = compact_lua_state(raw_save_file, rules, dry_run=args.dry_run)
+
+        for rule in result["rules"]:
+            if not rule["tables"]:
+                print(f"{rule['rule']}: no table at this path")
+            else:
+                print(f"{rule['rule']}: {rule['removed']} entries removed ({format_bytes(rule['bytes'])})")
+        before, after = result["before"], result["after"]
+        print(f"Lua state: {format_bytes(before['bytes'])} -> {format_bytes(after['bytes'])} uncompressed, "
+              f"{format_bytes(before['compressed_bytes'])} -> {format_bytes(after['compressed_bytes'])} compressed")
+
+        if args.dry_run:
+            print("Dry run, save file not modified.")
+        elif not result["changed"]:
+            print("Nothing to remove. Save file not modified.")
+        else:
+            output_path = args.output if args.output else args.file
+            save_game_file(raw_save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+            print(f"Saved to {output_path}")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error in retention rules: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while compacting: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _tagged_argument(kind):
+    # Type of repeatable options sharing one dest, so their values keep their command line order
+    return lambda text: (kind, text)
+
+def handle_transform(args):
+    from core_logic import load_save_file, save_game_file
+    from state_transform import apply_rules, load_rules, parse_rule_argument
+    try:
+        rules = load_rules(args.rules) if args.rules else []
+        # In command line order, since rules on the same value run in the order they are given
+        rules += [parse_rule_argument(text, kind) for kind, text in args.edits]
+        if not rules:
+            print("Error: No rules given (use --set, --cap, --clear, --remove or --rules).", file=sys.stderr)
+            sys.exit(1)
+
+        save_file = load_save_file(args.file)
+        results = apply_rules(save_file.lua_state._active_state, rules)
+        for result in results:
+            print(f"{result['rule']}: {result['matches']} match(es)")
+
+        if not any(result["matches"] for result in results):
+            print("No rule matched. Save file not modified.")
+            return
+        output_path = args.output if args.output else args.file
+        save_game_file(save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+        print(f"Saved to {output_path}")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error in transform rules: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while transforming: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_convert(args):
+    import metrics
+    from core_logic import save_game_file
+    from save_convert import convert_save_file, convert_save_files
+
+    def write(raw_save_file, output_path):
+        save_game_file(raw_save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+
+    try:
+        if not (args.paths or args.output_dir):
+            output_path = args.output if args.output else args.file
+            from_version, converted = convert_save_file(args.file, output_path, args.to_version, write)
+            if converted:
+                print(f"Converted from version {from_version} to {args.to_version}. Saved to {output_path}")
+            else:
+                print(f"The save is already version {args.to_version}. Save file not modified.")
+            return
+
+        if args.output:
+            print("Error: --output is for a single save; use --output-dir when converting several.", file=sys.stderr)
+            sys.exit(1)
+        converted = skipped = failed = 0
+        for path, output_path, from_version, changed, error in convert_save_files(
+                [args.file] + args.paths, args.to_version, output_dir=args.output_dir, write=write
+        ):
+            if error is not None:
+                print(f"Error: Could not convert '{path}': {error}", file=sys.stderr)
+                metrics.inc(metrics.ERRORS, labels=(("command", "convert"),))
+                failed += 1
+            elif changed:
+                print(f"Converted '{path}' from version {from_version}: {output_path}")
+                converted += 1
+            else:
+                skipped += 1
+        print(f"{converted} save(s) converted to version {args.to_version}, "
+              f"{skipped} already at that version, {failed} failed.")
+        if failed:
+            sys.exit(1)
+    except FileNotFoundError as e:
+        print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error: Cannot convert: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred during conversion: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def print_recovery_report(path, output_path, report, dry_run):
+    checksum = {True: "matches", False: "does not match", None: "missing"}[report.get("checksum_matches")]
+    print(f"{path}: version {report['version']} ({report['version_source']}), "
+          f"signature {'found' if report['signature'] else 'missing'}, checksum {checksum}")
+    print(f"  Lua state found by {report['lua_state_found_by']} at offset {report['lua_state_offset']}, "
+          f"{report['lua_state_bytes']} bytes recovered")
+    for lost in report["lost"]:
+        print(f"  Lost: {lost}")
+    if not report["lost"]:
+        print("  Nothing lost.")
+    if not dry_run:
+        print(f"  Recovered save written to {output_path}")
+
+def handle_recover(args):
+    import metrics
+    from durable_write import grouped_directory_sync
+    from run_aggregate import expand_save_paths, output_dir_paths
+    from save_recover import recover_save_file, recovered_path
+
+    if args.output and args.paths:
+        print("Error: --output is for a single save; use --output-dir when recovering several.", file=sys.stderr)
+        sys.exit(1)
+    if args.output_dir and not args.dry_run:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # Directories are expanded without the *.recovered.sav files earlier runs wrote into them
+    save_paths = expand_save_paths([args.file] + args.paths)
+    if args.output:
+        targets = [(path, args.output, None) for path in save_paths]
+    elif args.output_dir:
+        targets = output_dir_paths(save_paths, args.output_dir)
+    else:
+        targets = [(path, recovered_path(path), None) for path in save_paths]
+
+    failed = 0
+    # The directories written to are synced once at the end rather than after every save
+    with grouped_directory_sync():
+        for path, output_path, error in targets:
+            if error is not None:
+                print(f"Error: Could not recover '{path}': {error}", file=sys.stderr)
+                metrics.inc(metrics.ERRORS, labels=(("command", "recover"),))
+                failed += 1
+                continue
+            try:
+                report = recover_save_file(path, output_path, version=args.version, dry_run=args.dry_run)
+                if args.json:
+                    print(json.dumps(dict(report, file=path, output=None if args.dry_run else output_path)))
+                else:
+                    print_recovery_report(path, output_path, report, args.dry_run)
+            except FileNotFoundError as e:
+                print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+                metrics.inc(metrics.ERRORS, labels=(("command", "recover"),))
+                failed += 1
+            except Exception as e:
+                print(f"Error: Could not recover '{path}': {e}", file=sys.stderr)
+                metrics.inc(metrics.ERRORS, labels=(("command", "recover"),))
+                failed += 1
+    if failed:
+        sys.exit(1)
+
+def handle_search(args):
+    from state_index import load_state_index
+    try:
+        start_time = time.perf_counter()
+        index, from_cache = load_state_index(args.file, use_cache=args.cache)
+        index_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        results = index.search(args.query, prefix=args.prefix, limit=args.limit)
+        search_time = time.perf_counter() - start_time
+
+        for term, path in results:
+            if path == term or path.endswith("." + term):
+                print(path)
+            else: # Matched a string value rather than a key name
+                print(f"{path} = {term!r}")
+
+        source = "loaded from cache" if from_cache else "built"
+        print(f"{len(results)} match(es) in {search_time * 1000:.2f} ms (index {source} in {index_time * 1000:.0f} ms).")
+        if args.limit is not None and len(results) >= args.limit:
+            print(f"Showing the first {args.limit} matches; use --limit to see more.")
+    except FileNotFoundError as e:
+        print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while searching: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_query(args):
+    from core_logic import query_lua_state, decode_query_value
+    from save_diff import format_diff_value
+    try:
+        matches = 0
+        for path, value in query_lua_state(args.file, args.query):
+            value = decode_query_value(value)
+            if args.json:
+                print(json.dumps({"path": path, "value": value}, default=str))
+            else:
+                print(f"{path} = {format_diff_value(value)}")
+            matches += 1
+            if args.limit is not None and matches >= args.limit:
+                break
+        if not args.json:
+            print(f"{matches} match(es).")
+    except FileNotFoundError as e:
+        print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error in query: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while querying: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_set(args):
+    from core_logic import load_save_file, save_game_file, set_lua_state
+    from save_diff import format_diff_value
+    try:
+        save_file = load_save_file(args.file)
+        replaced = set_lua_state(save_file, args.query, args.value)
+        for path, old_value in replaced:
+            print(f"  {path}: {format_diff_value(old_value)} -> {args.value}")
+        if not replaced:
+            print("No matches. Save file not modified.")
+            return
+
+        output_path = args.output if args.output else args.file
+        save_game_file(save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+        print(f"Set {len(replaced)} value(s). Saved to {output_path}")
+    except FileNotFoundError:
+        print(f"Error: Save file not found at {args.file}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error in query: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_dump(args):
+    from models.raw_save_file import RawSaveFile
+    from state_interchange import dump_lua_state, format_from_filename
+    try:
+        file_format = args.format or format_from_filename(args.dump_file)
+        raw_save_file = RawSaveFile.from_file(args.file)
+        data = dump_lua_state(raw_save_file, file_format, args.path)
+        with open(args.dump_file, "wb") as f:
+            f.write(data)
+        what = f"'{args.path}'" if args.path else "Lua state"
+        print(f"Dumped {what} as {file_format} to {args.dump_file} ({_format_bytes(len(data))}).")
+    except FileNotFoundError as e:
+        print(f"Error: Save file not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while dumping: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_load(args):
+    from core_logic import save_game_file
+    from models.raw_save_file import RawSaveFile
+    from state_interchange import load_lua_state
+    try:
+        raw_save_file = RawSaveFile.from_file(args.file)
+        with open(args.dump_file, "rb") as f:
+            path = load_lua_state(raw_save_file, f.read())
+
+        output_path = args.output if args.output else args.file
+        save_game_file(raw_save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+        what = f"'{path}'" if path else "Lua state"
+        print(f"Loaded {what} from {args.dump_file}. Saved to {output_path}")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error: The dump does not fit the save: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while loading: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_patch(args):
+    from core_logic import save_game_file
+    from json_patch import parse_patch, apply_patch
+    from models.raw_save_file import RawSaveFile
+    try:
+        if args.patch_file == "-":
+            patch_text = sys.stdin.read()
+        else:
+            with open(args.patch_file, "r") as f:
+                patch_text = f.read()
+        operations = parse_patch(patch_text)
+
+        raw_save_file = RawSaveFile.from_file(args.file)
+        document = apply_patch(raw_save_file, operations)
+        if not (document.header_changed or document.state_changed):
+            print(f"Applied {len(operations)} operation(s), nothing changed. Save file not modified.")
+            return
+
+        output_path = args.output if args.output else args.file
+        save_game_file(raw_save_file, output_path, snapshot=not args.no_snapshot, journal=not args.no_journal)
+        print(f"Applied {len(operations)} operation(s). Saved to {output_path}")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error: Patch not applied: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred while patching: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _format_bytes(num_bytes):
+    return f"{num_bytes / 1024:.1f} KiB"
+
+def format_journal_entry(entry):
+    changes = list(entry["paths"]) + [f"header.{field_name}" for field_name in entry["header"]]
+    total = entry["changes"]
+    shown = ", ".join(changes[:3]) + (f" (+{total - 3} more)" if total > 3 else "")
+    return f"{entry['number']:>4}  {entry['time']}  {total} change(s): {shown}"
+
+def handle_undo(args):
+    from save_journal import SaveJournal
+    try:
+        journal = SaveJournal.for_save(args.file)
+        if args.list:
+            position, entries = journal.entries()
+            if not entries:
+                print(f"No journal entries for '{args.file}'.")
+            for entry in entries:
+                marker = "*" if entry["number"] == position else " "
+                undone = "  (undone)" if entry["number"] > position else ""
+                print(f"{marker}{format_journal_entry(entry)}{undone}")
+            return
+
+        step = journal.undo if args.command == "undo" else journal.redo
+        entries = step(args.file, args.steps)
+        for entry in entries:
+            print(f"{'Undid' if args.command == 'undo' else 'Redid'} {format_journal_entry(entry).strip()}")
+        print(f"Saved to {args.file}")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as ve:
+        print(f"Error: {ve}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_snapshot(args):
+    from snapshot_store import SnapshotStore
+    try:
+        store = SnapshotStore(args.store) if args.store else SnapshotStore.for_save(args.file)
+        profile = os.path.basename(args.file)
+
+        if args.action == "create":
+            manifest = store.create(args.file)
+            print(f"Created snapshot {manifest['id']} ({_format_bytes(manifest['new_bytes'])} of new data).")
+        elif args.action == "list":
+            manifests = store.list(profile)
+            if not manifests:
+                print(f"No snapshots of '{profile}' in {store.root}")
+            for manifest in manifests:
+                header = manifest["header"]
+                print(f"  {manifest['id']}  runs: {header.get('runs')}  location: {header.get('location')}  "
+                      f"new data: {_format_bytes(manifest['new_bytes'])}")
+        elif args.action == "restore":
+            if not args.snapshot_id:
+                print("Error: restore needs the id of the snapshot to restore (see 'snapshot list').", file=sys.stderr)
+                sys.exit(1)
+            from core_logic import journal_write, read_for_journal, take_snapshot
+            output_path = args.output if args.output else args.file
+            before = None if args.no_journal else read_for_journal(output_path)
+            if os.path.exists(output_path) and not args.no_snapshot:
+                manifest = take_snapshot(output_path, store)
+                if manifest is not None:
+                    print(f"Snapshot {manifest['id']} of the current '{output_path}' saved before restoring.")
+            store.restore(args.snapshot_id, output_path)
+            if before is not None:
+                journal_write(output_path, before)
+            print(f"Restored snapshot {args.snapshot_id} to {output_path}")
+        elif args.action == "prune":
+            removed = store.prune(args.keep, profile)
+            print(f"Removed {removed['snapshots']} snapshots and {removed['objects']} unused chunks "
+                  f"({_format_bytes(removed['bytes'])} freed).")
+
+        usage = store.usage(profile)
+        if usage["snapshots"]:
+            print(f"{usage['snapshots']} snapshots of '{profile}' use {_format_bytes(usage['stored_bytes'])} "
+                  f"for {_format_bytes(usage['logical_bytes'])} of Lua state ({usage['objects']} unique chunks).")
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
 def main():
     parser = argparse.ArgumentParser(
         description="Pluto: Hades Save Editor CLI",
@@ -384,6 +883,40 @@ def main():
         required=True,
         help="Path to the Hades save file (.sav)"
     )
+    parser.add_argument(
+        "--no-snapshot",
+        action="store_true",
+        help="Do not snapshot a save before overwriting it"
+    )
+    parser.add_argument(
+        "--no-journal",
+        action="store_true",
+        help="Do not record changes in the save's journal (they cannot be undone)"
+    )
+    parser.add_argument(
+        "--durability",
+        choices=DURABILITY_MODES, default=DURABILITY_MODES[0],
+        help=("How saves are flushed to disk (every write is atomic either way):\n"
+              "  full - fsync the save and its directory (default)\n"
+              "  file - fsync the save only\n"
+              "  none - no fsync, fastest")
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Log progress (loading, saving, snapshots, journal entries) to stderr"
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS, default=LOG_FORMATS[0],
+        help="Format of the --verbose log: text (key=value fields) or json (one object per line)"
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help=("Write counters and latency histograms of the run to FILE: JSON if it ends in .json,\n"
+              "the Prometheus text format otherwise (e.g. for node_exporter's textfile collector)")
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="Available commands", required=True)
 
@@ -427,10 +960,365 @@ def main():
     reset_gifts_parser.set_defaults(func=handle_reset_gifts)
 
     # Export runs command
-    export_parser = subparsers.add_parser("export_runs", help="Export run history to CSV")
-    export_parser.add_argument("csv_filepath", help="Path to save the CSV file (e.g., runs.csv)")
+    export_parser = subparsers.add_parser("export_runs", help="Export run history to CSV or NDJSON")
+    export_parser.add_argument(
+        "csv_filepath",
+        help=("Path to save the export (e.g., runs.csv). Use a .ndjson or .jsonl extension for NDJSON.\n"
+              "Re-exporting to the same path only appends runs that are new since the last export.")
+    )
+    export_parser.add_argument(
+        "--full", action="store_true",
+        help="Rewrite the whole file instead of appending only new runs"
+    )
+    export_parser.add_argument(
+        "--details", action="store_true",
+        help="Add the gods, keepsakes and companion of each run as extra columns"
+    )
     export_parser.set_defaults(func=handle_export_runs)
 
+    # Run statistics command
+    stats_parser = subparsers.add_parser("stats", help="Show win rates, heat distribution and escape times from run history")
+    stats_parser.add_argument(
+        "--npz",
+        help="Optional: Path to save the run history columns as a NumPy .npz file"
+    )
+    stats_parser.set_defaults(func=handle_stats)
+
+    # Aggregate run history command
+    aggregate_parser = subparsers.add_parser(
+        "aggregate",
+        help="Merge the run history of several saves and backups (deduplicated per profile)"
+    )
+    aggregate_parser.add_argument(
+        "paths", nargs="*",
+        help="Additional save files or directories of saves to read alongside --file"
+    )
+    aggregate_parser.add_argument(
+        "--csv",
+        help="Optional: Write the merged runs to this CSV file instead of printing statistics"
+    )
+    aggregate_parser.add_argument(
+        "--npz",
+        help="Optional: Path to save the merged run history columns as a NumPy .npz file"
+    )
+    aggregate_parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="Optional: Number of worker processes (default: one per CPU)"
+    )
+    aggregate_parser.set_defaults(func=handle_aggregate)
+
+    # Export Lua state database command
+    export_db_parser = subparsers.add_parser(
+        "export_db",
+        help="Flatten the Lua state of --file and other saves into a SQLite database for SQL queries"
+    )
+    export_db_parser.add_argument("database", help="Path to the SQLite database (created if missing)")
+    export_db_parser.add_argument(
+        "paths", nargs="*",
+        help="Additional save files or directories of saves to export alongside --file"
+    )
+    export_db_parser.add_argument(
+        "--full", action="store_true",
+        help="Re-export every save instead of skipping the ones unchanged since the last export"
+    )
+    export_db_parser.set_defaults(func=handle_export_db)
+
+    # Diff command
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="Show added (+), removed (-) and changed (~) paths between --file and another save"
+    )
+    diff_parser.add_argument("other_file", help="Path to the save file to compare against --file")
+    diff_parser.set_defaults(func=handle_diff)
+
+    # Watch command
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Print an NDJSON event whenever a save in a directory changes, listing what changed"
+    )
+    watch_parser.add_argument(
+        "directory", nargs="?",
+        help="Directory of saves to watch (default: the directory containing --file)"
+    )
+    watch_parser.add_argument(
+        "--path",
+        help="Only report changes at or below this dotted path, e.g. GameState.Resources"
+    )
+    watch_parser.add_argument(
+        "--interval", type=float, default=1.0,
+        help="Seconds between directory scans when polling (default: 1)"
+    )
+    watch_parser.add_argument(
+        "--poll", action="store_true",
+        help="Poll file modification times and sizes even where inotify is available"
+    )
+    watch_parser.set_defaults(func=handle_watch)
+
+    # Disk usage command
+    du_parser = subparsers.add_parser(
+        "du",
+        help="Show how many bytes each subtree of the Lua state takes, uncompressed and compressed"
+    )
+    du_parser.add_argument(
+        "--depth", type=int, default=2,
+        help="Number of levels of the state to break down (default: 2)"
+    )
+    du_parser.add_argument(
+        "--limit", type=int, default=10,
+        help="Largest entries shown per table; the rest are summed up (default: 10)"
+    )
+    du_parser.add_argument(
+        "--json", action="store_true",
+        help="Print the whole tree as JSON (ignores --limit)"
+    )
+    du_parser.set_defaults(func=handle_du)
+
+    # Compact command
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Shrink the save by pruning history tables with retention rules"
+    )
+    compact_parser.add_argument(
+        "--keep-last", action="append", default=[], metavar="PATH=N",
+        help="Keep only the N entries with the largest number keys of a table, e.g. GameState.RunHistory=100"
+    )
+    compact_parser.add_argument(
+        "--drop", action="append", default=[], metavar="PATH=PATTERN",
+        help="Remove the entries of a table whose key matches a glob pattern, e.g. GameState.TextLinesRecord=*Intro*"
+    )
+    compact_parser.add_argument(
+        "--rules",
+        help='JSON file with a list of rules, e.g. [{"path": "GameState.RunHistory", "keep_last": 100}]'
+    )
+    compact_parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only report what the rules would remove and the resulting sizes"
+    )
+    compact_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save to a new file (otherwise overwrites original)"
+    )
+    compact_parser.set_defaults(func=handle_compact)
+
+    # Transform command
+    transform_parser = subparsers.add_parser(
+        "transform",
+        help="Apply several Lua state edits (set, cap, clear, remove) in one pass"
+    )
+    transform_parser.add_argument(
+        "--set", dest="edits", action="append", default=[], type=_tagged_argument("set"), metavar="PATH=VALUE",
+        help="Set the values at PATH (e.g. GameState.Resources.Gems=500); repeatable"
+    )
+    transform_parser.add_argument(
+        "--cap", dest="edits", action="append", default=[], type=_tagged_argument("cap"), metavar="PATH=N",
+        help="Lower the numbers at PATH above N (e.g. GameState.Resources.*=9999); repeatable"
+    )
+    transform_parser.add_argument(
+        "--clear", dest="edits", action="append", default=[], type=_tagged_argument("clear"), metavar="PATH",
+        help="Replace the values at PATH with empty tables; repeatable"
+    )
+    transform_parser.add_argument(
+        "--remove", dest="edits", action="append", default=[], type=_tagged_argument("remove"), metavar="PATH",
+        help="Remove the keys at PATH; repeatable"
+    )
+    transform_parser.add_argument(
+        "--rules",
+        help="Optional: JSON file with a list of rules, e.g. [{\"path\": \"GameState.Resources.Gems\", \"set\": 500}]"
+    )
+    transform_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save the modified file (overwrites original if not specified)"
+    )
+    transform_parser.set_defaults(func=handle_transform)
+
+    # Convert command
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Convert saves between versions 14, 15 and 16"
+    )
+    convert_parser.add_argument(
+        "--to-version", type=int, required=True, choices=[14, 15, 16],
+        help="Version to convert to"
+    )
+    convert_parser.add_argument(
+        "paths", nargs="*",
+        help="Additional save files or directories of saves to convert alongside --file"
+    )
+    convert_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save to a new file (otherwise overwrites original)"
+    )
+    convert_parser.add_argument(
+        "--output-dir",
+        help="Optional: Directory to write converted saves to, keeping their names (otherwise they are overwritten)"
+    )
+    convert_parser.set_defaults(func=handle_convert)
+
+    # Recover command
+    recover_parser = subparsers.add_parser(
+        "recover",
+        help="Rebuild a damaged save from whatever header fields and Lua state can still be read"
+    )
+    recover_parser.add_argument(
+        "paths", nargs="*",
+        help="Additional save files or directories of saves to recover alongside --file"
+    )
+    recover_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to write the recovered save to (default: <name>.recovered.sav next to it)"
+    )
+    recover_parser.add_argument(
+        "--output-dir",
+        help="Optional: Directory to write recovered saves to, keeping their names"
+    )
+    recover_parser.add_argument(
+        "--version", type=int, choices=[14, 15, 16],
+        help="Optional: Version of the save, if its header is too damaged to tell"
+    )
+    recover_parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only report what can be recovered"
+    )
+    recover_parser.add_argument(
+        "--json", action="store_true",
+        help="Print one JSON report per save"
+    )
+    recover_parser.set_defaults(func=handle_recover)
+
+    # Search command
+    search_parser = subparsers.add_parser(
+        "search",
+        help="Find the paths of Lua state keys and string values containing a term (case-insensitive)"
+    )
+    search_parser.add_argument("query", help="Text to look for in key names and string values")
+    search_parser.add_argument("--prefix", action="store_true", help="Only match terms starting with the query")
+    search_parser.add_argument(
+        "--limit", type=int, default=100,
+        help="Maximum number of paths to print (default: 100)"
+    )
+    search_parser.add_argument(
+        "--cache", action="store_true",
+        help="Keep the index in a file next to the save (<save>.search.json) and reuse it while the save is unchanged"
+    )
+    search_parser.set_defaults(func=handle_search)
+
+    # Query and set commands
+    query_help = ("Path query, e.g. GameState.RunHistory.*.ShrinePointsCache\n"
+                  "  *         any key at one level\n"
+                  "  **        any number of levels\n"
+                  "  [F=v]     only tables whose field F equals v (also !=, <, <=, >, >=)\n"
+                  "  [F]       only tables that have field F\n"
+                  "  [>=v]     only values that compare to v")
+    query_parser = subparsers.add_parser(
+        "query",
+        help="Print the Lua state values matching a path query",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    query_parser.add_argument("query", help=query_help)
+    query_parser.add_argument("--json", action="store_true", help="Print one JSON object per match")
+    query_parser.add_argument("--limit", type=int, help="Optional: Stop after this many matches")
+    query_parser.set_defaults(func=handle_query)
+
+    set_parser = subparsers.add_parser(
+        "set",
+        help="Set every Lua state value matching a path query and save changes",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    set_parser.add_argument("query", help=query_help)
+    set_parser.add_argument("value", help="New value: a number, true, false, nil or a string")
+    set_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save to a new file (otherwise overwrites original)"
+    )
+    set_parser.set_defaults(func=handle_set)
+
+    # Dump and load commands
+    dump_parser = subparsers.add_parser(
+        "dump",
+        help="Write the Lua state (or one subtree of it) to a JSON or binary file"
+    )
+    dump_parser.add_argument(
+        "dump_file",
+        help="File to write; .json files are JSON, anything else uses the binary format by default"
+    )
+    dump_parser.add_argument(
+        "--format", choices=DUMP_FORMATS,
+        help=("Format to write (default: from the file extension). The binary format keeps every Lua\n"
+              "type and number key as it is and is much faster for large saves.")
+    )
+    dump_parser.add_argument("--path", help="Optional: Dotted path of the subtree to dump, e.g. GameState.Resources")
+    dump_parser.set_defaults(func=handle_dump)
+
+    load_parser = subparsers.add_parser(
+        "load",
+        help="Replace the Lua state (or the subtree it was dumped from) with a dump and save changes"
+    )
+    load_parser.add_argument("dump_file", help="File written by 'dump' or 'edit_raw' (format is detected)")
+    load_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save to a new file (otherwise overwrites original)"
+    )
+    load_parser.set_defaults(func=handle_load)
+
+    # Patch command
+    patch_parser = subparsers.add_parser(
+        "patch",
+        help="Apply a JSON Patch (RFC 6902) to the header fields and Lua state and save changes",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    patch_parser.add_argument(
+        "patch_file",
+        help=("JSON Patch file, or - to read it from stdin. Paths follow the edit_raw JSON layout:\n"
+              "  /runs                                   header field\n"
+              "  /lua_state/0/GameState/Resources/Gems   Lua state value")
+    )
+    patch_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to save to a new file (otherwise overwrites original)"
+    )
+    patch_parser.set_defaults(func=handle_patch)
+
+    # Undo and redo commands
+    for name, help_text in (
+            ("undo", "Revert the last change(s) made to the save, using its journal"),
+            ("redo", "Reapply change(s) reverted with undo"),
+    ):
+        step_parser = subparsers.add_parser(name, help=help_text)
+        step_parser.add_argument(
+            "-n", "--steps", type=int, default=1,
+            help="Optional: Number of journal entries to step through (default: 1)"
+        )
+        step_parser.add_argument(
+            "--list", action="store_true",
+            help="List the journal entries instead (* marks the last one applied)"
+        )
+        step_parser.set_defaults(func=handle_undo)
+
+    # Snapshot command
+    snapshot_parser = subparsers.add_parser(
+        "snapshot",
+        help="Manage deduplicated snapshots of the save (taken automatically before it is overwritten)"
+    )
+    snapshot_parser.add_argument(
+        "action",
+        choices=["create", "list", "restore", "prune"],
+        help=("create  - Snapshot the save now\n"
+              "list    - List the snapshots of the save\n"
+              "restore - Restore a snapshot over the save (or to --output)\n"
+              "prune   - Keep only the newest --keep snapshots and drop unused data")
+    )
+    snapshot_parser.add_argument("snapshot_id", nargs="?", help="Snapshot to restore")
+    snapshot_parser.add_argument("--keep", type=int, default=10, help="Snapshots to keep when pruning (default: 10)")
+    snapshot_parser.add_argument(
+        "--store",
+        help="Optional: Snapshot directory (default: .pluto_snapshots next to the save)"
+    )
+    snapshot_parser.add_argument(
+        "-o", "--output",
+        help="Optional: Path to restore to (otherwise overwrites the save)"
+    )
+    snapshot_parser.set_defaults(func=handle_snapshot)
+
     # Edit raw Lua state command
     edit_raw_parser = subparsers.add_parser(
         "edit_raw", 
@@ -442,6 +1330,11 @@ def main():
         "-o", "--output",
         help="Optional: Path to save to a new file (otherwise overwrites original)"
     )
+    edit_raw_parser.add_argument(
+        "--format", choices=DUMP_FORMATS, default=DUMP_FORMATS[0],
+        help="Format of the file opened in the editor (default: json; binary is for external tools)"
+    )
+    edit_raw_parser.add_argument("--path", help="Optional: Only edit the subtree at this dotted path")
     edit_raw_parser.set_defaults(func=handle_edit_raw)
 
     # Edit Lua state command (new TUI editor)
@@ -460,7 +1353,32 @@ def main():
         sys.exit(1)
     
     args = parser.parse_args()
-    args.func(args)
+    if args.durability != DURABILITY_MODES[0]:
+        from durable_write import set_default_durability
+        set_default_durability(args.durability)
+    if args.verbose:
+        from structured_log import configure_logging
+        configure_logging(log_format=args.log_format)
+    if not args.metrics:
+        args.func(args)
+        return
+
+    import metrics
+    metrics.enable_metrics(args.metrics)
+    labels = (("command", args.command),)
+    start_time = time.perf_counter()
+    failed = True
+    try:
+        args.func(args)
+        failed = False
+    except SystemExit as e:
+        failed = e.code not in (None, 0)
+        raise
+    finally:
+        metrics.observe(metrics.COMMAND_SECONDS, time.perf_counter() - start_time, labels)
+        if failed:
+            metrics.inc(metrics.ERRORS, labels=labels)
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
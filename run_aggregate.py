@@ -0,0 +1,173 @@
+''' Run-history aggregation across many saves and backups '''
+import csv
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from core_logic import RUN_CSV_HEADER, run_to_csv_row
+from models.lua_state import decompress_lua_state_bytes
+from models.luabins_stream import find_path, read_table_entries
+from models.raw_save_file import RawSaveFile
+
+RUN_HISTORY_PATH = ["GameState", "RunHistory"]
+
+_PROFILE_NAME = re.compile(r"^(Profile\d+)", re.IGNORECASE)
+# The game's saves and backups: Profile1.sav, Profile1_Temp.sav, Profile1.sav.bak
+_SAVE_FILE_NAME = re.compile(r"\.sav(\.bak\d*)?$", re.IGNORECASE)
+# Outputs of recover (Profile1.recovered.sav), which are not read back as saves of the profile
+_RECOVERED_MARKER = ".recovered."
+
+
+def profile_name(path: str) -> str:
+    """
+    Groups a save and its backups under one profile, named by their directory and profile.
+
+    "saves/Profile1.sav", "saves/Profile1.sav.bak" and "saves/Profile1_Temp.sav" all belong to
+    "/absolute/path/to/saves/Profile1", while "other/Profile1.sav" is a profile of its own.
+    Files that do not follow the game's naming are grouped by their name up to the first dot.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    match = _PROFILE_NAME.match(name)
+    return os.path.join(directory, match.group(1) if match else name.split(".", 1)[0])
+
+
+def is_save_file_name(name: str) -> bool:
+    """
+    Whether a file name is one the game gives saves and backups. The journals, search indexes,
+    temporary files and recovered copies written next to saves are not.
+    """
+    return (not name.startswith(".") and _RECOVERED_MARKER not in name.lower()
+            and _SAVE_FILE_NAME.search(name) is not None)
+
+
+def expand_save_paths(paths: List[str]) -> List[str]:
+    """
+    Expands directories into the save files (and backups) they contain. A save named explicitly
+    and also found in a directory (or named twice) is only returned once.
+    """
+    result = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found = [
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if is_save_file_name(name) and os.path.isfile(os.path.join(path, name))
+            ]
+        else:
+            found = [path]
+        for save_path in found:
+            key = os.path.normcase(os.path.abspath(save_path))
+            if key not in seen:
+                seen.add(key)
+                result.append(save_path)
+    return result
+
+
+def output_dir_paths(paths: List[str], output_dir: str) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Maps saves to files of the same name in output_dir, for bulk commands writing there.
+
+    Saves of the same name from different directories would overwrite each other, so none of
+    them is given an output: their error message says which saves collide.
+
+    :return: [(path, output path, error message or None)] in the order of paths
+    """
+    sources: Dict[str, List[str]] = {}
+    for path in paths:
+        output_path = os.path.join(output_dir, os.path.basename(path))
+        sources.setdefault(os.path.normcase(os.path.abspath(output_path)), []).append(path)
+
+    result = []
+    for path in paths:
+        output_path = os.path.join(output_dir, os.path.basename(path))
+        colliding = sources[os.path.normcase(os.path.abspath(output_path))]
+        error = None
+        if len(colliding) > 1:
+            others = ", ".join(f"'{other}'" for other in colliding if other != path)
+            error = f"'{output_path}' would also be written from {others}; not written"
+        result.append((path, output_path, error))
+    return result
+
+
+def read_run_history(path: str) -> Tuple[str, List[Tuple[int, bytes, Dict[Any, Any]]], Optional[str]]:
+    """
+    Reads only GameState.RunHistory from a save, without decoding the rest of the Lua state.
+
+    :return: (path, [(attempt, content hash, run)], error message or None)
+    """
+    try:
+        raw_save_file = RawSaveFile.from_file(path)
+        buf = memoryview(decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes)))
+
+        offset = find_path(buf, RUN_HISTORY_PATH)
+        if offset is None:
+            return path, [], None
+
+        runs = [
+            (int(key), hashlib.blake2b(buf[start:end], digest_size=16).digest(), run)
+            for key, run, start, end in read_table_entries(buf, offset)
+        ]
+        return path, runs, None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def aggregate_run_history(paths: List[str], workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Reads the RunHistory of every save in parallel and merges them.
+
+    A run that appears in several backups of the same profile (same attempt number and
+    same encoded content) is only kept once.
+
+    :param paths: Save files or directories of save files
+    :param workers: Number of worker processes (default: one per CPU)
+    :return: Dict with the merged "runs" as (profile, attempt, run) plus read counters
+    """
+    save_paths = expand_save_paths(paths)
+    start_time = time.perf_counter()
+
+    if len(save_paths) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read_run_history, save_paths))
+    else:
+        results = [read_run_history(path) for path in save_paths]
+
+    seen = set()
+    runs = []
+    runs_read = 0
+    errors = {}
+    for path, file_runs, error in results:
+        if error is not None:
+            errors[path] = error
+            continue
+
+        profile = profile_name(path)
+        runs_read += len(file_runs)
+        for attempt, digest, run in file_runs:
+            run_key = (profile, attempt, digest)
+            if run_key in seen:
+                continue
+            seen.add(run_key)
+            runs.append((profile, attempt, run))
+
+    runs.sort(key=lambda item: (item[0], item[1]))
+    return {
+        "runs": runs,
+        "files": len(save_paths),
+        "runs_read": runs_read,
+        "duplicates": runs_read - len(runs),
+        "errors": errors,
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+def export_aggregated_runs_to_csv(runs: List[Tuple[str, int, Dict[Any, Any]]], csv_filepath: str):
+    """Writes merged runs to one CSV, using the export_runs columns plus the profile name."""
+    with open(csv_filepath, "w", newline='') as csvfile:
+        run_writer = csv.writer(csvfile, dialect='excel')
+        run_writer.writerow(["Profile"] + RUN_CSV_HEADER)
+        for profile, attempt, run in runs:
+            run_writer.writerow([profile] + run_to_csv_row(attempt, run))
@@ -0,0 +1,132 @@
+''' Columnar run-history analytics '''
+from typing import Dict, Any, Iterable, Tuple
+
+import numpy as np
+
+import gamedata
+from models.save_file import HadesSaveFile
+
+# Ids are positions in the gamedata tables, -1 means the run could not be classified
+WEAPON_NAMES = list(gamedata.HeroMeleeWeapons.keys())
+ASPECT_NAMES = list(gamedata.AspectTraits.keys())
+_WEAPON_IDS = {name: i for i, name in enumerate(WEAPON_NAMES)}
+_ASPECT_IDS = {name: i for i, name in enumerate(ASPECT_NAMES)}
+
+CLEAR_TIME_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def run_history_to_columns(run_history: Dict[Any, Dict[Any, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Converts a RunHistory table into one NumPy array per column, sorted by attempt.
+
+    Missing numeric values are stored as NaN so that they drop out of the aggregates.
+    """
+    return runs_to_columns(run_history.items(), len(run_history))
+
+
+def runs_to_columns(runs: Iterable[Tuple[Any, Dict[Any, Any]]], count: int) -> Dict[str, np.ndarray]:
+    """Same as run_history_to_columns, for (attempt, run) pairs that may come from several saves."""
+    attempt = np.empty(count, dtype=np.int64)
+    heat = np.full(count, np.nan)
+    weapon_id = np.full(count, -1, dtype=np.int16)
+    aspect_id = np.full(count, -1, dtype=np.int16)
+    gameplay_time = np.full(count, np.nan)
+    cleared = np.zeros(count, dtype=bool)
+    easy_mode_level = np.full(count, np.nan)
+
+    for i, (key, run) in enumerate(runs):
+        attempt[i] = int(key)
+        if "ShrinePointsCache" in run:
+            heat[i] = run["ShrinePointsCache"]
+        if "WeaponsCache" in run:
+            weapon_id[i] = _WEAPON_IDS.get(gamedata.classify_weapon(run["WeaponsCache"]), -1)
+        if "TraitCache" in run:
+            aspect_id[i] = _ASPECT_IDS.get(gamedata.classify_aspect(run["TraitCache"]), -1)
+        if "GameplayTime" in run:
+            gameplay_time[i] = run["GameplayTime"]
+        cleared[i] = bool(run.get("Cleared", False))
+        if "EasyModeLevel" in run:
+            easy_mode_level[i] = run["EasyModeLevel"]
+
+    order = np.argsort(attempt, kind="stable")
+    return {
+        "attempt": attempt[order],
+        "heat": heat[order],
+        "weapon_id": weapon_id[order],
+        "aspect_id": aspect_id[order],
+        "gameplay_time": gameplay_time[order],
+        "cleared": cleared[order],
+        "easy_mode_level": easy_mode_level[order],
+    }
+
+
+def load_run_columns(save_file_object: HadesSaveFile) -> Dict[str, np.ndarray]:
+    """Loads the RunHistory of a save file into columnar arrays."""
+    return run_history_to_columns(save_file_object.lua_state.run_history)
+
+
+def _win_rates(keys: np.ndarray, cleared: np.ndarray, labels: list) -> Dict[str, Dict[str, float]]:
+    runs = np.bincount(keys, minlength=len(labels))
+    clears = np.bincount(keys, weights=cleared, minlength=len(labels))
+
+    result = {}
+    for key in np.flatnonzero(runs):
+        result[labels[key]] = {
+            "runs": int(runs[key]),
+            "clears": int(clears[key]),
+            "win_rate": float(clears[key] / runs[key]),
+        }
+    return result
+
+
+def compute_run_stats(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Computes win rates, heat distribution and clear-time percentiles from run columns."""
+    cleared = columns["cleared"]
+    total = int(cleared.size)
+    clears = int(np.count_nonzero(cleared))
+
+    # Shift ids by one so that unclassified runs (-1) land in bucket 0
+    weapon_keys = columns["weapon_id"].astype(np.int64) + 1
+    aspect_keys = columns["aspect_id"].astype(np.int64) + 1
+    weapon_labels = ["Unknown weapon"] + [gamedata.HeroMeleeWeapons[name] for name in WEAPON_NAMES]
+    aspect_labels = ["Redacted"] + [f"Aspect of {gamedata.AspectTraits[name]}" for name in ASPECT_NAMES]
+    # Aspects share display names across weapons (e.g. Zagreus), so group by the (weapon, aspect) pair
+    pair_labels = [f"{weapon} - {aspect}" for weapon in weapon_labels for aspect in aspect_labels]
+
+    has_heat = ~np.isnan(columns["heat"])
+    heat = columns["heat"][has_heat].astype(np.int64)
+    heat_runs = np.bincount(heat)
+    heat_clears = np.bincount(heat, weights=cleared[has_heat], minlength=heat_runs.size)
+
+    clear_times = columns["gameplay_time"][cleared]
+    clear_times = clear_times[~np.isnan(clear_times)]
+    if clear_times.size:
+        percentiles = np.percentile(clear_times, CLEAR_TIME_PERCENTILES)
+    else:
+        percentiles = np.full(len(CLEAR_TIME_PERCENTILES), np.nan)
+
+    return {
+        "runs": total,
+        "clears": clears,
+        "win_rate": clears / total if total else 0.0,
+        "god_mode_runs": int(np.count_nonzero(~np.isnan(columns["easy_mode_level"]))),
+        "by_weapon": _win_rates(weapon_keys, cleared, weapon_labels),
+        "by_aspect": _win_rates(weapon_keys * len(aspect_labels) + aspect_keys, cleared, pair_labels),
+        "heat": {
+            int(level): {"runs": int(heat_runs[level]), "clears": int(heat_clears[level])}
+            for level in np.flatnonzero(heat_runs)
+        },
+        "clear_time_percentiles": {
+            p: float(value) for p, value in zip(CLEAR_TIME_PERCENTILES, percentiles)
+        },
+    }
+
+
+def save_run_columns_npz(columns: Dict[str, np.ndarray], npz_filepath: str):
+    """Writes the run columns plus the id -> name tables to a compressed .npz file."""
+    np.savez_compressed(
+        npz_filepath,
+        weapon_names=np.array(WEAPON_NAMES),
+        aspect_names=np.array(ASPECT_NAMES),
+        **columns
+    )
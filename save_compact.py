@@ -0,0 +1,183 @@
+''' Shrinks saves by pruning history tables according to retention rules '''
+import fnmatch
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import lz4.block
+from luabins.lua_table_key import LuaTableKey
+
+from models.lazy_lua_table import encode_lazy_value
+from models.lua_path import format_key, split_path
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.luabins_stream import (
+    STATE_TABLE_OFFSET, encode_table_header, is_table, iter_entry_spans, read_table_header
+)
+from models.path_rules import (
+    RuleNode, build_rule_trie, check_rule_fields, load_rule_file, matching_nodes, split_rule_argument
+)
+from models.raw_save_file import RawSaveFile
+
+# A rule applies to the table at a dotted path ("*" matches any key at one level) and is one of:
+#   {"path": "GameState.RunHistory", "keep_last": 100}         keep the 100 entries with the largest number keys
+#   {"path": "GameState.TextLinesRecord", "drop": "Intro*"}     drop the entries whose key matches a glob pattern
+# Entries with string keys are never removed by keep_last. When keep_last prunes a sequence (a
+# table whose number keys are 1..n, as RunHistory's are), the kept entries are renumbered 1..N,
+# since Lua's # operator, ipairs and table.insert expect a sequence to start at 1.
+KEEP_LAST = "keep_last"
+DROP = "drop"
+
+
+class RetentionRule:
+    def __init__(self, path: str, keep_last: Optional[int] = None, drop: Optional[str] = None):
+        if (keep_last is None) == (drop is None):
+            raise ValueError(f"A rule for {path} needs exactly one of '{KEEP_LAST}' and '{DROP}'")
+        if keep_last is not None and keep_last < 0:
+            raise ValueError(f"'{KEEP_LAST}' must not be negative (rule for {path})")
+        self.path = path
+        self.components = split_path(path)
+        if not self.components:
+            raise ValueError("A rule needs the path of the table it applies to")
+        self.keep_last = keep_last
+        self.drop = drop
+
+    def __str__(self):
+        if self.keep_last is not None:
+            return f"{self.path}: keep the last {self.keep_last}"
+        return f"{self.path}: drop {self.drop}"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RetentionRule':
+        check_rule_fields(data, (KEEP_LAST, DROP))
+        keep_last = data.get(KEEP_LAST)
+        if keep_last is not None and (isinstance(keep_last, bool) or not isinstance(keep_last, int)):
+            raise ValueError(f"'{KEEP_LAST}' must be a whole number in {data!r}")
+        return cls(data["path"], keep_last=keep_last, drop=data.get(DROP))
+
+    def select(self, entries: List[Tuple[Any, int, int, int]]) -> Set[int]:
+        """Returns the indexes of the entries of a matched table that this rule removes."""
+        if self.keep_last is not None:
+            numbered = sorted(
+                (key, index) for index, (key, _, _, _) in enumerate(entries)
+                if isinstance(key, float)
+            )
+            return {index for _, index in numbered[:max(len(numbered) - self.keep_last, 0)]}
+        return {
+            index for index, (key, _, _, _) in enumerate(entries)
+            if not isinstance(key, LuaTableKey) and fnmatch.fnmatchcase(format_key(key), self.drop)
+        }
+
+
+def _sequence_keys(entries: List[Tuple[Any, int, int, int]], removed: Set[int]) -> Dict[int, float]:
+    # New keys of the kept entries of a sequence, by entry index; empty if the number keys were not 1..n
+    numbered = sorted(
+        (key, index) for index, (key, _, _, _) in enumerate(entries)
+        if isinstance(key, float)
+    )
+    if [key for key, _ in numbered] != [float(number) for number in range(1, len(numbered) + 1)]:
+        return {}
+    kept = [index for _, index in numbered if index not in removed]
+    return {index: float(number) for number, index in enumerate(kept, 1) if entries[index][0] != number}
+
+
+def parse_rule_argument(text: str, kind: str) -> RetentionRule:
+    """Parses a PATH=N (keep_last) or PATH=PATTERN (drop) command line rule."""
+    path, argument = split_rule_argument(text, "N" if kind == KEEP_LAST else "PATTERN")
+    if kind == KEEP_LAST:
+        try:
+            return RetentionRule(path, keep_last=int(argument))
+        except ValueError:
+            raise ValueError(f"Expected a whole number after '=' in '{text}'") from None
+    return RetentionRule(path, drop=argument)
+
+
+def load_rules(path: str) -> List[RetentionRule]:
+    """Reads a JSON file holding a list of rule objects."""
+    return load_rule_file(path, RetentionRule.from_dict)
+
+
+class _Compactor:
+    def __init__(self, rules: List[RetentionRule]):
+        self.root = build_rule_trie(rules)
+        self.stats = {id(rule): {"tables": 0, "removed": 0, "bytes": 0} for rule in rules}
+
+    def write_table(self, buf, offset: int, nodes: List[RuleNode], out: bytearray) -> int:
+        """
+        Writes the table at offset to out with the rules of nodes applied, returning its end.
+
+        The rules on this table pick the entries to remove from the keys alone, before anything
+        below it is looked at, so only kept entries below a rule path are rewritten (and counted
+        in the report). Every other value is copied as it is.
+        """
+        array_size, hash_size, first_entry = read_table_header(buf, offset)
+        # (key, key offset, value offset, end offset)
+        entries = list(iter_entry_spans(buf, offset))
+        table_end = entries[-1][3] if entries else first_entry
+
+        removed: Set[int] = set()
+        pruned_by_keep_last = False
+        for node in nodes:
+            for rule in node.rules:
+                stats = self.stats[id(rule)]
+                stats["tables"] += 1
+                for index in rule.select(entries) - removed:
+                    removed.add(index)
+                    stats["removed"] += 1
+                    stats["bytes"] += entries[index][3] - entries[index][1]
+                    pruned_by_keep_last = pruned_by_keep_last or rule.keep_last is not None
+        new_keys = _sequence_keys(entries, removed) if pruned_by_keep_last else {}
+
+        # Luabins writes the array part first; the sizes are only preallocation hints when loading
+        kept_array = sum(1 for index in range(array_size) if index not in removed)
+        kept_hash = array_size + hash_size - len(removed) - kept_array
+        out += encode_table_header(kept_array, kept_hash)
+        for index, (key, key_offset, value_offset, end) in enumerate(entries):
+            if index in removed:
+                continue
+            if index in new_keys:
+                encode_lazy_value(new_keys[index], out)
+            else:
+                out += buf[key_offset:value_offset]
+            child_nodes = matching_nodes(nodes, key)
+            if child_nodes and is_table(buf, value_offset):
+                self.write_table(buf, value_offset, child_nodes, out)
+            else:
+                out += buf[value_offset:end]
+        return table_end
+
+
+def _compress(version: int, lua_bytes: bytes) -> bytes:
+    # Version 14 saves are not compressed; their LZ4 size is still reported for comparison
+    return compress_lua_state_bytes(version, lua_bytes) if version > 14 else lz4.block.compress(lua_bytes, store_size=False)
+
+
+def compact_lua_state(raw_save_file: RawSaveFile, rules: List[RetentionRule], dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Applies retention rules to a save's Lua state in one traversal and reports what they remove.
+
+    Unless dry_run is set (or nothing was removed), the RawSaveFile is updated with the compacted
+    state. The sizes are computed the same way either way.
+
+    :return: {"before": sizes, "after": sizes, "rules": [{"rule", "tables", "removed", "bytes"}], "changed": bool}
+    """
+    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+    buf = memoryview(lua_bytes)
+    compactor = _Compactor(rules)
+
+    new_bytes = bytearray(buf[:STATE_TABLE_OFFSET])
+    end = compactor.write_table(buf, STATE_TABLE_OFFSET, [compactor.root], new_bytes)
+    new_bytes += buf[end:]
+    new_bytes = bytes(new_bytes)
+
+    changed = any(stats["removed"] for stats in compactor.stats.values())
+    compressed = _compress(raw_save_file.version, new_bytes)
+    result = {
+        "before": {"bytes": len(lua_bytes), "compressed_bytes": len(_compress(raw_save_file.version, lua_bytes))},
+        "after": {"bytes": len(new_bytes), "compressed_bytes": len(compressed)},
+        "rules": [dict(rule=str(rule), **compactor.stats[id(rule)]) for rule in rules],
+        "changed": changed,
+    }
+
+    if changed and not dry_run:
+        lua_state_bytes = compressed if raw_save_file.version > 14 else new_bytes
+        raw_save_file.save_data["lua_state"] = lua_state_bytes
+        raw_save_file.lua_state_bytes = lua_state_bytes
+    return result
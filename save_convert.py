@@ -0,0 +1,117 @@
+''' Converts saves between versions 14, 15 and 16 without decoding their Lua state '''
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from constant import SAV15_UNCOMPRESSED_SIZE, SAV16_UNCOMPRESSED_SIZE, SAVE_DATA_V14_LENGTH, SAVE_DATA_V15_LENGTH
+from durable_write import grouped_directory_sync
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.raw_save_file import RawSaveFile, SAVE_HEADER_FIELDS
+from run_aggregate import expand_save_paths, output_dir_paths
+from schemas.sav_14 import sav14_save_data_schema
+from schemas.sav_15 import sav15_save_data_schema
+
+SUPPORTED_VERSIONS = [14, 15, 16]
+
+# The three versions store the same luabins stream and the same header fields, except that
+# version 16 adds a timestamp. Versions 15 and 16 LZ4-compress the stream, and versions 14 and
+# 15 pad the save data to a fixed size, which it must fit in.
+_PADDED_SAVE_DATA = {
+    14: (sav14_save_data_schema, SAVE_DATA_V14_LENGTH),
+    15: (sav15_save_data_schema, SAVE_DATA_V15_LENGTH),
+}
+_UNCOMPRESSED_LIMITS = {15: SAV15_UNCOMPRESSED_SIZE, 16: SAV16_UNCOMPRESSED_SIZE}
+
+
+def _is_compressed(version: int) -> bool:
+    return version > 14
+
+
+def convert_raw_save_file(raw_save_file: RawSaveFile, to_version: int, timestamp: Optional[int] = None) -> RawSaveFile:
+    """
+    Returns the save converted to to_version.
+
+    The Lua state is moved across as bytes: between 15 and 16 the compressed block is copied
+    as it is, and otherwise it is only decompressed or compressed, never decoded. timestamp
+    (Unix seconds) is used when converting to version 16. Raises ValueError if the state does
+    not fit the target version.
+    """
+    if to_version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported version {to_version} (supported: {', '.join(map(str, SUPPORTED_VERSIONS))})")
+
+    from_version = raw_save_file.version
+    lua_state_bytes = bytes(raw_save_file.lua_state_bytes)
+    if _is_compressed(from_version) != _is_compressed(to_version):
+        if _is_compressed(from_version):
+            lua_state_bytes = decompress_lua_state_bytes(from_version, lua_state_bytes)
+        else:
+            if len(lua_state_bytes) > _UNCOMPRESSED_LIMITS[to_version]:
+                raise ValueError(
+                    f"The Lua state ({len(lua_state_bytes)} bytes) is larger than version {to_version} "
+                    f"saves allow ({_UNCOMPRESSED_LIMITS[to_version]} bytes)"
+                )
+            lua_state_bytes = compress_lua_state_bytes(to_version, lua_state_bytes)
+
+    save_data: Dict[str, Any] = {}
+    for field_name in SAVE_HEADER_FIELDS:
+        if field_name == "timestamp":
+            if to_version >= 16:
+                save_data[field_name] = raw_save_file.save_data.get(field_name, timestamp or 0)
+        else:
+            save_data[field_name] = raw_save_file.save_data[field_name]
+    save_data["version"] = to_version
+    save_data["lua_state"] = lua_state_bytes
+
+    if to_version in _PADDED_SAVE_DATA:
+        schema, length = _PADDED_SAVE_DATA[to_version]
+        size = len(schema.build(save_data))
+        if size > length:
+            raise ValueError(f"The save data ({size} bytes) does not fit the {length} bytes of a version {to_version} save")
+    return RawSaveFile(to_version, save_data)
+
+
+def convert_save_file(path: str, output_path: str, to_version: int, write=None) -> Tuple[int, bool]:
+    """
+    Converts the save at path and writes it to output_path, with write(raw_save_file, output_path)
+    if given (e.g. to snapshot a save that is overwritten).
+
+    :return: (the save's original version, whether it was converted); saves already at
+             to_version are left alone
+    """
+    raw_save_file = RawSaveFile.from_file(path)
+    if raw_save_file.version == to_version:
+        return raw_save_file.version, False
+    # The file's modification time stands in for the timestamp older versions do not have
+    converted = convert_raw_save_file(raw_save_file, to_version, timestamp=int(os.path.getmtime(path)))
+    if write is not None:
+        write(converted, output_path)
+    else:
+        converted.to_file(output_path)
+    return raw_save_file.version, True
+
+
+def convert_save_files(
+        paths: List[str], to_version: int, output_dir: Optional[str] = None, write=None
+) -> Iterator[Tuple[str, str, Optional[int], bool, Optional[str]]]:
+    """
+    Converts saves one at a time (directories are expanded), into output_dir or in place.
+
+    :return: Yields (path, output path, original version, whether it was converted, error
+             message or None) for every save
+    """
+    save_paths = expand_save_paths(paths)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        targets = output_dir_paths(save_paths, output_dir)
+    else:
+        targets = [(path, path, None) for path in save_paths]
+    # The directories written to are synced once, after the last save, rather than after every save
+    with grouped_directory_sync():
+        for path, output_path, error in targets:
+            if error is not None:
+                yield path, output_path, None, False, error
+                continue
+            try:
+                from_version, converted = convert_save_file(path, output_path, to_version, write)
+                yield path, output_path, from_version, converted, None
+            except Exception as e:
+                yield path, output_path, None, False, str(e)
@@ -0,0 +1,103 @@
+''' Structural diff between two save files '''
+import hashlib
+from typing import Any, Iterator, List, Tuple
+
+from models.lua_path import join_path
+from models.lua_state import decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, iter_table_spans, is_table, read_value
+from models.raw_save_file import RawSaveFile
+
+ADDED = "+"
+REMOVED = "-"
+CHANGED = "~"
+
+# (kind, dotted path, old value, new value)
+DiffEntry = Tuple[str, str, Any, Any]
+
+
+def subtree_digest(buf, start: int, end: int) -> bytes:
+    """Content hash of one encoded subtree."""
+    return hashlib.blake2b(buf[start:end], digest_size=16).digest()
+
+
+def _diff_tables(old_buf, old_offset: int, new_buf, new_offset: int, path: List[Any]) -> Iterator[DiffEntry]:
+    # Each subtree is identified by the hash of its encoded bytes, so an unchanged subtree is
+    # skipped after one hash per side and only subtrees whose hashes differ are descended into.
+    old_entries = {key: (start, end) for key, start, end in iter_table_spans(old_buf, old_offset)}
+
+    for key, new_start, new_end in iter_table_spans(new_buf, new_offset):
+        child_path = path + [key]
+        if key not in old_entries:
+            yield ADDED, join_path(child_path), None, read_value(new_buf, new_start)[0]
+            continue
+
+        old_start, old_end = old_entries.pop(key)
+        if subtree_digest(old_buf, old_start, old_end) == subtree_digest(new_buf, new_start, new_end):
+            continue
+
+        if is_table(old_buf, old_start) and is_table(new_buf, new_start):
+            yield from _diff_tables(old_buf, old_start, new_buf, new_start, child_path)
+        else:
+            yield (
+                CHANGED, join_path(child_path),
+                read_value(old_buf, old_start)[0], read_value(new_buf, new_start)[0]
+            )
+
+    for key, (old_start, _) in old_entries.items():
+        yield REMOVED, join_path(path + [key]), read_value(old_buf, old_start)[0], None
+
+
+def diff_lua_state_bytes(old_bytes: bytes, new_bytes: bytes) -> Iterator[DiffEntry]:
+    """Diffs two decompressed luabins streams, starting at their first (state) table."""
+    old_buf = memoryview(old_bytes)
+    new_buf = memoryview(new_bytes)
+    if subtree_digest(old_buf, STATE_TABLE_OFFSET, len(old_buf)) == subtree_digest(new_buf, STATE_TABLE_OFFSET, len(new_buf)):
+        return
+    yield from _diff_tables(old_buf, STATE_TABLE_OFFSET, new_buf, STATE_TABLE_OFFSET, [])
+
+
+def diff_headers(old_save: RawSaveFile, new_save: RawSaveFile) -> Iterator[DiffEntry]:
+    old_header = old_save.header_fields()
+    new_header = new_save.header_fields()
+    for field_name in old_header.keys() | new_header.keys():
+        path = f"header.{field_name}"
+        if field_name not in new_header:
+            yield REMOVED, path, old_header[field_name], None
+        elif field_name not in old_header:
+            yield ADDED, path, None, new_header[field_name]
+        elif old_header[field_name] != new_header[field_name]:
+            yield CHANGED, path, old_header[field_name], new_header[field_name]
+
+
+def diff_save_files(old_path: str, new_path: str) -> Iterator[DiffEntry]:
+    """
+    Yields the differences between two saves: header fields first, then Lua state paths.
+
+    Paths use the dotted format of _LuaStateProperty; header fields are prefixed with "header.".
+    """
+    old_save = RawSaveFile.from_file(old_path)
+    new_save = RawSaveFile.from_file(new_path)
+
+    yield from sorted(diff_headers(old_save, new_save), key=lambda entry: entry[1])
+    yield from diff_lua_state_bytes(
+        decompress_lua_state_bytes(old_save.version, bytes(old_save.lua_state_bytes)),
+        decompress_lua_state_bytes(new_save.version, bytes(new_save.lua_state_bytes)),
+    )
+
+
+def format_diff_value(value: Any, max_length: int = 80) -> str:
+    if isinstance(value, dict):
+        return f"<table of {len(value)} items>"
+    text = repr(value)
+    if len(text) > max_length:
+        text = text[:max_length - 3] + "..."
+    return text
+
+
+def format_diff_entry(entry: DiffEntry) -> str:
+    kind, path, old_value, new_value = entry
+    if kind == ADDED:
+        return f"{ADDED} {path}: {format_diff_value(new_value)}"
+    if kind == REMOVED:
+        return f"{REMOVED} {path}: {format_diff_value(old_value)}"
+    return f"{CHANGED} {path}: {format_diff_value(old_value)} -> {format_diff_value(new_value)}"
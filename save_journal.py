@@ -0,0 +1,307 @@
+''' Journal of the edits made to a save, for undo and redo without backups '''
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import lz4.block
+
+from models.lua_path import join_path
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, TABLE_HEADER_SIZE, is_table, iter_entry_spans, skip_value
+from models.raw_save_file import RawSaveFile
+from save_diff import subtree_digest
+
+# The journal of Profile1.sav is Profile1.sav.journal. It starts with a magic number and the
+# number of entries currently applied to the save (entries past it were undone and can be
+# redone), followed by one record per write of the save:
+#
+#   <I meta length> <meta JSON> <I block length> <LZ4 block of the splices>
+#
+# The meta JSON holds the time, the header fields that changed ({field: [old, new]}, null
+# for a missing field), the dotted paths that changed and digests of the save before and
+# after. The splices turn the decompressed Lua state before into the one after:
+#
+#   <I old offset> <I new offset> <I old length> <I new length> <old bytes> <new bytes>
+#
+# They are found the way diff finds changes (unchanged subtrees are skipped by their hash),
+# so an entry is about as large as what the edit changed, whatever the size of the save.
+JOURNAL_SUFFIX = ".journal"
+_MAGIC = b"PLJ1"
+_POSITION = struct.Struct("<I")
+_LENGTH = struct.Struct("<I")
+_SPLICE = struct.Struct("<IIII")
+_MAX_LISTED_PATHS = 20
+
+# (old offset, new offset, old bytes, new bytes)
+Splice = Tuple[int, int, bytes, bytes]
+
+
+def journal_path(save_path: str) -> str:
+    return save_path + JOURNAL_SUFFIX
+
+
+def state_digest(header: Dict[str, Any], lua_bytes: bytes) -> str:
+    """Digest of a save's header fields and decompressed Lua state."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+    digest.update(lua_bytes)
+    return digest.hexdigest()
+
+
+def read_save_state(raw_save_file: RawSaveFile) -> Tuple[Dict[str, Any], bytes]:
+    """Returns the header fields and the decompressed Lua state of a save."""
+    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+    return raw_save_file.header_fields(), lua_bytes
+
+
+def _diff_table(old_buf, old_offset: int, new_buf, new_offset: int, path: List[Any],
+                splices: List[Splice], paths: List[List[Any]]):
+    # (key, entry start, value start, entry end) of every entry of both tables
+    old_entries = list(iter_entry_spans(old_buf, old_offset))
+    new_entries = list(iter_entry_spans(new_buf, new_offset))
+    old_end = old_entries[-1][3] if old_entries else old_offset + TABLE_HEADER_SIZE
+    new_end = new_entries[-1][3] if new_entries else new_offset + TABLE_HEADER_SIZE
+    old_keys = {entry[0] for entry in old_entries}
+    new_keys = {entry[0] for entry in new_entries}
+
+    if [entry[0] for entry in old_entries if entry[0] in new_keys] != \
+            [entry[0] for entry in new_entries if entry[0] in old_keys]:
+        # The entries were reordered, which no command does; the table is replaced as a whole
+        splices.append((old_offset, new_offset, bytes(old_buf[old_offset:old_end]), bytes(new_buf[new_offset:new_end])))
+        paths.append(path)
+        return
+
+    if old_buf[old_offset + 1:old_offset + TABLE_HEADER_SIZE] != new_buf[new_offset + 1:new_offset + TABLE_HEADER_SIZE]:
+        splices.append((
+            old_offset + 1, new_offset + 1,
+            bytes(old_buf[old_offset + 1:old_offset + TABLE_HEADER_SIZE]),
+            bytes(new_buf[new_offset + 1:new_offset + TABLE_HEADER_SIZE]),
+        ))
+
+    # Both entry lists keep their common keys in the same order, so one merge pass lines them up
+    i = j = 0
+    while i < len(old_entries) or j < len(new_entries):
+        if i < len(old_entries) and old_entries[i][0] not in new_keys:
+            key, start, _, end = old_entries[i]
+            new_position = new_entries[j][1] if j < len(new_entries) else new_end
+            splices.append((start, new_position, bytes(old_buf[start:end]), b""))
+            paths.append(path + [key])
+            i += 1
+        elif j < len(new_entries) and new_entries[j][0] not in old_keys:
+            key, start, _, end = new_entries[j]
+            old_position = old_entries[i][1] if i < len(old_entries) else old_end
+            splices.append((old_position, start, b"", bytes(new_buf[start:end])))
+            paths.append(path + [key])
+            j += 1
+        else:
+            key, _, old_start, old_stop = old_entries[i]
+            _, _, new_start, new_stop = new_entries[j]
+            if subtree_digest(old_buf, old_start, old_stop) != subtree_digest(new_buf, new_start, new_stop):
+                if is_table(old_buf, old_start) and is_table(new_buf, new_start):
+                    _diff_table(old_buf, old_start, new_buf, new_start, path + [key], splices, paths)
+                else:
+                    splices.append((old_start, new_start, bytes(old_buf[old_start:old_stop]), bytes(new_buf[new_start:new_stop])))
+                    paths.append(path + [key])
+            i += 1
+            j += 1
+
+
+def diff_lua_state_splices(old_bytes: bytes, new_bytes: bytes) -> Tuple[List[Splice], List[str]]:
+    """Returns the splices turning one decompressed Lua state into another, and the dotted paths they change."""
+    old_buf = memoryview(old_bytes)
+    new_buf = memoryview(new_bytes)
+    splices: List[Splice] = []
+    paths: List[List[Any]] = []
+    start = STATE_TABLE_OFFSET
+    if old_buf[:start] != new_buf[:start]:
+        splices.append((0, 0, bytes(old_buf[:start]), bytes(new_buf[:start])))
+    if subtree_digest(old_buf, start, len(old_buf)) != subtree_digest(new_buf, start, len(new_buf)):
+        _diff_table(old_buf, start, new_buf, start, [], splices, paths)
+        old_end, new_end = skip_value(old_buf, start), skip_value(new_buf, start)
+        if old_buf[old_end:] != new_buf[new_end:]:
+            splices.append((old_end, new_end, bytes(old_buf[old_end:]), bytes(new_buf[new_end:])))
+    return splices, [join_path(path) for path in paths]
+
+
+def apply_splices(lua_bytes: bytes, splices: List[Splice], reverse: bool = False) -> bytes:
+    """
+    Applies splices to a decompressed Lua state (undoes them with reverse). Raises ValueError
+    if the state does not hold the bytes a splice replaces.
+    """
+    out = bytearray()
+    position = 0
+    for old_offset, new_offset, old_bytes, new_bytes in splices:
+        offset, expected, replacement = (new_offset, new_bytes, old_bytes) if reverse else (old_offset, old_bytes, new_bytes)
+        if offset < position or lua_bytes[offset:offset + len(expected)] != expected:
+            raise ValueError(f"The Lua state does not match the journal at offset {offset}")
+        out += lua_bytes[position:offset]
+        out += replacement
+        position = offset + len(expected)
+    out += lua_bytes[position:]
+    return bytes(out)
+
+
+def _encode_splices(splices: List[Splice]) -> bytes:
+    out = bytearray()
+    for old_offset, new_offset, old_bytes, new_bytes in splices:
+        out += _SPLICE.pack(old_offset, new_offset, len(old_bytes), len(new_bytes))
+        out += old_bytes
+        out += new_bytes
+    return bytes(out)
+
+
+def _decode_splices(data: bytes) -> List[Splice]:
+    splices = []
+    offset = 0
+    while offset < len(data):
+        old_offset, new_offset, old_length, new_length = _SPLICE.unpack_from(data, offset)
+        offset += _SPLICE.size
+        old_bytes = data[offset:offset + old_length]
+        offset += old_length
+        splices.append((old_offset, new_offset, old_bytes, data[offset:offset + new_length]))
+        offset += new_length
+    return splices
+
+
+class SaveJournal:
+    """The journal of one save; see the format above."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def for_save(cls, save_path: str) -> 'SaveJournal':
+        return cls(journal_path(save_path))
+
+    def _read(self) -> Tuple[int, List[Dict[str, Any]]]:
+        # (position, entries); every entry's meta gets its "number" and its record's "offset" and "end"
+        if not os.path.exists(self.path):
+            return 0, []
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{self.path} is not a save journal")
+        position, = _POSITION.unpack_from(data, len(_MAGIC))
+        offset = len(_MAGIC) + _POSITION.size
+
+        entries = []
+        while offset < len(data):
+            start = offset
+            meta_length, = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            meta = json.loads(data[offset:offset + meta_length].decode("utf-8"))
+            offset += meta_length
+            block_length, = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size + block_length
+            if offset > len(data):
+                break # A record cut short by an interrupted write is ignored
+            meta["number"], meta["offset"], meta["end"] = len(entries) + 1, start, offset
+            entries.append(meta)
+        return min(position, len(entries)), entries
+
+    def _read_splices(self, entry: Dict[str, Any]) -> List[Splice]:
+        with open(self.path, "rb") as f:
+            f.seek(entry["offset"])
+            record = f.read(entry["end"] - entry["offset"])
+        meta_length, = _LENGTH.unpack_from(record, 0)
+        block_offset = _LENGTH.size + meta_length + _LENGTH.size
+        return _decode_splices(lz4.block.decompress(record[block_offset:]))
+
+    def _write_position(self, position: int):
+        with open(self.path, "r+b") as f:
+            f.seek(len(_MAGIC))
+            f.write(_POSITION.pack(position))
+
+    def entries(self) -> Tuple[int, List[Dict[str, Any]]]:
+        """Returns (number of entries applied to the save, every entry's meta, oldest first)."""
+        return self._read()
+
+    def record(self, before: RawSaveFile, after: RawSaveFile) -> Optional[Dict[str, Any]]:
+        """
+        Appends the changes between two revisions of the save, returning the entry's meta (None
+        if nothing changed). Entries that were undone are dropped, and so is the whole journal
+        if the save was changed by something else (e.g. the game) since the last entry.
+        """
+        old_header, old_lua_bytes = read_save_state(before)
+        new_header, new_lua_bytes = read_save_state(after)
+        splices, paths = diff_lua_state_splices(old_lua_bytes, new_lua_bytes)
+        header_changes = {
+            field_name: [old_header.get(field_name), new_header.get(field_name)]
+            for field_name in sorted(old_header.keys() | new_header.keys())
+            if old_header.get(field_name) != new_header.get(field_name)
+        }
+        if not splices and not header_changes:
+            return None
+
+        meta = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "header": header_changes,
+            "changes": len(paths) + len(header_changes),
+            "paths": paths[:_MAX_LISTED_PATHS],
+            "before": state_digest(old_header, old_lua_bytes),
+            "after": state_digest(new_header, new_lua_bytes),
+        }
+
+        position, entries = self._read()
+        if position and entries[position - 1]["after"] != meta["before"]:
+            position = 0 # The entries lead to another revision of the save and cannot be undone
+        if position == 0:
+            with open(self.path, "wb") as f:
+                f.write(_MAGIC + _POSITION.pack(0))
+        elif position < len(entries):
+            with open(self.path, "r+b") as f:
+                f.truncate(entries[position]["offset"])
+
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        block = lz4.block.compress(_encode_splices(splices))
+        with open(self.path, "ab") as f:
+            f.write(_LENGTH.pack(len(meta_bytes)) + meta_bytes + _LENGTH.pack(len(block)) + block)
+        self._write_position(position + 1)
+        meta["number"] = position + 1
+        meta["size"] = _LENGTH.size * 2 + len(meta_bytes) + len(block)
+        return meta
+
+    def _step(self, save_path: str, steps: int, reverse: bool) -> List[Dict[str, Any]]:
+        position, entries = self._read()
+        if reverse:
+            selected = entries[max(position - steps, 0):position][::-1]
+        else:
+            selected = entries[position:position + steps]
+        if not selected:
+            raise ValueError(f"Nothing to {'undo' if reverse else 'redo'} in {self.path}")
+
+        header, lua_bytes = read_save_state(RawSaveFile.from_file(save_path))
+        expected, target = ("after", "before") if reverse else ("before", "after")
+        for entry in selected:
+            if state_digest(header, lua_bytes) != entry[expected]:
+                raise ValueError(
+                    f"The save was changed since journal entry {entry['number']} was recorded; "
+                    f"it can no longer be {'undone' if reverse else 'redone'}"
+                )
+            lua_bytes = apply_splices(lua_bytes, self._read_splices(entry), reverse=reverse)
+            for field_name, (old_value, new_value) in entry["header"].items():
+                value = old_value if reverse else new_value
+                if value is None:
+                    header.pop(field_name, None)
+                else:
+                    header[field_name] = value
+            if state_digest(header, lua_bytes) != entry[target]:
+                raise ValueError(f"Journal entry {entry['number']} does not reproduce the save it recorded")
+
+        version = header["version"]
+        save_data = dict(header)
+        save_data["lua_state"] = compress_lua_state_bytes(version, lua_bytes)
+        RawSaveFile(version, save_data).to_file(save_path)
+        self._write_position(position - len(selected) if reverse else position + len(selected))
+        return selected
+
+    def undo(self, save_path: str, steps: int = 1) -> List[Dict[str, Any]]:
+        """Reverts the last steps applied entries on the save, returning their meta (newest first)."""
+        return self._step(save_path, steps, reverse=True)
+
+    def redo(self, save_path: str, steps: int = 1) -> List[Dict[str, Any]]:
+        """Reapplies the next steps undone entries on the save, returning their meta."""
+        return self._step(save_path, steps, reverse=False)
@@ -0,0 +1,335 @@
+''' Salvages what it can from saves that no longer parse '''
+import os
+import re
+import struct
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import lz4.block
+from luabins.constants import LUABINS_TABLE
+
+from constant import FILE_SIGNATURE, SAV15_UNCOMPRESSED_SIZE, SAV16_UNCOMPRESSED_SIZE, SAVE_DATA_V14_LENGTH, SAVE_DATA_V15_LENGTH
+from models.lazy_lua_table import encode_lazy_value
+from models.lua_path import join_path
+from models.lua_state import compress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, is_table, iter_table, read_key, read_table_header, read_value
+from models.raw_save_file import RawSaveFile, SAVE_HEADER_FIELDS
+
+# File layout: signature, adler32 checksum of the save data, then the save data: the header
+# fields (see schemas/) and the length-prefixed Lua state, padded to a fixed size in 14 and 15.
+_SAVE_DATA_OFFSET = len(FILE_SIGNATURE) + 4
+_PADDED_LENGTHS = {14: SAVE_DATA_V14_LENGTH, 15: SAVE_DATA_V15_LENGTH}
+_UNCOMPRESSED_LIMITS = {15: SAV15_UNCOMPRESSED_SIZE, 16: SAV16_UNCOMPRESSED_SIZE}
+
+_UINT = struct.Struct("<I")
+# Longest header string we accept; anything longer means the length prefix is damaged
+_MAX_HEADER_STRING = 4096
+# A luabins stream holding one table starts with a value count of 1 and the table tag
+_STREAM_START = bytes([1, LUABINS_TABLE])
+# Lua state candidates found by the scan that are decoded at most
+_MAX_CANDIDATES = 16
+
+DEFAULT_HEADER = {
+    "timestamp": 0, "location": "", "runs": 0, "active_meta_points": 0, "active_shrine_points": 0,
+    "god_mode_enabled": 0, "hell_mode_enabled": 0, "lua_keys": [], "current_map_name": "", "start_next_map": "",
+}
+
+
+class _HeaderReader:
+    def __init__(self, buf, offset: int):
+        self.buf = buf
+        self.offset = offset
+
+    def _take(self, size: int):
+        if self.offset + size > len(self.buf):
+            raise ValueError("ends early")
+        chunk = self.buf[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def uint(self) -> int:
+        return _UINT.unpack(self._take(4))[0]
+
+    def uint64(self) -> int:
+        return struct.unpack("<Q", self._take(8))[0]
+
+    def byte(self) -> int:
+        return self._take(1)[0]
+
+    def string(self) -> str:
+        length = self.uint()
+        if length > _MAX_HEADER_STRING:
+            raise ValueError(f"implausible string length {length}")
+        return bytes(self._take(length)).decode("utf8")
+
+    def strings(self) -> List[str]:
+        count = self.uint()
+        if count > _MAX_HEADER_STRING:
+            raise ValueError(f"implausible string count {count}")
+        return [self.string() for _ in range(count)]
+
+
+def _read_header(buf, version: int) -> Tuple[Dict[str, Any], Optional[int], Optional[str]]:
+    # Returns (fields read, offset of the Lua state length prefix or None, error or None)
+    readers = {
+        "timestamp": _HeaderReader.uint64, "location": _HeaderReader.string, "runs": _HeaderReader.uint,
+        "active_meta_points": _HeaderReader.uint, "active_shrine_points": _HeaderReader.uint,
+        "god_mode_enabled": _HeaderReader.byte, "hell_mode_enabled": _HeaderReader.byte,
+        "lua_keys": _HeaderReader.strings, "current_map_name": _HeaderReader.string,
+        "start_next_map": _HeaderReader.string,
+    }
+    reader = _HeaderReader(buf, _SAVE_DATA_OFFSET + 4)
+    fields = {}
+    for field_name in SAVE_HEADER_FIELDS[1:]:
+        if field_name == "timestamp" and version < 16:
+            continue
+        try:
+            fields[field_name] = readers[field_name](reader)
+        except (ValueError, UnicodeDecodeError, struct.error) as e:
+            return fields, None, f"{field_name}: {e}"
+    return fields, reader.offset, None
+
+
+def lz4_decompress_partial(block, limit: int) -> bytes:
+    """
+    Decodes an LZ4 block as far as it is intact, returning everything decoded before the first
+    error (lz4.block.decompress returns nothing for a damaged or truncated block).
+    """
+    out = bytearray()
+    i = 0
+    n = len(block)
+    try:
+        while i < n and len(out) < limit:
+            token = block[i]
+            i += 1
+            literals = token >> 4
+            if literals == 15:
+                while True:
+                    extra = block[i]
+                    i += 1
+                    literals += extra
+                    if extra != 255:
+                        break
+            out += block[i:i + literals]
+            i += literals
+            if i >= n:
+                break # The last sequence only has literals
+
+            match_offset = block[i] | (block[i + 1] << 8)
+            i += 2
+            if match_offset == 0 or match_offset > len(out):
+                break
+            match_length = (token & 15) + 4
+            if token & 15 == 15:
+                while True:
+                    extra = block[i]
+                    i += 1
+                    match_length += extra
+                    if extra != 255:
+                        break
+            start = len(out) - match_offset
+            if match_offset >= match_length:
+                out += out[start:start + match_length]
+            else:
+                # Overlapping match: the last match_offset bytes repeat
+                pattern = bytes(out[start:])
+                out += (pattern * (match_length // match_offset + 1))[:match_length]
+    except IndexError:
+        pass # Truncated block
+    return bytes(out[:limit])
+
+
+def _decode_candidate(buf, prefix_offset: int, version: int) -> Tuple[Optional[bytes], bool]:
+    # Returns (luabins bytes or None, whether the length prefix and payload were intact)
+    length = _UINT.unpack_from(buf, prefix_offset)[0]
+    start = prefix_offset + 4
+    end = start + length
+    intact = end <= len(buf)
+    payload = bytes(buf[start:min(end, len(buf))])
+
+    if version in _UNCOMPRESSED_LIMITS:
+        lua_bytes = None
+        if intact:
+            try:
+                lua_bytes = lz4.block.decompress(payload, uncompressed_size=_UNCOMPRESSED_LIMITS[version])
+            except lz4.block.LZ4BlockError:
+                intact = False
+        if lua_bytes is None:
+            lua_bytes = lz4_decompress_partial(payload, _UNCOMPRESSED_LIMITS[version])
+    else:
+        lua_bytes = payload
+    if not lua_bytes.startswith(_STREAM_START):
+        return None, False
+    return lua_bytes, intact
+
+
+def _scan_candidates(buf, data_end: int) -> List[int]:
+    """
+    Finds plausible offsets of the Lua state length prefix in one pass over the data.
+
+    The state is the last field, so a prefix whose payload ends at (or after) the last non-zero
+    byte of the save data is preferred; candidates running past the end of the file come next,
+    for truncated saves.
+    """
+    last_non_zero = len(bytes(buf[:data_end]).rstrip(b"\0"))
+    fitting, truncated = [], []
+    # The stream starts with "\x01T", raw (version 14) or as the first literals of the LZ4
+    # block, which follow a token and up to a few literal length bytes
+    for match in re.finditer(re.escape(_STREAM_START), bytes(buf)):
+        for gap in range(0, 6):
+            prefix_offset = match.start() - gap - 4
+            if prefix_offset < _SAVE_DATA_OFFSET:
+                break
+            end = prefix_offset + 4 + _UINT.unpack_from(buf, prefix_offset)[0]
+            if last_non_zero <= end <= data_end:
+                fitting.append(prefix_offset)
+            elif end > len(buf) and end - prefix_offset < 2 * _UNCOMPRESSED_LIMITS[16]:
+                truncated.append(prefix_offset)
+    return (fitting + truncated)[:_MAX_CANDIDATES]
+
+
+def _salvage_table(buf, offset: int, path: List[Any], lost: List[str]) -> Tuple[Dict[Any, Any], Optional[int]]:
+    # Decodes the table at offset, keeping every entry read before the stream breaks off.
+    # Returns (table, end offset or None if it broke off)
+    try:
+        array_size, hash_size, offset = read_table_header(buf, offset)
+    except struct.error:
+        lost.append(f"{join_path(path) or '<state>'}: the whole table")
+        return {}, None
+    count = array_size + hash_size
+    table = {}
+    for index in range(count):
+        try:
+            key, value_offset = read_key(buf, offset)
+            if is_table(buf, value_offset):
+                value, end = _salvage_table(buf, value_offset, path + [key], lost)
+                table[key] = value
+                if end is None:
+                    if index + 1 < count:
+                        lost.append(f"{join_path(path) or '<state>'}: {count - index - 1} of {count} entries")
+                    return table, None
+                offset = end
+            else:
+                table[key], offset = read_value(buf, value_offset)
+        except Exception:
+            lost.append(f"{join_path(path) or '<state>'}: {count - index} of {count} entries")
+            return table, None
+    return table, offset
+
+
+def salvage_lua_state(lua_bytes: bytes) -> Tuple[bytes, List[str]]:
+    """
+    Returns a complete luabins stream holding every entry of the state that could be decoded,
+    and a description of each part that was lost.
+    """
+    buf = memoryview(lua_bytes)
+    lost: List[str] = []
+    state, end = _salvage_table(buf, STATE_TABLE_OFFSET, [], lost)
+    if end is not None and end == len(buf):
+        return bytes(lua_bytes), lost # Intact, keep the bytes as they are
+    if end is not None:
+        lost.append(f"{len(buf) - end} bytes after the end of the state")
+    out = bytearray(_STREAM_START[:STATE_TABLE_OFFSET])
+    encode_lazy_value(state, out)
+    return bytes(out), lost
+
+
+def _guess_version(buf) -> Tuple[int, str]:
+    if len(buf) >= _SAVE_DATA_OFFSET + 4:
+        version = _UINT.unpack_from(buf, _SAVE_DATA_OFFSET)[0]
+        if version in (14, 15, 16):
+            return version, "read from the header"
+    if len(buf) != _SAVE_DATA_OFFSET + SAVE_DATA_V15_LENGTH:
+        return 16, "guessed from the file size"
+    # 14 and 15 have the same padded size, but only 14 stores the stream uncompressed
+    for candidate in _scan_candidates(buf, len(buf)):
+        if _decode_candidate(buf, candidate, 14)[0] is not None:
+            return 14, "guessed from the file size and the uncompressed Lua state"
+    return 15, "guessed from the file size"
+
+
+def recover_save_bytes(data: bytes, version: Optional[int] = None, timestamp: int = 0) -> Tuple[RawSaveFile, Dict[str, Any]]:
+    """
+    Rebuilds a save from damaged bytes.
+
+    The header fields are read as far as they are intact (the rest get defaults), the Lua state
+    is taken from where the header says it is or found by scanning for its length prefix, and
+    as much of it is decoded as possible. Raises ValueError if no Lua state could be found.
+
+    :return: (the rebuilt save, report of what was recovered and lost)
+    """
+    buf = memoryview(data)
+    report: Dict[str, Any] = {"signature": bytes(buf[:len(FILE_SIGNATURE)]) == FILE_SIGNATURE, "lost": []}
+
+    if version is None:
+        version, how = _guess_version(buf)
+    else:
+        how = "given"
+    report["version"] = version
+    report["version_source"] = how
+
+    data_end = min(len(buf), _SAVE_DATA_OFFSET + _PADDED_LENGTHS[version]) if version in _PADDED_LENGTHS else len(buf)
+    if len(buf) >= _SAVE_DATA_OFFSET:
+        stored_checksum = _UINT.unpack_from(buf, len(FILE_SIGNATURE))[0]
+        report["checksum_matches"] = stored_checksum == zlib.adler32(buf[_SAVE_DATA_OFFSET:data_end], 1)
+
+    header, prefix_offset, header_error = ({}, None, "file too short") if len(buf) < _SAVE_DATA_OFFSET + 4 \
+        else _read_header(buf, version)
+    if header_error:
+        report["lost"].append(f"Header from {header_error}")
+
+    lua_bytes = None
+    intact = False
+
+    def candidates():
+        if prefix_offset is not None and prefix_offset + 4 <= len(buf):
+            yield prefix_offset
+        # Only scanned for when the header does not lead to the state
+        yield from (offset for offset in _scan_candidates(buf, data_end) if offset != prefix_offset)
+
+    for candidate in candidates():
+        lua_bytes, intact = _decode_candidate(buf, candidate, version)
+        if lua_bytes is not None:
+            report["lua_state_offset"] = candidate
+            report["lua_state_found_by"] = "header" if candidate == prefix_offset else "scan"
+            break
+    if lua_bytes is None:
+        raise ValueError("No Lua state found in the file")
+    if not intact:
+        report["lost"].append(f"The Lua state block is damaged or truncated; {len(lua_bytes)} bytes decoded from it")
+
+    lua_bytes, lost_entries = salvage_lua_state(lua_bytes)
+    report["lost"] += [f"Lua state {entry}" for entry in lost_entries]
+
+    defaults = dict(DEFAULT_HEADER, timestamp=timestamp)
+    # The header lists the top-level keys of the state
+    defaults["lua_keys"] = [key for key, _ in iter_table(memoryview(lua_bytes), STATE_TABLE_OFFSET) if isinstance(key, str)]
+    save_data: Dict[str, Any] = {"version": version}
+    for field_name in SAVE_HEADER_FIELDS[1:]:
+        if field_name == "timestamp" and version < 16:
+            continue
+        if field_name in header:
+            save_data[field_name] = header[field_name]
+        else:
+            save_data[field_name] = defaults[field_name]
+            report["lost"].append(f"Header field {field_name}, set to {defaults[field_name]!r}")
+
+    save_data["lua_state"] = compress_lua_state_bytes(version, lua_bytes)
+    report["lua_state_bytes"] = len(lua_bytes)
+    return RawSaveFile(version, save_data), report
+
+
+def recovered_path(path: str) -> str:
+    """Where a recovered save is written by default: Profile1.sav -> Profile1.recovered.sav"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.recovered{extension or '.sav'}"
+
+
+def recover_save_file(path: str, output_path: str, version: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """Recovers the save at path into output_path (unless dry_run), returning the report."""
+    with open(path, "rb") as f:
+        data = f.read()
+    raw_save_file, report = recover_save_bytes(data, version, timestamp=int(os.path.getmtime(path)))
+    if not dry_run:
+        raw_save_file.to_file(output_path)
+    return report
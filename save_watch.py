@@ -0,0 +1,176 @@
+''' Watches a directory of saves and reports what changed in each save as it is rewritten '''
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+from models.lua_state import decompress_lua_state_bytes
+from models.raw_save_file import RawSaveFile
+from run_aggregate import expand_save_paths
+from save_diff import ADDED, REMOVED, diff_headers, diff_lua_state_bytes
+
+ADDED_EVENT = "added"
+CHANGED_EVENT = "changed"
+REMOVED_EVENT = "removed"
+ERROR_EVENT = "error"
+
+# inotify(7) event masks: a save was written and closed, or moved into, out of or around the directory
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+class _WatchedSave:
+    def __init__(self, mtime_ns: int, size: int):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checksum = None
+        self.raw_save_file = None
+        self.lua_bytes = None
+
+
+def _open_inotify(directory: str) -> Optional[int]:
+    # inotify through libc, so no extra dependency is needed; None where it is not available
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class SaveWatcher:
+    """
+    Tracks the saves in a directory and yields an event for each one that changes.
+
+    A scan only stats the files. A save is read again when its mtime or size changed, and only
+    decoded and diffed against its previous version when the checksum of its contents changed
+    too, so idle scans cost one stat per file. Change events list just the header fields and Lua
+    state paths that differ (see save_diff), optionally limited to those under path_filter.
+    """
+
+    def __init__(self, directory: str, path_filter: Optional[str] = None):
+        self.directory = directory
+        self.path_filter = path_filter
+        self.saves: Dict[str, _WatchedSave] = {}
+
+    def _wanted(self, path: str) -> bool:
+        if not self.path_filter:
+            return True
+        return path == self.path_filter or path.startswith(self.path_filter + ".")
+
+    def _event(self, kind: str, path: str, **fields) -> Dict[str, Any]:
+        event = {"time": datetime.now().isoformat(), "event": kind, "file": path}
+        event.update(fields)
+        return event
+
+    def _read(self, path: str, watched: _WatchedSave) -> Optional[Dict[str, Any]]:
+        with open(path, "rb") as f:
+            input_bytes = f.read()
+        metrics.inc(metrics.BYTES_READ, len(input_bytes))
+        checksum = hashlib.blake2b(input_bytes, digest_size=16).hexdigest()
+        if checksum == watched.checksum:
+            return None # Touched, but the contents are the same
+
+        raw_save_file = RawSaveFile.from_bytes(input_bytes)
+        lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+        previous = watched.raw_save_file
+        previous_lua_bytes = watched.lua_bytes
+        watched.checksum = checksum
+        watched.raw_save_file = raw_save_file
+        watched.lua_bytes = lua_bytes
+
+        if previous is None:
+            return self._event(ADDED_EVENT, path, version=raw_save_file.version)
+
+        changes = []
+        entries = list(diff_headers(previous, raw_save_file))
+        entries += diff_lua_state_bytes(previous_lua_bytes, lua_bytes)
+        for kind, entry_path, old_value, new_value in entries:
+            if not self._wanted(entry_path):
+                continue
+            change = {"kind": kind, "path": entry_path}
+            if kind != ADDED:
+                change["old"] = old_value
+            if kind != REMOVED:
+                change["new"] = new_value
+            changes.append(change)
+        if not changes:
+            return None
+        return self._event(CHANGED_EVENT, path, changes=changes)
+
+    def scan(self) -> List[Dict[str, Any]]:
+        """Checks every save in the directory once, returning the events for what changed."""
+        events = []
+        seen = set()
+        for path in expand_save_paths([self.directory]):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen.add(path)
+
+            watched = self.saves.get(path)
+            if watched is not None and watched.mtime_ns == stat.st_mtime_ns and watched.size == stat.st_size:
+                continue
+            if watched is None:
+                watched = self.saves[path] = _WatchedSave(stat.st_mtime_ns, stat.st_size)
+            else:
+                watched.mtime_ns = stat.st_mtime_ns
+                watched.size = stat.st_size
+
+            try:
+                event = self._read(path, watched)
+            except Exception as e:
+                # Most likely caught mid-write: the next write changes mtime or size again
+                event = self._event(ERROR_EVENT, path, error=str(e))
+            if event is not None:
+                events.append(event)
+
+        for path in [path for path in self.saves if path not in seen]:
+            del self.saves[path]
+            events.append(self._event(REMOVED_EVENT, path))
+        return events
+
+    def watch(self, interval: float = 1.0, use_inotify: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Yields events as saves change, forever.
+
+        With inotify the watcher sleeps until the directory changes; otherwise it scans every
+        interval seconds.
+        """
+        inotify_fd = _open_inotify(self.directory) if use_inotify else None
+        try:
+            yield from self.scan()
+            while True:
+                if inotify_fd is not None:
+                    select.select([inotify_fd], [], [])
+                    # Let a burst of writes settle, then read the events just to clear them
+                    time.sleep(min(interval, 0.2))
+                    try:
+                        while os.read(inotify_fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    time.sleep(interval)
+                yield from self.scan()
+        finally:
+            if inotify_fd is not None:
+                os.close(inotify_fd)
@@ -18,7 +18,7 @@ sav14_save_data_schema = Struct(
     ),
     "current_map_name" / PascalString(Int32ul, "utf8"),
     "start_next_map" / PascalString(Int32ul, "utf8"),
-    "lua_state" / PrefixedArray(Int32ul, Byte)
+    "lua_state" / Prefixed(Int32ul, GreedyBytes)
 )
 
 sav14_schema = Struct(
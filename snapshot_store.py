@@ -0,0 +1,214 @@
+''' Content-addressed snapshot store for save backups '''
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import lz4.block
+
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, TABLE_HEADER_SIZE, is_table, iter_entry_spans
+from models.raw_save_file import RawSaveFile
+
+SNAPSHOT_DIR_NAME = ".pluto_snapshots"
+
+
+def default_store_path(save_path: str) -> str:
+    """Snapshots are kept in a hidden directory next to the save they back up."""
+    return os.path.join(os.path.dirname(os.path.abspath(save_path)), SNAPSHOT_DIR_NAME)
+
+
+# Subtrees larger than this are split further, into groups of their entries
+SPLIT_SUBTREE_SIZE = 64 * 1024
+# A group of entries ends after an entry whose encoded key's CRC is a multiple of this, so group
+# boundaries depend only on content and an inserted or changed entry only affects its own group
+GROUP_BOUNDARY_MODULUS = 64
+
+
+def _chunk_table(buf, table_offset: int, group_start: int, depth: int, chunks: List[bytes]) -> int:
+    table_end = table_offset + TABLE_HEADER_SIZE
+    for _, entry_start, value_start, table_end in iter_entry_spans(buf, table_offset):
+        if table_end - entry_start > SPLIT_SUBTREE_SIZE and is_table(buf, value_start):
+            if entry_start > group_start:
+                chunks.append(bytes(buf[group_start:entry_start]))
+            # The key and table header of the subtree open its first group
+            group_start = _chunk_table(buf, value_start, entry_start, depth + 1, chunks)
+        elif depth == 0 or zlib.crc32(buf[entry_start:value_start]) % GROUP_BOUNDARY_MODULUS == 0:
+            # Every top-level subtree (GameState, CurrentRun, ...) is a chunk of its own
+            chunks.append(bytes(buf[group_start:table_end]))
+            group_start = table_end
+
+    if table_end > group_start:
+        chunks.append(bytes(buf[group_start:table_end]))
+    return table_end
+
+
+def _split_lua_stream(lua_bytes: bytes) -> List[bytes]:
+    """
+    Splits a luabins stream into content-defined chunks: one per top-level subtree of the state
+    table, with large subtrees split further into groups of their entries.
+
+    Concatenating the chunks gives back the exact input bytes.
+    """
+    buf = memoryview(lua_bytes)
+    chunks: List[bytes] = []
+    table_end = _chunk_table(buf, STATE_TABLE_OFFSET, 0, 0, chunks)
+    if table_end < len(buf):
+        chunks.append(bytes(buf[table_end:]))
+    return chunks
+
+
+class SnapshotStore:
+    """
+    Stores revisions of save files as manifests over shared, compressed chunks.
+
+    Each chunk of the Lua state (see _split_lua_stream) is stored once under the hash of its
+    content. Snapshots of near-identical revisions therefore only add the chunks that changed
+    plus a small JSON manifest.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+
+    @classmethod
+    def for_save(cls, save_path: str) -> 'SnapshotStore':
+        return cls(default_store_path(save_path))
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _manifest_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.manifests_dir, snapshot_id + ".json")
+
+    def _put_object(self, chunk: bytes) -> (str, int):
+        digest = hashlib.blake2b(chunk, digest_size=20).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = lz4.block.compress(chunk)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(temp_path, path)
+        return digest, len(compressed)
+
+    def _get_object(self, digest: str) -> bytes:
+        with open(self._object_path(digest), "rb") as f:
+            return lz4.block.decompress(f.read())
+
+    def create(self, save_path: str) -> Dict[str, Any]:
+        """Snapshots the save file at save_path and returns its manifest."""
+        raw_save_file = RawSaveFile.from_file(save_path)
+        lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+
+        chunk_digests = []
+        new_bytes = 0
+        for chunk in _split_lua_stream(lua_bytes):
+            digest, stored = self._put_object(chunk)
+            chunk_digests.append(digest)
+            new_bytes += stored
+
+        profile = os.path.basename(save_path)
+        created = datetime.utcnow()
+        manifest = {
+            "id": f"{profile}-{created:%Y%m%dT%H%M%S%f}",
+            "profile": profile,
+            "source": os.path.abspath(save_path),
+            "created": created.isoformat(),
+            "header": raw_save_file.header_fields(),
+            "lua_state_size": len(lua_bytes),
+            "chunks": chunk_digests,
+            "new_bytes": new_bytes,
+        }
+
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        with open(self._manifest_path(manifest["id"]), "w") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    def list(self, profile: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Returns the manifests in the store, oldest first, optionally for one profile only."""
+        if not os.path.isdir(self.manifests_dir):
+            return []
+
+        manifests = []
+        for name in os.listdir(self.manifests_dir):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.manifests_dir, name), "r") as f:
+                manifest = json.load(f)
+            if profile is None or manifest["profile"] == profile:
+                manifests.append(manifest)
+        return sorted(manifests, key=lambda manifest: manifest["created"])
+
+    def load(self, snapshot_id: str) -> Dict[str, Any]:
+        path = self._manifest_path(snapshot_id)
+        if not os.path.exists(path):
+            raise ValueError(f"Unknown snapshot: {snapshot_id}")
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def restore(self, snapshot_id: str, target_path: str) -> Dict[str, Any]:
+        """Rebuilds the save of a snapshot at target_path and returns the snapshot's manifest."""
+        manifest = self.load(snapshot_id)
+        lua_bytes = b"".join(self._get_object(digest) for digest in manifest["chunks"])
+
+        header = manifest["header"]
+        version = header["version"]
+        save_data = dict(header)
+        save_data["lua_state"] = compress_lua_state_bytes(version, lua_bytes)
+
+        RawSaveFile(version, save_data).to_file(target_path)
+        return manifest
+
+    def prune(self, keep: int, profile: Optional[str] = None) -> Dict[str, int]:
+        """
+        Deletes all but the newest `keep` snapshots of each profile, then every chunk that
+        no remaining snapshot refers to.
+        """
+        by_profile: Dict[str, List[Dict[str, Any]]] = {}
+        for manifest in self.list(profile):
+            by_profile.setdefault(manifest["profile"], []).append(manifest)
+
+        removed_snapshots = 0
+        for manifests in by_profile.values():
+            for manifest in manifests[:max(0, len(manifests) - keep)]:
+                os.remove(self._manifest_path(manifest["id"]))
+                removed_snapshots += 1
+
+        referenced = {digest for manifest in self.list() for digest in manifest["chunks"]}
+        removed_objects = 0
+        freed_bytes = 0
+        if os.path.isdir(self.objects_dir):
+            for prefix in os.listdir(self.objects_dir):
+                prefix_dir = os.path.join(self.objects_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    if digest not in referenced:
+                        path = os.path.join(prefix_dir, digest)
+                        freed_bytes += os.path.getsize(path)
+                        os.remove(path)
+                        removed_objects += 1
+
+        return {"snapshots": removed_snapshots, "objects": removed_objects, "bytes": freed_bytes}
+
+    def usage(self, profile: Optional[str] = None) -> Dict[str, int]:
+        """
+        Compares the logical size of the snapshots (their Lua states as full copies) with the
+        bytes the store actually uses for them.
+        """
+        manifests = self.list(profile)
+        digests = {digest for manifest in manifests for digest in manifest["chunks"]}
+        stored_bytes = sum(os.path.getsize(self._object_path(digest)) for digest in digests)
+        stored_bytes += sum(os.path.getsize(self._manifest_path(manifest["id"])) for manifest in manifests)
+        return {
+            "snapshots": len(manifests),
+            "logical_bytes": sum(manifest["lua_state_size"] for manifest in manifests),
+            "stored_bytes": stored_bytes,
+            "objects": len(digests),
+        }
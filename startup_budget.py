@@ -0,0 +1,95 @@
+''' Checks the import time of pluto_cli.py subcommands against a per-subcommand budget '''
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional, Set, Tuple
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pluto_cli.py")
+
+# Import time budget (ms) of read-only subcommands, as measured by `python -X importtime`.
+# Most of it goes to construct, which every command that reads a save needs.
+SUBCOMMAND_BUDGETS_MS: Dict[str, float] = {
+    "--help": 50,
+    "show info": 150,
+    "show currencies": 150,
+    "show boons": 150,
+    "du": 150,
+    "diff {save}": 150,
+    "query GameState.Resources": 150,
+    "search Gems": 150,
+    "snapshot list": 150,
+    "stats": 300,
+}
+
+# Packages only the subcommands that use them may import
+HEAVY_PACKAGES: Dict[str, Set[str]] = {
+    "prompt_toolkit": set(),  # edit_lua only
+    "numpy": {"stats"},
+    "click": set(),
+}
+
+
+def measure_imports(arguments: List[str], cwd: str) -> Tuple[float, Set[str]]:
+    """Runs the CLI once, returning its total import time in ms and the top-level packages it imported."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", CLI_PATH] + arguments,
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    total_us = 0
+    packages = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue # The column header
+        packages.add(name.strip().split(".")[0])
+        if not name.startswith("  "):
+            # Top-level imports; nested ones are included in their parent's cumulative time
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+
+def check_startup_budget(save_path: str, repeat: int = 3) -> List[Dict[str, object]]:
+    """
+    Measures every budgeted subcommand (best of repeat runs) against save_path.
+
+    The commands run in a temporary directory, so files they create there (e.g. the boon
+    catalog) do not touch the working directory.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as cwd:
+        for command, budget_ms in SUBCOMMAND_BUDGETS_MS.items():
+            arguments = ["--file", os.path.abspath(save_path)] + command.format(save=os.path.abspath(save_path)).split()
+            best_ms: Optional[float] = None
+            packages: Set[str] = set()
+            for _ in range(repeat):
+                elapsed_ms, packages = measure_imports(arguments, cwd)
+                best_ms = elapsed_ms if best_ms is None else min(best_ms, elapsed_ms)
+
+            name = command.split()[0]
+            unexpected = sorted(
+                package for package, allowed in HEAVY_PACKAGES.items()
+                if package in packages and name not in allowed
+            )
+            results.append({
+                "command": command.replace("{save}", "SAVE"),
+                "import_ms": best_ms,
+                "budget_ms": budget_ms,
+                "unexpected_packages": unexpected,
+                "ok": best_ms <= budget_ms and not unexpected,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"Usage: python {os.path.basename(__file__)} SAVE [REPEAT]", file=sys.stderr)
+        sys.exit(2)
+    results = check_startup_budget(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    for result in results:
+        status = "ok" if result["ok"] else "OVER BUDGET"
+        extra = f"  imports {', '.join(result['unexpected_packages'])}" if result["unexpected_packages"] else ""
+        print(f"{result['command']:<32} {result['import_ms']:7.1f} ms / {result['budget_ms']:5.0f} ms  {status}{extra}")
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
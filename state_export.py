@@ -0,0 +1,134 @@
+''' Flattens the Lua state of many saves into a SQLite database for ad-hoc SQL queries '''
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+import metrics
+from models.lua_path import join_path
+from models.lua_state import decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, TABLE_START, walk_table
+from models.raw_save_file import RawSaveFile
+from run_aggregate import expand_save_paths, profile_name
+
+# Incremental exports count unchanged saves as hits of this cache in the metrics
+_CACHE_LABELS = (("cache", "export_db"),)
+
+# One row per Lua state entry: (file, profile, dotted path, Lua type, value). Tables get a row
+# of their own with a NULL value, so "has key" questions are answerable too. Booleans are
+# stored as 0/1 and nil as NULL. Example:
+#   SELECT profile, SUM(value) FROM lua_values WHERE path = 'GameState.Resources.GiftPoints' GROUP BY profile
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS files ("
+    " file TEXT PRIMARY KEY,"
+    " profile TEXT NOT NULL,"
+    " checksum TEXT NOT NULL,"
+    " version INTEGER NOT NULL,"
+    " rows INTEGER NOT NULL,"
+    " exported_at TEXT NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS lua_values ("
+    " file TEXT NOT NULL,"
+    " profile TEXT NOT NULL,"
+    " path TEXT NOT NULL,"
+    " type TEXT NOT NULL,"
+    " value"
+    ")",
+    "CREATE INDEX IF NOT EXISTS lua_values_path ON lua_values (path, value)",
+    "CREATE INDEX IF NOT EXISTS lua_values_value ON lua_values (value)",
+    "CREATE INDEX IF NOT EXISTS lua_values_file ON lua_values (file)",
+]
+
+_INSERT_VALUE = "INSERT INTO lua_values (file, profile, path, type, value) VALUES (?, ?, ?, ?, ?)"
+
+
+def file_checksum(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def _lua_type(value: Any) -> Tuple[str, Any]:
+    # Returns the Lua type name and the value as stored in SQLite
+    if value is TABLE_START:
+        return "table", None
+    if value is None:
+        return "nil", None
+    if isinstance(value, bool):
+        return "boolean", int(value)
+    if isinstance(value, float):
+        return "number", value
+    return "string", value
+
+
+def iter_state_rows(lua_bytes: bytes) -> Iterator[Tuple[str, str, Any]]:
+    """Yields (dotted path, Lua type, value) for every entry of a decompressed Lua state, in one pass."""
+    # Sibling entries share their parent path, so its dotted form is only built once
+    joined_parents: Dict[Tuple[Any, ...], str] = {}
+    for parent, key, value in walk_table(memoryview(lua_bytes), STATE_TABLE_OFFSET):
+        joined_parent = joined_parents.get(parent)
+        if joined_parent is None:
+            joined_parent = joined_parents[parent] = join_path(list(parent))
+        path = join_path([key])
+        if joined_parent:
+            path = joined_parent + "." + path
+        value_type, stored_value = _lua_type(value)
+        yield path, value_type, stored_value
+
+
+def export_lua_states(db_path: str, paths: List[str], incremental: bool = True) -> Dict[str, Any]:
+    """
+    Exports the Lua state of every save (directories are expanded) into the database at db_path.
+
+    When incremental, a save whose checksum matches the one recorded at its last export is
+    skipped; a changed save has its rows replaced. Everything is written in one transaction.
+
+    :return: {"exported": [paths], "skipped": [paths], "errors": {path: message}, "rows": int, "seconds": float}
+    """
+    start = time.perf_counter()
+    connection = sqlite3.connect(db_path)
+    result = {"exported": [], "skipped": [], "errors": {}, "rows": 0}
+    try:
+        for statement in _SCHEMA:
+            connection.execute(statement)
+
+        with connection:
+            for path in expand_save_paths(paths):
+                file_key = os.path.abspath(path)
+                try:
+                    checksum = file_checksum(path)
+                    if incremental:
+                        row = connection.execute("SELECT checksum FROM files WHERE file = ?", (file_key,)).fetchone()
+                        if row is not None and row[0] == checksum:
+                            metrics.inc(metrics.CACHE_HITS, labels=_CACHE_LABELS)
+                            result["skipped"].append(path)
+                            continue
+                        metrics.inc(metrics.CACHE_MISSES, labels=_CACHE_LABELS)
+
+                    raw_save_file = RawSaveFile.from_file(path)
+                    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+                except Exception as e:
+                    result["errors"][path] = str(e)
+                    continue
+
+                profile = profile_name(path)
+                connection.execute("DELETE FROM lua_values WHERE file = ?", (file_key,))
+                before = connection.total_changes
+                connection.executemany(
+                    _INSERT_VALUE,
+                    ((file_key, profile, entry_path, value_type, value)
+                     for entry_path, value_type, value in iter_state_rows(lua_bytes))
+                )
+                rows = connection.total_changes - before
+                connection.execute(
+                    "INSERT OR REPLACE INTO files (file, profile, checksum, version, rows, exported_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_key, profile, checksum, raw_save_file.version, rows, datetime.now().isoformat())
+                )
+                result["exported"].append(path)
+                result["rows"] += rows
+    finally:
+        connection.close()
+
+    result["seconds"] = time.perf_counter() - start
+    return result
@@ -0,0 +1,150 @@
+''' Inverted index over the key names and string values of a Lua state '''
+import bisect
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+from models.lazy_lua_table import LazyLuaTable
+from models.lua_path import join_path
+from models.lua_state import decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, walk_table
+from models.raw_save_file import RawSaveFile
+
+# On request (search --cache), the index is persisted next to the save and reused while the
+# save's Lua state is unchanged
+INDEX_FILE_SUFFIX = ".search.json"
+_CACHE_LABELS = (("cache", "search_index"),)
+
+
+def index_cache_path(save_path: str) -> str:
+    return save_path + INDEX_FILE_SUFFIX
+
+
+def _iter_stream_terms(buf, offset: int, prefix: Tuple[Any, ...] = ()) -> Iterator[Tuple[str, Tuple[Any, ...]]]:
+    for path, key, value in walk_table(buf, offset):
+        entry_path = prefix + path + (key,)
+        if isinstance(key, str):
+            yield key, entry_path
+        if isinstance(value, str):
+            yield value, entry_path
+
+
+def _iter_table_terms(table, path: Tuple[Any, ...] = ()) -> Iterator[Tuple[str, Tuple[Any, ...]]]:
+    items = table.items() if isinstance(table, dict) else enumerate(table)
+    for key, value in items:
+        entry_path = path + (key,)
+        if isinstance(key, str):
+            yield key, entry_path
+        if isinstance(value, str):
+            yield value, entry_path
+        elif isinstance(value, LazyLuaTable):
+            # Not decoded yet: walk its bytes instead of decoding it
+            yield from _iter_stream_terms(value.buf, value.offset, entry_path)
+        elif isinstance(value, (dict, list)):
+            yield from _iter_table_terms(value, entry_path)
+
+
+class StateIndex:
+    """
+    Maps every key name and string value of a Lua state to the dotted paths it occurs at.
+
+    Lookups are case-insensitive. Prefix queries bisect a sorted list of the distinct terms;
+    substring queries scan that list, which is far shorter than the number of paths.
+    """
+
+    def __init__(self, terms: Dict[str, List[str]], source_hash: Optional[str] = None):
+        self.terms = terms
+        self.source_hash = source_hash
+        self._sorted_terms = sorted((term.lower(), term) for term in terms)
+        self._sorted_keys = [lowered for lowered, _ in self._sorted_terms]
+
+    @classmethod
+    def _from_term_paths(cls, term_paths: Iterator[Tuple[str, Tuple[Any, ...]]], source_hash=None) -> 'StateIndex':
+        terms: Dict[str, List[str]] = {}
+        # Sibling entries share their parent path, so its dotted form is only built once
+        joined_parents: Dict[Tuple[Any, ...], str] = {}
+        for term, path in term_paths:
+            parent = path[:-1]
+            joined_parent = joined_parents.get(parent)
+            if joined_parent is None:
+                joined_parent = joined_parents[parent] = join_path(list(parent))
+            dotted_path = join_path([path[-1]])
+            if joined_parent:
+                dotted_path = joined_parent + "." + dotted_path
+            terms.setdefault(term, []).append(dotted_path)
+        return cls(terms, source_hash)
+
+    @classmethod
+    def from_lua_bytes(cls, lua_bytes: bytes, source_hash: Optional[str] = None) -> 'StateIndex':
+        """Builds the index in one pass over a decompressed luabins stream."""
+        return cls._from_term_paths(_iter_stream_terms(memoryview(lua_bytes), STATE_TABLE_OFFSET), source_hash)
+
+    @classmethod
+    def from_table(cls, table) -> 'StateIndex':
+        """Builds the index from a decoded state, which may contain LazyLuaTable placeholders."""
+        return cls._from_term_paths(_iter_table_terms(table))
+
+    def search(self, query: str, prefix: bool = False, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """
+        Returns (term, path) for every term containing query (or starting with it, if prefix
+        is set), ordered by term and then by path.
+        """
+        query = query.lower()
+        if prefix:
+            start = bisect.bisect_left(self._sorted_keys, query)
+            matches = []
+            for lowered, term in self._sorted_terms[start:]:
+                if not lowered.startswith(query):
+                    break
+                matches.append(term)
+        else:
+            matches = [term for lowered, term in self._sorted_terms if query in lowered]
+
+        results = []
+        for term in matches:
+            for path in self.terms[term]:
+                results.append((term, path))
+                if limit is not None and len(results) >= limit:
+                    return results
+        return results
+
+    def to_file(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"source_hash": self.source_hash, "terms": self.terms}, f)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'StateIndex':
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["terms"], data["source_hash"])
+
+
+def load_state_index(save_path: str, use_cache: bool = False) -> Tuple[StateIndex, bool]:
+    """
+    Returns the index of a save and whether it came from the persisted cache.
+
+    With use_cache, the index is read from and written to <save>.search.json. The cache is keyed
+    by a hash of the save's stored Lua state, so it is rebuilt and rewritten whenever the save
+    changes. Without it, nothing is written next to the save.
+    """
+    raw_save_file = RawSaveFile.from_file(save_path)
+    lua_state_bytes = bytes(raw_save_file.lua_state_bytes)
+    source_hash = hashlib.blake2b(lua_state_bytes, digest_size=16).hexdigest()
+
+    cache_path = index_cache_path(save_path)
+    if use_cache and os.path.exists(cache_path):
+        try:
+            index = StateIndex.from_file(cache_path)
+            if index.source_hash == source_hash:
+                metrics.inc(metrics.CACHE_HITS, labels=_CACHE_LABELS)
+                return index, True
+        except (ValueError, KeyError):
+            pass # Unreadable cache, rebuild it
+    metrics.inc(metrics.CACHE_MISSES, labels=_CACHE_LABELS)
+
+    index = StateIndex.from_lua_bytes(decompress_lua_state_bytes(raw_save_file.version, lua_state_bytes), source_hash)
+    if use_cache:
+        index.to_file(cache_path)
+    return index, False
@@ -0,0 +1,179 @@
+''' Dumps and loads the Lua state (or one subtree of it) as JSON or a compact binary format '''
+import json
+import re
+import struct
+import sys
+import time
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from luabins import decode_luabins, encode_luabins
+
+from models.lua_path import format_key, split_path
+from models.lua_state import compress_lua_state_bytes, decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, is_table, iter_table, read_value, skip_value
+from models.raw_save_file import RawSaveFile, SAVE_HEADER_FIELDS
+
+JSON_FORMAT = "json"
+BINARY_FORMAT = "binary"
+FORMATS = [JSON_FORMAT, BINARY_FORMAT]
+
+# Binary files are the magic, a length-prefixed JSON object with the save header and the path
+# of the dumped subtree (null for the whole state), then the value as raw luabins bytes. Those
+# bytes are copied straight out of (and back into) the save's stream, so a dump and load never
+# decode or re-encode the Lua state, and every Lua type and number key is kept as it is.
+BINARY_MAGIC = b"PLUTOLB1"
+_META_LENGTH = struct.Struct("<I")
+
+# How json.dumps writes a number key ("3", "1.0", "-2.5", "1e+20")
+_NUMBER_KEY = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?")
+
+
+def format_from_filename(path: str) -> str:
+    """JSON for .json files, the binary format for anything else."""
+    return JSON_FORMAT if path.lower().endswith(".json") else BINARY_FORMAT
+
+
+def _find_subtree(buf, path: str) -> Tuple[int, int]:
+    """Returns the (start, end) offsets of the encoded value at a dotted path of the state."""
+    offset = STATE_TABLE_OFFSET
+    for component in split_path(path):
+        if not is_table(buf, offset):
+            raise ValueError(f"Path not found in the Lua state: {path}")
+        for key, value_offset in iter_table(buf, offset):
+            if format_key(key) == component:
+                offset = value_offset
+                break
+        else:
+            raise ValueError(f"Path not found in the Lua state: {path}")
+    return offset, skip_value(buf, offset)
+
+
+def _check_stream(lua_bytes: bytes):
+    # A state must be a complete luabins stream: a value count followed by exactly that many values
+    buf = memoryview(lua_bytes)
+    offset = STATE_TABLE_OFFSET
+    for _ in range(buf[0]):
+        offset = skip_value(buf, offset)
+    if offset != len(buf):
+        raise ValueError(f"Unexpected data after the end of the Lua state at offset {offset}")
+
+
+def dump_lua_state(raw_save_file: RawSaveFile, file_format: str, path: Optional[str] = None) -> bytes:
+    """
+    Returns the contents of a dump of the save's Lua state, or of the subtree at path.
+
+    JSON dumps of the whole state keep the layout edit_raw has always used (the header fields
+    plus "lua_state"); subtree dumps are {"version", "path", "value"}.
+    """
+    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+    header = raw_save_file.header_fields()
+
+    if file_format == BINARY_FORMAT:
+        if path:
+            start, end = _find_subtree(memoryview(lua_bytes), path)
+            payload = lua_bytes[start:end]
+        else:
+            payload = lua_bytes
+        meta = json.dumps({"header": header, "path": path or None}).encode("utf-8")
+        return BINARY_MAGIC + _META_LENGTH.pack(len(meta)) + meta + payload
+
+    if path:
+        start, _ = _find_subtree(memoryview(lua_bytes), path)
+        document = {"version": raw_save_file.version, "path": path, "value": read_value(memoryview(lua_bytes), start)[0]}
+    else:
+        document = dict(header)
+        document["lua_state"] = decode_luabins(BytesIO(lua_bytes))
+    return json.dumps(document, indent=2, default=str).encode("utf-8")
+
+
+def _restore_number_keys(value: Any) -> Any:
+    # JSON object keys are strings, so json.dumps turned Lua number keys (RunHistory's 1.0, 2.0, ...)
+    # into "1.0", "2.0"; keys spelled as numbers become numbers again
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if isinstance(key, str) and _NUMBER_KEY.fullmatch(key):
+                key = float(key)
+            result[key] = _restore_number_keys(item)
+        return result
+    if isinstance(value, list):
+        return [_restore_number_keys(item) for item in value]
+    return value
+
+
+def _read_dump(data: bytes) -> Tuple[Dict[str, Any], Optional[str], bytes]:
+    # Returns (header fields, subtree path or None, luabins bytes) from either format
+    if data.startswith(BINARY_MAGIC):
+        offset = len(BINARY_MAGIC)
+        meta_length = _META_LENGTH.unpack_from(data, offset)[0]
+        offset += _META_LENGTH.size
+        meta = json.loads(data[offset:offset + meta_length].decode("utf-8"))
+        return meta["header"], meta["path"], data[offset + meta_length:]
+
+    document = json.loads(data.decode("utf-8"))
+    if "path" in document and "value" in document:
+        # encode_luabins prefixes the value count, which a subtree does not have
+        value = _restore_number_keys(document["value"])
+        return {"version": document["version"]}, document["path"], encode_luabins([value])[1:]
+    header = {key: value for key, value in document.items() if key != "lua_state"}
+    return header, None, encode_luabins(_restore_number_keys(document["lua_state"]))
+
+
+def load_lua_state(raw_save_file: RawSaveFile, data: bytes) -> Optional[str]:
+    """
+    Replaces the save's Lua state (or the subtree a dump was taken from) with a dump's contents.
+
+    Whole-state dumps also update the header fields. The format is detected from the data.
+    Raises ValueError if the dump does not fit the save.
+
+    :return: The path of the replaced subtree, or None for the whole state
+    """
+    header, path, payload = _read_dump(data)
+    if header.get("version", raw_save_file.version) != raw_save_file.version:
+        raise ValueError(
+            f"The dump is of a version {header['version']} save, but the save is version {raw_save_file.version}"
+        )
+
+    if path:
+        if skip_value(memoryview(payload), 0) != len(payload):
+            raise ValueError("Unexpected data after the end of the dumped value")
+        lua_bytes = decompress_lua_state_bytes(raw_save_file.version, bytes(raw_save_file.lua_state_bytes))
+        start, end = _find_subtree(memoryview(lua_bytes), path)
+        lua_bytes = lua_bytes[:start] + payload + lua_bytes[end:]
+    else:
+        _check_stream(payload)
+        lua_bytes = payload
+        for field_name in SAVE_HEADER_FIELDS:
+            if field_name in header and field_name != "version" and field_name in raw_save_file.save_data:
+                raw_save_file.save_data[field_name] = header[field_name]
+
+    lua_state_bytes = compress_lua_state_bytes(raw_save_file.version, bytes(lua_bytes))
+    raw_save_file.save_data["lua_state"] = lua_state_bytes
+    raw_save_file.lua_state_bytes = lua_state_bytes
+    return path or None
+
+
+def benchmark_formats(save_path: str, path: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """Times a dump and a load of the save (or a subtree) in each format."""
+    results = {}
+    for file_format in FORMATS:
+        raw_save_file = RawSaveFile.from_file(save_path)
+        start = time.perf_counter()
+        data = dump_lua_state(raw_save_file, file_format, path)
+        dump_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_lua_state(raw_save_file, data)
+        load_seconds = time.perf_counter() - start
+        results[file_format] = {"size": len(data), "dump_seconds": dump_seconds, "load_seconds": load_seconds}
+    return results
+
+
+if __name__ == '__main__' and '--benchmark' in sys.argv:
+    arguments = sys.argv[sys.argv.index('--benchmark') + 1:]
+    result = benchmark_formats(arguments[0], arguments[1] if len(arguments) > 1 else None)
+    print(f"Dump and load of {arguments[0]}" + (f" ({arguments[1]})" if len(arguments) > 1 else "") + ":")
+    for file_format, timings in result.items():
+        print(f"  {file_format:>6}: {timings['size'] / 1024:10.1f} KiB  dump {timings['dump_seconds'] * 1000:8.1f} ms"
+              f"  load {timings['load_seconds'] * 1000:8.1f} ms")
@@ -0,0 +1,264 @@
+''' Applies many path-based edits to the Lua state in a single traversal '''
+import copy
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from models.lua_path import resolve_key, split_path
+from models.path_rules import (
+    WILDCARD, RuleNode, build_rule_trie, check_rule_fields, load_rule_file, matching_nodes, split_rule_argument
+)
+
+# A rule is a dotted path pattern ("*" matches any key at one level) and an action, a function
+# from the matched value to its new value. Rules are compiled into the trie of
+# models.path_rules, so one traversal of the state applies all of them: it only descends where
+# some rule can still match and looks keys up directly where no rule has a wildcard.
+#
+# A rule with a default also applies where the last key of its path is missing (the tables
+# above it must exist), as if the key held the default. Actions may return REMOVE to delete
+# the matched key.
+
+REMOVE = object()
+_MISSING = object()
+
+# Rule files hold a list of objects with a "path" and one action:
+#   {"path": "GameState.Resources.Gems", "set": 500}             replace the value
+#   {"path": "GameState.Resources.*", "cap": 9999}               lower numbers above the cap
+#   {"path": "CurrentRun.TextLinesRecord", "clear": true}         replace with an empty table
+#   {"path": "GameState.Flags.SomeFlag", "remove": true}          delete the key
+# "set" and "clear" also create the key where it is missing unless "create" is false.
+SET = "set"
+CAP = "cap"
+CLEAR = "clear"
+REMOVE_ACTION = "remove"
+_ACTIONS = (SET, CAP, CLEAR, REMOVE_ACTION)
+
+
+def set_to(value: Any) -> Callable[[Any], Any]:
+    # Tables are copied for every match so matches never share one table
+    if isinstance(value, dict):
+        return lambda _: copy.deepcopy(value)
+    return lambda _: value
+
+
+def clear_table(_) -> Dict[Any, Any]:
+    return {}
+
+
+def cap_at(maximum: float) -> Callable[[Any], Any]:
+    def cap(value):
+        if isinstance(value, float) and value > maximum:
+            return float(maximum)
+        return value
+    return cap
+
+
+def remove_key(_):
+    return REMOVE
+
+
+class TransformRule:
+    def __init__(self, path: str, action: Callable[[Any], Any], default: Any = _MISSING, name: Optional[str] = None):
+        self.path = path
+        self.components = split_path(path)
+        if not self.components:
+            raise ValueError("A rule needs a path")
+        if default is not _MISSING and self.components[-1] == WILDCARD:
+            raise ValueError(f"A rule ending in '{WILDCARD}' cannot create missing keys ({path})")
+        self.action = action
+        self.default = default
+        self.name = name or path
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TransformRule':
+        check_rule_fields(data, ("create", *_ACTIONS))
+        actions = [action for action in _ACTIONS if action in data]
+        if len(actions) != 1:
+            raise ValueError(f"A rule needs exactly one of {', '.join(_ACTIONS)} in {data!r}")
+
+        path, action = data["path"], actions[0]
+        create = data.get("create", True)
+        if action == SET:
+            value = _lua_value(data[SET])
+            return cls(path, set_to(value), default=None if create else _MISSING, name=f"{path} = {data[SET]!r}")
+        if action == CAP:
+            maximum = data[CAP]
+            if isinstance(maximum, bool) or not isinstance(maximum, (int, float)):
+                raise ValueError(f"'{CAP}' must be a number in {data!r}")
+            return cls(path, cap_at(maximum), name=f"{path} <= {maximum}")
+        if action == CLEAR:
+            return cls(path, clear_table, default={} if create else _MISSING, name=f"{path} = {{}}")
+        return cls(path, remove_key, name=f"remove {path}")
+
+
+def _lua_value(value: Any) -> Any:
+    # Lua numbers are floats; JSON arrays become tables with number keys starting at 1
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, list):
+        return {float(index): _lua_value(item) for index, item in enumerate(value, 1)}
+    if isinstance(value, dict):
+        return {key: _lua_value(item) for key, item in value.items()}
+    return value
+
+
+def parse_rule_argument(text: str, kind: str) -> TransformRule:
+    """Parses a command line rule: PATH=VALUE (set), PATH=N (cap), or PATH (clear, remove)."""
+    from lua_query import parse_literal
+    if kind in (CLEAR, REMOVE_ACTION):
+        return TransformRule.from_dict({"path": text, kind: True, **_create_for(text, kind)})
+    path, argument = split_rule_argument(text, "VALUE" if kind == SET else "N")
+    value = parse_literal(argument)
+    if kind == CAP and not isinstance(value, float):
+        raise ValueError(f"Expected a number after '=' in '{text}'")
+    return TransformRule.from_dict({"path": path, kind: value, **_create_for(path, kind)})
+
+
+def _create_for(path: str, kind: str) -> Dict[str, bool]:
+    # Command line rules create missing keys unless their path ends in a wildcard
+    if kind in (SET, CLEAR):
+        return {"create": split_path(path)[-1:] != [WILDCARD]}
+    return {}
+
+
+def load_rules(path: str) -> List[TransformRule]:
+    """Reads a JSON file holding a list of rule objects."""
+    return load_rule_file(path, TransformRule.from_dict)
+
+
+class TransformEngine:
+    """
+    Rules compiled into a dispatch trie, applied together in one traversal of a state table.
+
+    Rules on the same value run in registration order, each seeing the previous one's result,
+    and rules below a value see the value left by the rules on it.
+    """
+
+    def __init__(self, rules: List[TransformRule]):
+        self.rules = list(rules)
+        self.root = build_rule_trie(self.rules)
+
+    def apply(self, state: Dict[Any, Any]) -> List[int]:
+        """Applies every rule to the state in place, returning the number of matches per rule."""
+        counts = {id(rule): 0 for rule in self.rules}
+        self._apply(state, [self.root], counts)
+        return [counts[id(rule)] for rule in self.rules]
+
+    def _apply(self, table: Dict[Any, Any], nodes: List[RuleNode], counts: Dict[int, int]):
+        # Every key if some rule has a wildcard here, plus the named keys (which may be missing)
+        keys = list(table.keys()) if any(WILDCARD in node.children for node in nodes) else []
+        seen = set(keys)
+        for node in nodes:
+            for component in node.children:
+                if component == WILDCARD:
+                    continue
+                key = resolve_key(table, component)
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+
+        for key in keys:
+            child_nodes = matching_nodes(nodes, key)
+            value = table.get(key, _MISSING)
+
+            for node in child_nodes:
+                for rule in node.rules:
+                    if value is _MISSING:
+                        if rule.default is _MISSING:
+                            continue
+                        value = copy.deepcopy(rule.default)
+                    value = rule.action(value)
+                    counts[id(rule)] += 1
+                    if value is REMOVE:
+                        break
+                if value is REMOVE:
+                    break
+
+            if value is REMOVE:
+                table.pop(key, None)
+                continue
+            if value is _MISSING:
+                continue
+            table[key] = value
+            if isinstance(value, dict):
+                deeper = [node for node in child_nodes if node.children]
+                if deeper:
+                    self._apply(value, deeper, counts)
+
+
+def apply_rules(state: Dict[Any, Any], rules: List[TransformRule]) -> List[Dict[str, Any]]:
+    """Applies rules to a state in one traversal, returning [{"rule", "matches"}] in rule order."""
+    counts = TransformEngine(rules).apply(state)
+    return [{"rule": str(rule), "matches": count} for rule, count in zip(rules, counts)]
+
+
+# Per-run fields reset by the wildcard part of the benchmark
+_BENCHMARK_RUN_FIELDS = ["ShrinePointsCache", "BonusDarkness", "NumRerolls"]
+
+
+def benchmark_rules(save_path: str, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """
+    Times two jobs done one edit at a time and as one rule set, on fresh copies of the save's
+    state (best of repeat runs):
+
+    - "fixed paths": the NPC gift reset plus an update of every currency, one LuaState
+      property at a time
+    - "run history": resetting a few fields of every run, one path query ("set") at a time
+    """
+    from core_logic import CURRENCY_FIELDS, NPC_GIFT_PROPERTIES, reset_npc_gifts_rules, update_field_rules
+    from lua_query import compile_query
+    from models.save_file import HadesSaveFile
+
+    save_file = HadesSaveFile.from_file(save_path)
+    lua_state = save_file.lua_state
+    original = lua_state._active_state
+
+    def properties_one_at_a_time(state):
+        lua_state._active_state = state
+        for name in NPC_GIFT_PROPERTIES:
+            setattr(lua_state, name, {})
+        for name in CURRENCY_FIELDS.values():
+            setattr(lua_state, name, 100.0)
+
+    fixed_rules = reset_npc_gifts_rules()
+    for field in CURRENCY_FIELDS:
+        fixed_rules += update_field_rules(field, "100")
+
+    run_paths = [f"GameState.RunHistory.*.{field}" for field in _BENCHMARK_RUN_FIELDS]
+    queries = [compile_query(path) for path in run_paths]
+
+    def queries_one_at_a_time(state):
+        for query in queries:
+            query.set(state, 0.0)
+
+    jobs = {
+        "fixed paths": (properties_one_at_a_time, TransformEngine(fixed_rules).apply),
+        "run history": (queries_one_at_a_time, TransformEngine([TransformRule(path, set_to(0.0)) for path in run_paths]).apply),
+    }
+    results = {}
+    for job, runs in jobs.items():
+        results[job] = {}
+        for name, run in zip(("one at a time", "rule set"), runs):
+            best = None
+            for _ in range(repeat):
+                state = copy.deepcopy(original)
+                start = time.perf_counter()
+                run(state)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[job][name] = best
+    return results
+
+
+if __name__ == '__main__' and '--benchmark' in sys.argv:
+    arguments = sys.argv[sys.argv.index('--benchmark') + 1:]
+    result = benchmark_rules(arguments[0], int(arguments[1]) if len(arguments) > 1 else 5)
+    print(f"Transforms of {arguments[0]}:")
+    for job, timings in result.items():
+        print(f"  {job:>11}: one at a time {timings['one at a time'] * 1000:8.3f} ms"
+              f"  rule set {timings['rule set'] * 1000:8.3f} ms")
@@ -0,0 +1,151 @@
+''' Per-subtree accounting of the bytes a save's Lua state takes, raw and compressed '''
+from typing import Any, Dict, List, Optional
+
+import lz4.block
+
+from constant import SAVE_DATA_V14_LENGTH, SAVE_DATA_V15_LENGTH, SAVE_DATA_V16_LENGTH
+from models.lua_path import join_path
+from models.lua_state import decompress_lua_state_bytes
+from models.luabins_stream import STATE_TABLE_OFFSET, is_table, read_key, read_table_header, skip_value, table_size
+from models.raw_save_file import RawSaveFile
+
+# Size of the fixed region holding the header fields and the (compressed) Lua state
+SAVE_DATA_LENGTHS = {14: SAVE_DATA_V14_LENGTH, 15: SAVE_DATA_V15_LENGTH, 16: SAVE_DATA_V16_LENGTH}
+
+
+class UsageNode:
+    """
+    One entry of the state: its dotted path and the bytes its key and value take in the stream.
+
+    children is only filled for tables above the depth limit; deeper tables are counted as a
+    whole in their ancestor.
+    """
+
+    def __init__(self, key: Any, path: List[Any], start: int):
+        self.key = key
+        self.path = path
+        self.start = start
+        self.end = start
+        self.entries: Optional[int] = None
+        self.children: List['UsageNode'] = []
+        self.compressed: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def to_dict(self, total: int, compressed_total: int) -> Dict[str, Any]:
+        result = {
+            "path": join_path(self.path),
+            "bytes": self.size,
+            "share": self.size / total if total else 0.0,
+        }
+        if self.compressed is not None:
+            result["compressed_bytes"] = self.compressed
+            result["compressed_share"] = self.compressed / compressed_total if compressed_total else 0.0
+        if self.entries is not None:
+            result["entries"] = self.entries
+        if self.children:
+            result["children"] = [child.to_dict(total, compressed_total) for child in self.children]
+        return result
+
+
+def measure_tree(lua_bytes: bytes, max_depth: int) -> UsageNode:
+    """
+    Builds the usage tree of a decompressed state down to max_depth, in one pass over the stream.
+
+    Tables within the depth limit are walked entry by entry; anything deeper is skipped over in
+    one go, so every byte of the stream is visited once.
+    """
+    root = UsageNode(None, [], STATE_TABLE_OFFSET)
+    root.end = _measure_table(memoryview(lua_bytes), root, STATE_TABLE_OFFSET, max_depth)
+    return root
+
+
+def _measure_table(buf, node: UsageNode, offset: int, max_depth: int) -> int:
+    # Adds the entries of the table at offset (the value of node) to node, returning its end
+    array_size, hash_size, position = read_table_header(buf, offset)
+    node.entries = array_size + hash_size
+    for _ in range(node.entries):
+        key, value_offset = read_key(buf, position)
+        child = UsageNode(key, node.path + [key], position)
+        node.children.append(child)
+        if is_table(buf, value_offset) and len(child.path) < max_depth:
+            child.end = _measure_table(buf, child, value_offset, max_depth)
+        else:
+            if is_table(buf, value_offset):
+                child.entries = table_size(buf, value_offset)
+            child.end = skip_value(buf, value_offset)
+        position = child.end
+    node.children.sort(key=lambda child: child.size, reverse=True)
+    return position
+
+
+def _estimate_compressed(node: UsageNode, buf, max_depth: int):
+    # LZ4 only refers back 64 KiB, so compressing a subtree on its own comes close to what it
+    # adds to the compressed stream; small subtrees are overestimated somewhat
+    for child in node.children:
+        child.compressed = len(lz4.block.compress(buf[child.start:child.end], store_size=False))
+        if len(child.path) < max_depth:
+            _estimate_compressed(child, buf, max_depth)
+
+
+def lua_state_usage(raw_save_file: RawSaveFile, max_depth: int = 2) -> Dict[str, Any]:
+    """
+    Returns the byte usage of a save's Lua state: totals, and a tree of the subtrees down to
+    max_depth, each sorted by size (largest first).
+    """
+    stored = bytes(raw_save_file.lua_state_bytes)
+    lua_bytes = decompress_lua_state_bytes(raw_save_file.version, stored)
+    root = measure_tree(lua_bytes, max_depth)
+
+    # Version 14 saves are not compressed, but the estimate still shows what compresses well
+    compressed_total = len(stored) if raw_save_file.version > 14 else len(lz4.block.compress(lua_bytes, store_size=False))
+    _estimate_compressed(root, memoryview(lua_bytes), max_depth)
+
+    return {
+        "version": raw_save_file.version,
+        "bytes": len(lua_bytes),
+        "stored_bytes": len(stored),
+        "compressed_bytes": compressed_total,
+        "save_data_length": SAVE_DATA_LENGTHS.get(raw_save_file.version),
+        "max_depth": max_depth,
+        "tree": [child.to_dict(len(lua_bytes), compressed_total) for child in root.children],
+    }
+
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024 or unit == "MiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_usage(usage: Dict[str, Any], limit: Optional[int] = None) -> List[str]:
+    """Renders lua_state_usage as indented lines, showing at most limit children per table."""
+    lines = [
+        f"Lua state: {format_bytes(usage['bytes'])} uncompressed, "
+        f"{format_bytes(usage['compressed_bytes'])} compressed, "
+        f"stored as {format_bytes(usage['stored_bytes'])}"
+        + (f" of a {format_bytes(usage['save_data_length'])} save region "
+           f"({usage['stored_bytes'] / usage['save_data_length']:.1%})" if usage["save_data_length"] else "")
+    ]
+
+    def add_lines(nodes: List[Dict[str, Any]], depth: int):
+        shown = nodes if limit is None else nodes[:limit]
+        for node in shown:
+            compressed = ""
+            if "compressed_bytes" in node:
+                compressed = f"  ~{format_bytes(node['compressed_bytes']):>10} ({node['compressed_share']:6.1%})"
+            entries = f"  [{node['entries']} entries]" if "entries" in node else ""
+            lines.append(
+                f"{format_bytes(node['bytes']):>10} ({node['share']:6.1%}){compressed}  "
+                f"{'  ' * depth}{node['path']}{entries}"
+            )
+            add_lines(node.get("children", []), depth + 1)
+        if len(nodes) > len(shown):
+            rest = sum(node["bytes"] for node in nodes[len(shown):])
+            lines.append(f"{format_bytes(rest):>10}{' ' * 33}{'  ' * depth}... {len(nodes) - len(shown)} more")
+
+    add_lines(usage["tree"], 0)
+    return lines
@@ -0,0 +1,60 @@
+''' Quiet, structured progress logging for the core modules '''
+import json
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Dict
+
+# Progress messages ("Loading ...", "Saving to ...") are logged at INFO under the "pluto" logger,
+# with their details as fields instead of being formatted into the message:
+#
+#   logger.info("Saving", extra={"fields": {"path": target_path}})
+#
+# Nothing below WARNING is shown unless configure_logging() is called (the CLI's --verbose),
+# so command output stays clean. Warnings reach stderr either way, through logging's
+# last-resort handler.
+ROOT_LOGGER = "pluto"
+TEXT = "text"
+JSON = "json"
+LOG_FORMATS = [TEXT, JSON]
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return getattr(record, "fields", None) or {}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """level logger: message key=value ..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in _fields(record).items())
+        line = f"{record.levelname.lower()} {record.name}: {record.getMessage()}"
+        return f"{line} {fields}" if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: int = logging.INFO, log_format: str = TEXT):
+    """Sends pluto's log records at level and above to stderr in the given format."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == JSON else KeyValueFormatter())
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
@@ -9,4 +9,4 @@ def load_data_file_as_binary(filename):
 
 
 def get_path_to_data_file(filename):
-    return os.path.join(os.path.basename(data.__path__[0]), filename)
+    return os.path.join(data.__path__[0], filename)